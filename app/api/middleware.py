@@ -0,0 +1,19 @@
+from app.data_loader import data_manager
+
+"""
+middleware.py
+Pins one dataset per request, so a data reload that happens while a request
+is running cannot mix old and new farmers / parcels / indices in its answer
+"""
+
+
+class PinDatasetMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with data_manager.pinned():
+            await self.app(scope, receive, send)
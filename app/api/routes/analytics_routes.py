@@ -0,0 +1,64 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from app.data_loader.timeseries import METRICS
+from app.services import analytics_service
+from app.services.parcel_summary_service import LEVEL_NAMES
+
+"""
+analytics_routes.py
+Read-only dashboard API over the precomputed portfolio aggregates
+"""
+
+router = APIRouter(prefix="/analytics")
+
+
+@router.get("/summary")
+def analytics_summary():
+    """
+    Aggregates across all farmers
+    """
+
+    return analytics_service.portfolio()
+
+
+@router.get("/farmers")
+def analytics_farmers(offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """
+    Aggregates per farmer, ordered by farmer id
+    """
+
+    return {"offset": offset, "farmers": analytics_service.farmers(offset, limit)}
+
+
+@router.get("/farmers/{farmer_id}")
+def analytics_farmer(farmer_id: str):
+    res = analytics_service.farmer(farmer_id)
+    if res is None:
+        raise HTTPException(status_code=404, detail="Farmer has no parcels")
+    return res
+
+
+@router.get("/parcels")
+def analytics_parcels(
+        ndvi: list[str] = Query(None), ndmi: list[str] = Query(None), ndwi: list[str] = Query(None),
+        soc: list[str] = Query(None), nitrogen: list[str] = Query(None), phosphorus: list[str] = Query(None),
+        potassium: list[str] = Query(None), ph: list[str] = Query(None),
+        match: str = Query("any", pattern="^(any|all)$"), farmer_id: str | None = None):
+    """
+    Parcels whose latest observation is in the given levels, e.g.
+    /analytics/parcels?ndvi=poor&nitrogen=low  (poor vegetation OR nitrogen needed)
+    """
+
+    given = dict(zip(METRICS, (ndvi, ndmi, ndwi, soc, nitrogen, phosphorus, potassium, ph)))
+    conditions = {m: names for m, names in given.items() if names}
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Give at least one metric filter")
+
+    for m, names in conditions.items():
+        unknown = [n for n in names if n not in LEVEL_NAMES[m]]
+        if unknown:
+            raise HTTPException(status_code=400,
+                                detail=f"Unknown {m} level {unknown}, expected one of {list(LEVEL_NAMES[m])}")
+
+    parcel_ids = analytics_service.parcels_matching(conditions, match == "all", farmer_id)
+    return {"count": len(parcel_ids), "parcels": parcel_ids}
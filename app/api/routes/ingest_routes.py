@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Request
+
+from app.services.ingestion_service import IngestBatch
+
+"""
+ingest_routes.py
+Bulk ingestion of new parcel index observations (NDJSON body)
+"""
+
+router = APIRouter()
+
+
+@router.post("/ingest/indices")
+async def ingest_indices(request: Request):
+    """
+    Body: one JSON observation per line, e.g.
+    {"parcel_id": "P1", "date": "2025-06-01", "ndvi": 0.71, "nitrogen": 0.8}
+    The body is processed while it is received; invalid lines (or lines longer
+    than INGEST_MAX_LINE_BYTES) are reported and skipped, the valid ones are applied
+    """
+
+    batch = IngestBatch()
+    async for chunk in request.stream():
+        batch.feed_chunk(chunk)
+
+    return batch.finish()
@@ -1,12 +1,18 @@
+import asyncio
 import json
+import os
+import traceback
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
 from app.services.ai_handler import handle_intent
 from app.storage import state_store
-from app.services import account_linking_service, parcels_service, ai_service
+from app.services import account_linking_service, parcels_service, ai_service, intent_classifier, report_service
+from app.services import metrics, reply_cache
+from app.services.sessions import sessions
 from pydantic import BaseModel, Field
-from app.services.parcel_summary_service import build_parcel_summary
+from app.services.parcel_summary_service import build_parcel_summary, build_parcel_trend, build_parcel_details
 
 # from app.services import ai_service
 # from app.services.ai_handler import handle_intent
@@ -24,6 +30,9 @@ AI MODE:
 USE_AI = False
 router = APIRouter()
 
+# most messages accepted by one /messages:batch request
+MESSAGE_BATCH_MAX = int(os.getenv("MESSAGE_BATCH_MAX", "1000"))
+
 
 class MessagePayload(BaseModel):
     from_: str = Field(alias="from", example="+40740000000")
@@ -34,162 +43,274 @@ class MessagePayload(BaseModel):
     }
 
 
+class MessageBatchPayload(BaseModel):
+    messages: list[MessagePayload] = Field(max_length=MESSAGE_BATCH_MAX)
+
+
+GREETING_REPLY = (
+    "Welcome to the CO2 Angels Farm Assistant!\n"
+    "You can ask me things like:\n"
+    "- Show my parcels\n"
+    "- Show parcel P2 details\n"
+    "- How is parcel P1 doing?\n"
+    "- How has P1 changed over the last 30 days?\n"
+    "- Set weekly reports\n"
+    "- Stop reports"
+)
+
+FREQUENCY_REPLIES = {
+    "daily": "Okay! I’ve set your report frequency to daily.",
+    "weekly": "Got it! I’ll prepare a parcel summary for you every week based on your latest available data.",
+    "monthly": "OK! I’ve set your report frequency to monthly.",
+}
+
+# intent name -> handler(intent, session) returning the response
+HANDLERS = {}
+
+
+def handles(name: str):
+    """
+    Registers the rule based handler of an intent
+    """
+
+    def register(handler):
+        HANDLERS[name] = handler
+        return handler
+
+    return register
+
+
+@handles("GREETING")
+def _greeting(intent, session):
+    return {"reply": GREETING_REPLY}
+
+
+# report logic
+# Stored per farmer, not per phone, because a farmer may have multiple devices
+@handles("SET_REPORT_FREQUENCY")
+def _set_report_frequency(intent, session):
+    with metrics.stage("report_settings"):
+        report_service.set_report_frequency(session.farmer_id, intent.frequency)
+    return {"reply": FREQUENCY_REPLIES[intent.frequency]}
+
+
+@handles("STOP_REPORTS")
+def _stop_reports(intent, session):
+    with metrics.stage("report_settings"):
+        stopped = report_service.stop_reports(session.farmer_id)
+    if not stopped:
+        return {"reply": "You don't have any report schedule set."}
+
+    return {"reply": "Reports disabled successfully."}
+
+
+def _parcel_reply(stage, farmer_id, parcel_id, build, *args):
+    # a farmer cannot see another farmer s parcels
+    with metrics.stage("parcel_lookup"):
+        parcel, err = parcels_service.check_parcel_access(farmer_id, parcel_id)
+    if err:
+        return {"reply": err}
+
+    with metrics.stage(stage):
+        reply, error = build(parcel_id, *args)
+    if error:
+        return {"reply": error}
+    return reply
+
+
+# "how has P1 changed over the last 30 days"
+@handles("PARCEL_TREND")
+def _parcel_trend(intent, session):
+    return _parcel_reply("trend", session.farmer_id, intent.parcel_id, build_parcel_trend, intent.days)
+
+
+# parcel status with all info
+@handles("PARCEL_STATUS")
+def _parcel_status(intent, session):
+    return _parcel_reply("summary", session.farmer_id, intent.parcel_id, build_parcel_summary)
+
+
+# Normal parcel details
+@handles("PARCEL_DETAILS")
+def _parcel_details(intent, session):
+    return _parcel_reply("details", session.farmer_id, intent.parcel_id, build_parcel_details)
+
+
+@handles("LIST_PARCELS")
+def _list_parcels(intent, session):
+    with metrics.stage("parcel_lookup"):
+        # cached in the session until the data is reloaded
+        parcels = session.parcels()
+
+    if not parcels:
+        return {"reply": "You don’t have any parcels registered yet."}
+
+    reply_lines = [f"You have {len(parcels)} parcels:"]
+    for p in parcels:
+        reply_lines.append(f"{p['id']} – {p['name']} ({p['area_ha']} ha, {p['crop']})")
+
+    reply = "\n".join(reply_lines)
+
+    return {"reply": reply}
+
+
+# if message does not match any supported command it returns guided help list
+@handles("UNKNOWN")
+def _unknown(intent, session):
+    return {
+        "reply":
+            "I didn’t fully understand tha \n"
+            "Try one of these:\n"
+            "- Show my parcels\n"
+            "- Show parcel P3\n"
+            "- How is P1 doing?\n"
+            "- Set daily reports"
+    }
+
+
 @router.post("/message")
-def handle_message(payload: MessagePayload):
+async def handle_message(payload: MessagePayload):
     """
     Main chatbot message handler.
     Decides whether the user is linking account, requesting parcel list,
     asking parcel details, requesting a status summary or setting report frequency.
     Returns structured JSON response
+    Async so that slow AI calls only suspend this request; state access and
+    the intent handlers run in threads, so rule-based messages keep being
+    served while the model or the state backend is busy
     """
 
-    phone = payload.from_
-    text = payload.text.strip()
+    session = sessions.get(payload.from_)
+    with metrics.stage("message"):
+        # messages of one phone are handled one at a time
+        async with session.lock:
+            return await _handle_message(session, payload.text.strip())
+
+
+@router.post("/messages:batch")
+async def handle_message_batch(payload: MessageBatchPayload):
+    """
+    Many messages in one request, e.g. a burst delivered by the WhatsApp gateway.
+    Returns the replies in the order of the messages.
+    The messages of one phone are handled one after the other, in order (a
+    username must be linked before the next question); different phones run
+    concurrently, so one phone waiting for the AI does not hold up the others.
+    Each farmer's parcels are fetched once for the whole batch
+    """
+
+    conversations = {}
+    for i, message in enumerate(payload.messages):
+        conversations.setdefault(message.from_, []).append((i, message.text.strip()))
+    replies = [None] * len(payload.messages)
+
+    async def conversation(phone, messages):
+        session = sessions.get(phone)
+        for i, text in messages:
+            try:
+                with metrics.stage("message"):
+                    async with session.lock:
+                        replies[i] = await _handle_message(session, text)
+            except Exception as e:
+                # one failing message must not lose the replies of the others
+                metrics.MESSAGE_FAILURES.inc(reason=type(e).__name__)
+                print("Batch message failed:", repr(e))
+                traceback.print_exc()
+                replies[i] = {"error": "Message could not be processed"}
+
+    with metrics.stage("message_batch"), parcels_service.shared_lookups():
+        await asyncio.gather(*(conversation(phone, messages) for phone, messages in conversations.items()))
+
+    return {"replies": replies}
+
+
+def _intent_label(name) -> str:
+    """
+    Metric label of an intent named by the model: anything outside the known
+    intents is counted as UNKNOWN, so model output cannot add label values
+    """
+    return name if isinstance(name, str) and name in HANDLERS else "UNKNOWN"
+
+
+async def _handle_message(session, text: str):
+    phone = session.phone
 
     # account linked
-    if phone in state_store.phone_to_farmer:
-        # identify farmer
-        # every request is associated with exactly one farmer
-        # a farmer cannot see another farmer s parcels
-        farmer_id = state_store.phone_to_farmer[phone]
+    # identify farmer (resolved once per session)
+    # every request is associated with exactly one farmer
+    # a farmer cannot see another farmer s parcels
+    # state reads and writes, intent handlers and account linking run in
+    # threads: a slow or locked state backend must not stall the event loop
+    farmer_id = session.farmer_id
+    if farmer_id is None:
+        farmer_id = await asyncio.to_thread(session.farmer)
+    if farmer_id is not None:
+
+        # the text is lowercased, split and scanned for keywords once,
+        # every rule below reads the result
+        with metrics.stage("tokenize"):
+            message = intent_classifier.tokenize(text)
 
         # Greeting logic
         # We only treat the message as a greeting if it ONLY contains greeting text. Ex:
         # "hello" -> greeting
         # "hello show parcels" -> not greeting
-        text_lower = text.lower()
-        greetings = ["hello", "hi", "hey", "salut", "good morning", "good evening"]
-
-        if any(g in text_lower for g in greetings) and len(text_lower.split()) <= 2:
-            return {
-                "reply":
-                    "Welcome to the CO2 Angels Farm Assistant!\n"
-                    "You can ask me things like:\n"
-                    "- Show my parcels\n"
-                    "- Show parcel P2 details\n"
-                    "- How is parcel P1 doing?\n"
-                    "- Set weekly reports\n"
-                    "- Stop reports"
-            }
+        if message.greeting:
+            metrics.INTENTS.inc(intent="GREETING", source="rules")
+            return {"reply": GREETING_REPLY}
 
         """
         AI:
         - AI parses user intent (list parcels, summary, details, etc.)
+          unless the rule classifier is already confident (fast path, no model call)
         - Backend still fetches real data and validates security
         - AI only formats final text response in natural language
-        - if AI fails → automatic fallback to deterministic rule logic
+        - if AI fails or times out → automatic fallback to deterministic rule logic
         """
         if USE_AI:
             try:
-                intent_raw = ai_service.parse_message(text)
-                intent = json.loads(intent_raw)
-
-                result = handle_intent(intent, farmer_id, phone)
-
-                from app.services.ai_response import ai_format_response
-                reply = ai_format_response(result)
+                with metrics.stage("ai_parse"):
+                    intent, confidence = intent_classifier.classify(message)
+                    fast_path = confidence >= intent_classifier.FAST_PATH_THRESHOLD
+                    intent_classifier.record(fast_path)
+                    if not fast_path:
+                        intent_raw = await ai_service.parse_message_async(text)
+                        intent = json.loads(intent_raw)
+                metrics.INTENTS.inc(intent=_intent_label(intent.get("intent")), source="fast_path" if fast_path else "model")
+
+                with metrics.stage("ai_handle_intent"):
+                    result = await asyncio.to_thread(handle_intent, intent, farmer_id, phone)
+
+                from app.services.ai_response import ai_format_response_async
+                with metrics.stage("ai_format"):
+                    reply = await ai_format_response_async(result)
                 reply = reply.replace("\n", "\r\n")
                 return {"reply": reply, "raw": result}
 
             except Exception as e:
-                print("AI failed, falling back:", e)
-
-        # report logic
-        # Stored per farmer, not per phone, because a farmer may have multiple devices
-        text_lower = text.lower()
-        if "daily" in text_lower:
-            state_store.report_freq[farmer_id] = "daily"
-            return {"reply": "Okay! I’ve set your report frequency to daily."}
-
-        if "weekly" in text_lower:
-            state_store.report_freq[farmer_id] = "weekly"
-            return {
-                "reply": "Got it! I’ll prepare a parcel summary for you every week based on your latest available data."}
-
-        if "monthly" in text_lower:
-            state_store.report_freq[farmer_id] = "monthly"
-            return {"reply": "OK! I’ve set your report frequency to monthly."}
-
-        if "stop" in text_lower or "disable" in text_lower:
-            if farmer_id not in state_store.report_freq:
-                return {"reply": "You don't have any report schedule set."}
-
-            state_store.report_freq.pop(farmer_id, None)
-            return {"reply": "Reports disabled successfully."}
-
-        # parcel status with all info
-        parcel_id = parcels_service.extract_parcel_id(text)
-        if parcel_id:
-            words = text_lower.split()
-            if any(word in words for word in ["how", "status", "summary"]):
-                parcel, err = parcels_service.parcel_details_for_farmer(farmer_id, parcel_id)
-                if err:
-                    return {"reply": err}
-
-                summary, error = build_parcel_summary(parcel_id)
-                if error:
-                    return {"reply": error}
-                return summary
-
-            # Normal parcel details
-            details, error = parcels_service.parcel_details_for_farmer(farmer_id, parcel_id)
-            if error:
-                return {"reply": error}
-
-            latest = details.get("latest indices")
-
-            reply = (
-                f"Parcel {details['id']} – {details['name']}\n"
-                f"Crop: {details['crop']}\n"
-                f"Area: {details['area_ha']} ha\n"
-                f"Latest data: {latest['date']}:\n"
-                f"     NDVI: {latest['ndvi']}\n"
-                f"     NDMI: {latest['ndmi']}\n"
-                f"     NDWI: {latest['ndwi']}\n"
-                f"     SOC: {latest['soc']}\n"
-                f"     N: {latest['nitrogen']}\n"
-                f"     P: {latest['phosphorus']}\n"
-                f"     K: {latest['potassium']}\n"
-                f"     pH: {latest['ph']}"
-            )
-
-            return {"reply": reply}
-
-        # list parcels
-        if "parcel" in text_lower or "parcels" in text_lower or "field" in text_lower or "fields" in text_lower:
-            parcels = parcels_service.get_parcels_for_farmer(farmer_id)
-
-            if not parcels:
-                return {"reply": "You don’t have any parcels registered yet."}
-
-            reply_lines = [f"You have {len(parcels)} parcels:"]
-            for p in parcels:
-                reply_lines.append(f"{p['id']} – {p['name']} ({p['area_ha']} ha, {p['crop']})")
-
-            reply = "\n".join(reply_lines)
-
-            return {"reply": reply}
-
-        # if message does not match any supported command it returns guided help list
-        return {
-            "reply":
-                "I didn’t fully understand tha \n"
-                "Try one of these:\n"
-                "- Show my parcels\n"
-                "- Show parcel P3\n"
-                "- How is P1 doing?\n"
-                "- Set daily reports"
-        }
+                metrics.AI_FALLBACKS.inc(reason=type(e).__name__)
+                print("AI failed, falling back:", repr(e))
+
+        # rule based logic: one lookup in the dispatch table
+        with metrics.stage("routing"):
+            intent = intent_classifier.route(message)
+        metrics.INTENTS.inc(intent=intent.name, source="rules")
+        return await asyncio.to_thread(HANDLERS[intent.name], intent, session)
 
+    return await asyncio.to_thread(_link_account, phone, text)
+
+
+def _link_account(phone: str, text: str):
     # link account
     # if user is not linked yet, try to link account using the text as username
-    reply = account_linking_service.try_link_account(phone, text)
+    with metrics.stage("account_linking"):
+        reply = account_linking_service.try_link_account(phone, text)
     if reply != "Username not found":
         return {"reply": reply}
 
     # if phone number is seen for the first time, mark it as "pending linking" and ask user for username
     if phone not in state_store.pending_linking:
-        reply = account_linking_service.new_phone(phone)
+        with metrics.stage("account_linking"):
+            reply = account_linking_service.new_phone(phone)
         return {"reply": reply}
 
     # otherwise user is already in linking flow but sent an invalid username
@@ -199,11 +320,126 @@ def handle_message(payload: MessagePayload):
 @router.get("/debug/state")
 def debug_state():
     """
-    Debug endpoint to inspect in-memory chatbot state
+    Debug endpoint to inspect chatbot state: how many entries each part has,
+    read from counters the state backend keeps, so it is cheap at any size.
+    The entries themselves are paged by /debug/state/{namespace}
     """
 
     return {
-        "phone_to_farmer": state_store.phone_to_farmer,
-        "pending_linking": list(state_store.pending_linking),
-        "report_freq": state_store.report_freq
+        "phone_to_farmer": len(state_store.phone_to_farmer),
+        "pending_linking": len(state_store.pending_linking),
+        "report_freq": {
+            "total": len(state_store.report_freq),
+            "by_frequency": state_store.report_freq.value_counts()
+        }
     }
+
+
+# entries read from the state backend at a time while streaming
+STATE_PAGE_SIZE = 500
+STATE_NAMESPACES = ("phone_to_farmer", "pending_linking", "report_freq")
+
+
+def _state_pages(namespace: str, farmer_id, frequency):
+    """
+    page(after, limit) -> (entries, cursor) for one namespace and its filters
+    """
+    if namespace == "phone_to_farmer":
+        if frequency:
+            raise HTTPException(status_code=400, detail="phone_to_farmer can only be filtered by farmer_id")
+
+        def page(after, limit):
+            rows, cursor = state_store.phone_to_farmer.scan(after, limit, value=farmer_id)
+            return [{"phone": k, "farmer_id": v} for k, v in rows], cursor
+
+    elif namespace == "pending_linking":
+        if farmer_id or frequency:
+            raise HTTPException(status_code=400, detail="pending_linking has no filters")
+
+        def page(after, limit):
+            phones, cursor = state_store.pending_linking.scan(after, limit)
+            return [{"phone": p} for p in phones], cursor
+
+    elif namespace == "report_freq":
+
+        def page(after, limit):
+            if farmer_id:
+                freq = state_store.report_freq.get(farmer_id)
+                matches = freq is not None and (after is None or farmer_id > after) \
+                    and (frequency is None or freq == frequency)
+                rows, cursor = ([(farmer_id, freq)] if matches else []), None
+            else:
+                rows, cursor = state_store.report_freq.scan(after, limit, value=frequency)
+            return [
+                {"farmer_id": k, "frequency": v, "last_report_sent": state_store.last_report_sent.get(k)}
+                for k, v in rows
+            ], cursor
+
+    else:
+        raise HTTPException(status_code=404, detail=f"Unknown state namespace, use one of {STATE_NAMESPACES}")
+
+    return page
+
+
+@router.get("/debug/state/{namespace}")
+def debug_state_entries(namespace: str, cursor: str | None = None, limit: int = Query(100, ge=1, le=100000),
+                        farmer_id: str | None = None, frequency: str | None = None):
+    """
+    Entries of one state namespace in key order, streamed as NDJSON: one line
+    per entry, then a final line with next_cursor (pass it back as cursor).
+    phone_to_farmer can be filtered by farmer_id, report_freq by farmer_id and / or frequency
+    """
+
+    page = _state_pages(namespace, farmer_id, frequency)
+
+    def lines():
+        after = cursor
+        remaining = limit
+        sent = 0
+        while remaining:
+            entries, after = page(after, min(remaining, STATE_PAGE_SIZE))
+            for entry in entries:
+                yield json.dumps(entry) + "\n"
+            sent += len(entries)
+            remaining -= len(entries)
+            if after is None:
+                break
+        yield json.dumps({"entries": sent, "next_cursor": after}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/debug/fast-path")
+def debug_fast_path():
+    """
+    How many AI-mode messages were classified without calling the model
+    """
+
+    return intent_classifier.stats()
+
+
+@router.get("/debug/ai-cache")
+def debug_ai_cache():
+    """
+    Hit / miss counters of the AI parse and format caches
+    """
+
+    return ai_service.cache_stats()
+
+
+@router.get("/debug/sessions")
+def debug_sessions():
+    """
+    Size and hit / eviction counters of the per-phone session cache
+    """
+
+    return sessions.stats()
+
+
+@router.get("/debug/reply-cache")
+def debug_reply_cache():
+    """
+    Hit / miss counters of the rendered parcel reply cache
+    """
+
+    return reply_cache.stats()
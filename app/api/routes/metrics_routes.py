@@ -0,0 +1,67 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.data_loader import data_manager
+from app.services import ai_service, delivery, intent_classifier, metrics, reply_cache
+from app.services.sessions import sessions
+
+"""
+metrics_routes.py
+Prometheus scrape endpoint: stage timing histograms, intent / fallback
+counters and the counters of the in-process caches
+"""
+
+router = APIRouter()
+
+_CACHE_COUNTERS = ("hits", "misses", "evictions", "expirations", "invalidations")
+
+
+def _cache_lines() -> list:
+    caches = {"reply": reply_cache.stats(), **{f"ai_{name}": s for name, s in ai_service.cache_stats().items()}}
+    lines = []
+    for field in _CACHE_COUNTERS:
+        name = f"{metrics.PREFIX}cache_{field}_total"
+        lines += [f"# HELP {name} Cache {field} since startup", f"# TYPE {name} counter"]
+        lines += [f'{name}{{cache="{cache}"}} {s[field]}' for cache, s in caches.items()]
+
+    name = f"{metrics.PREFIX}cache_entries"
+    lines += [f"# HELP {name} Entries currently cached", f"# TYPE {name} gauge"]
+    lines += [f'{name}{{cache="{cache}"}} {s["size"]}' for cache, s in caches.items()]
+    return lines
+
+
+def _other_lines() -> list:
+    fast = intent_classifier.stats()
+    name = f"{metrics.PREFIX}ai_classifications_total"
+    lines = [f"# HELP {name} AI-mode messages by who classified them", f"# TYPE {name} counter",
+             f'{name}{{path="fast_path"}} {fast["fast_path"]}',
+             f'{name}{{path="model"}} {fast["model"]}']
+
+    name = f"{metrics.PREFIX}sessions"
+    lines += [f"# HELP {name} Phones with a cached conversation session", f"# TYPE {name} gauge",
+              f"{name} {len(sessions)}"]
+
+    name = f"{metrics.PREFIX}delivery_queue_depth"
+    lines += [f"# HELP {name} Outbound messages not acknowledged yet", f"# TYPE {name} gauge",
+              f"{name} {len(delivery.queue)}"]
+
+    dataset = data_manager.current()
+    name = f"{metrics.PREFIX}dataset_generation"
+    lines += [f"# HELP {name} Data reloads since startup (1 = initial load)", f"# TYPE {name} gauge",
+              f"{name} {dataset.generation}"]
+    load_seconds = dataset.stats.get("load_seconds")
+    if load_seconds is not None:
+        name = f"{metrics.PREFIX}dataset_load_seconds"
+        lines += [f"# HELP {name} Duration of the last data load", f"# TYPE {name} gauge",
+                  f"{name} {load_seconds}"]
+    return lines
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Prometheus text exposition format
+    """
+
+    return PlainTextResponse(metrics.render(_cache_lines() + _other_lines()),
+                             media_type="text/plain; version=0.0.4")
@@ -1,51 +1,75 @@
-from fastapi import APIRouter
+import json
 
-from app.services import parcels_service, report_service
-from app.storage import state_store
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from app.services import delivery, metrics, report_engine, report_scheduler
 from datetime import date
 
 router = APIRouter()
 
 
 @router.post("/generate-reports")
-def generate_reports():
+def generate_reports(limit: int | None = Query(None, ge=1), cursor: str | None = None):
     """
     Simulates scheduled report sending.
-    Checks which farmers are due for a report today
-    and returns the messages that would be sent
+    Checks which farmers are due for a report today, queues their messages
+    for delivery and returns them. A farmer counts as sent once the
+    delivery is acknowledged (see /debug/delivery).
+    With limit, only that many farmers are processed; pass next_cursor back as
+    cursor to continue
     """
 
-    res = []
+    with metrics.stage("generate_reports"):
+        today = date.today()
+        farmer_ids, next_cursor = report_engine.select_due(today, cursor, limit)
+        res = list(report_engine.iter_reports(farmer_ids, today))
 
-    # Go through all linked phone numbers
-    for phone, farmer_id in state_store.phone_to_farmer.items():
+    return {
+        "generated_at": str(today),
+        "reports_sent": len(res),
+        "messages": res,
+        "next_cursor": next_cursor
+    }
 
-        # check if farmer should receive a report today
-        if not report_service.scheduled_report(farmer_id):
-            continue
 
-        parcels = parcels_service.get_parcels_for_farmer(farmer_id)
+@router.post("/generate-reports/stream")
+def generate_reports_stream(limit: int | None = Query(None, ge=1), cursor: str | None = None):
+    """
+    Same as /generate-reports, streamed as NDJSON: one line per message,
+    then a final line with the totals and next_cursor
+    """
 
-        # if farmer has no parcels registered
-        if not parcels:
-            res.append({
-                "to": phone,
-                "message": "You currently have no registered parcels."
-            })
-            continue
+    today = date.today()
+    farmer_ids, next_cursor = report_engine.select_due(today, cursor, limit)
 
-        msg = f"You have {len(parcels)} parcels. Latest data looks stable."
+    def lines():
+        sent = 0
+        for report in report_engine.iter_reports(farmer_ids, today):
+            sent += 1
+            yield json.dumps(report, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "generated_at": str(today),
+            "reports_sent": sent,
+            "next_cursor": next_cursor
+        }) + "\n"
 
-        res.append({
-            "to": phone,
-            "message": msg
-        })
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-        # mark report as sent
-        state_store.last_report_sent[farmer_id] = str(date.today())
 
-    return {
-        "generated_at": str(date.today()),
-        "reports_sent": len(res),
-        "messages": res
-    }
+@router.get("/debug/scheduler")
+def debug_scheduler():
+    """
+    State of the background report scheduler
+    """
+
+    return report_scheduler.stats()
+
+
+@router.get("/debug/delivery")
+def debug_delivery():
+    """
+    Depth, outcomes, throughput and latency of the outbound delivery queue
+    """
+
+    return delivery.queue.stats()
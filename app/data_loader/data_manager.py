@@ -1,36 +1,328 @@
+import contextvars
+import hashlib
 import json
 import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from app.data_loader.repository import DataRepository
+from app.data_loader.snapshot import SNAPSHOT_FILE, Snapshot
+from app.data_loader.streaming import iter_parcel_indices
+from app.data_loader.timeseries import IndicesStore, ParcelTimeSeries
+from app.services import metrics
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 """
-Loads farmers, parcels and parcel index monitoring data from JSON files located in the data directory 
+Loads farmers, parcels and parcel index monitoring data from JSON files located in the data directory
 and stores them into global in-memory variables.
 This simulates a database
+
+Everything loaded together lives in one Dataset object. A background watcher
+polls the files and, when they change, builds a new Dataset next to the old one
+and swaps a single reference, so a reload never blocks requests.
+FARMERS, PARCELS, PARCELS_INDICES, REPO and LOAD_STATS still work as module
+attributes and always resolve to the dataset of the current request (see pinned()).
 """
 
-FARMERS = []
-PARCELS = []
-PARCELS_INDICES = {}
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data"))
+
+# seconds between checks of the data files, 0 disables hot reload
+DATA_RELOAD_INTERVAL = float(os.getenv("DATA_RELOAD_INTERVAL", "5"))
+
+
+class Dataset:
+    """
+    One consistent, immutable-by-convention generation of the data
+    """
+
+    def __init__(self, repo, indices: IndicesStore, stats: dict,
+                 fingerprints: dict, generation: int, snapshot: str | None = None):
+        # indexed view over farmers / parcels: a DataRepository, or a
+        # SnapshotRepository reading them straight from the mapped file
+        self.repo = repo
+        self.farmers = repo.farmers
+        self.parcels = repo.parcels
+        # parcel_id -> ParcelTimeSeries, sorted once at load time
+        self.indices = indices
+        # timings, record counts and memory used
+        self.stats = stats
+        # file path -> (mtime, size, sha256) of the files it was built from
+        self.fingerprints = fingerprints
+        self.generation = generation
+        # snapshot file the data was mapped from, None when it came from JSON
+        self.snapshot = snapshot
+
+
+_current = Dataset(DataRepository([], []), IndicesStore(), {}, {}, 0)
+
+# dataset pinned for the duration of a request
+_pinned = contextvars.ContextVar("dataset", default=None)
+
+_LEGACY_NAMES = {
+    "FARMERS": "farmers",
+    "PARCELS": "parcels",
+    "PARCELS_INDICES": "indices",
+    "REPO": "repo",
+    "LOAD_STATS": "stats",
+}
+
+
+def current() -> Dataset:
+    dataset = _pinned.get()
+    return _current if dataset is None else dataset
+
+
+def __getattr__(name):
+    attr = _LEGACY_NAMES.get(name)
+    if attr is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(current(), attr)
+
+
+@contextmanager
+def pinned():
+    """
+    Everything inside sees the same Dataset, even if a reload swaps it meanwhile
+    """
+    token = _pinned.set(current())
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+# callbacks run with the ids of parcels whose indices changed (None = everything)
+_indices_listeners = []
+
+
+def on_indices_changed(callback):
+    """
+    Registers a callback used by caches / aggregates built from PARCELS_INDICES
+    """
+    _indices_listeners.append(callback)
+    return callback
+
+
+def notify_indices_changed(parcel_ids=None):
+    for callback in _indices_listeners:
+        callback(parcel_ids)
+
+
+_swap_lock = threading.Lock()
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def load_indices(parcels_indices_path: str) -> IndicesStore:
+    """
+    Streams parcel_indices.json one parcel at a time straight into the column store
+    """
+    store = IndicesStore()
+    for parcel_id, records in iter_parcel_indices(parcels_indices_path):
+        store.put(parcel_id, ParcelTimeSeries.from_records(records))
+    return store
+
+
+def _paths():
+    return {
+        "farmers": os.path.join(DATA_DIR, "farmers.json"),
+        "parcels": os.path.join(DATA_DIR, "parcels.json"),
+        "indices": os.path.join(DATA_DIR, "parcel_indices.json"),
+        "snapshot": os.getenv("DATA_SNAPSHOT", os.path.join(DATA_DIR, SNAPSHOT_FILE)),
+    }
+
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _fingerprints(paths: dict, previous: dict) -> dict:
+    """
+    (mtime, size, hash) per file. The hash is only recomputed when mtime or size
+    moved, and it decides whether the content really changed
+    """
+    res = {}
+    for path in paths.values():
+        st = _stat(path)
+        if st is None:
+            res[path] = None
+            continue
+        old = previous.get(path)
+        if old is not None and old[:2] == st:
+            res[path] = old
+        else:
+            res[path] = (*st, _sha256(path))
+    return res
+
+
+def _content(fingerprints: dict) -> dict:
+    return {path: fp and fp[2] for path, fp in fingerprints.items()}
+
+
+def _snapshot_is_fresh(snapshot_path: str, json_paths: list) -> bool:
+    """
+    A snapshot is only used when it is newer than every JSON file it was built from
+    """
+    if not os.path.exists(snapshot_path):
+        return False
+    built = os.path.getmtime(snapshot_path)
+    return all(os.path.getmtime(p) <= built for p in json_paths)
+
+
+def _build(previous: Dataset, fingerprints: dict) -> Dataset:
+    """
+    Loads a new Dataset. When only farmers/parcels changed, the indices store of
+    the previous dataset (with any ingested observations) is reused, whether
+    the new data comes from JSON or from the snapshot
+    """
+    paths = _paths()
+    started = time.perf_counter()
+
+    indices_path = paths["indices"]
+    same_indices = _content(fingerprints).get(indices_path) == _content(previous.fingerprints).get(indices_path)
+    reuse_indices = bool(previous.generation) and same_indices
+
+    snapshot = None
+    if _snapshot_is_fresh(paths["snapshot"], [paths["farmers"], paths["parcels"], paths["indices"]]):
+        try:
+            snapshot = Snapshot(paths["snapshot"])
+        except ValueError as e:
+            # e.g. written by an older version: the JSON files are still there
+            print("Ignoring data snapshot:", e)
+
+    # compiled binary snapshot (see snapshot.py) -> mmap, records decoded on lookup
+    if snapshot is not None:
+        repo = snapshot.repository()
+        # parcel_indices.json unchanged: the snapshot holds nothing newer than
+        # the current series, which may have ingested observations on top
+        indices = previous.indices if reuse_indices else snapshot.indices()
+        source = "snapshot"
+        snapshot_path = paths["snapshot"]
+        index_records = indices.record_count()
+        # the snapshot columns stay in the mapped file, they are not copied into the heap
+        indices_bytes = 0
+    else:
+        with open(paths["farmers"], "r") as pt:
+            farmers = json.load(pt)
+
+        with open(paths["parcels"], "r") as pt:
+            parcels = json.load(pt)
+        repo = DataRepository(farmers, parcels)
+
+        if reuse_indices:
+            indices = previous.indices
+        else:
+            indices = load_indices(indices_path)
+        source = "json"
+        snapshot_path = None
+        index_records = indices.record_count()
+        indices_bytes = indices.nbytes()
+
+    load_seconds = time.perf_counter() - started
+    metrics.STAGE_SECONDS.observe(load_seconds, stage="load_data")
+    stats = {
+        "source": source,
+        "load_seconds": round(load_seconds, 3),
+        "farmers": len(repo.farmers),
+        "parcels": len(repo.parcels),
+        "indexed_parcels": len(indices),
+        "index_records": index_records,
+        "indices_mb": round(indices_bytes / (1024 * 1024), 2),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    return Dataset(repo, indices, stats, fingerprints, previous.generation + 1, snapshot_path)
+
+
+def _swap(dataset: Dataset):
+    global _current
+    with _swap_lock:
+        # the only write readers can observe: one reference assignment
+        _current = dataset
+
+    print("Data loaded successfully!", dataset.stats)
+
+    # everything was replaced, anything derived from the old data is stale
+    notify_indices_changed(None)
 
 
 def load_data():
-    global FARMERS, PARCELS, PARCELS_INDICES
-    path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data")
-    farmers_path = os.path.join(path, "farmers.json")
-    parcels_path = os.path.join(path, "parcels.json")
-    parcels_indices_path = os.path.join(path, "parcel_indices.json")
+    previous = _current
+    _swap(_build(previous, _fingerprints(_paths(), previous.fingerprints)))
+
+
+def attach_snapshot(path: str, generation: int):
+    """
+    Makes a snapshot file the data of this process: mapped read-only, no JSON,
+    no watcher. Used by worker processes that render reports (report_pool)
+    """
+    global _current
+    snapshot = Snapshot(path)
+    dataset = Dataset(snapshot.repository(), snapshot.indices(), {"source": "snapshot"}, {}, generation, path)
+    with _swap_lock:
+        _current = dataset
+    notify_indices_changed(None)
+
+
+def reload_if_changed() -> bool:
+    """
+    Rebuilds and swaps the dataset if a data file changed, returns True if it did
+    """
+    previous = _current
+    fingerprints = _fingerprints(_paths(), previous.fingerprints)
+    if _content(fingerprints) == _content(previous.fingerprints):
+        # touched but identical, remember the new mtimes so it is not hashed again
+        previous.fingerprints = fingerprints
+        return False
+    _swap(_build(previous, fingerprints))
+    return True
+
 
-    with open(farmers_path, "r") as pt:
-        FARMERS = json.load(pt)
+_watcher_stop = threading.Event()
 
-    with open(parcels_path, "r") as pt:
-        PARCELS = json.load(pt)
 
-    with open(parcels_indices_path, "r") as pt:
-        PARCELS_INDICES = json.load(pt)
+def _watch(interval: float):
+    while not _watcher_stop.wait(interval):
+        try:
+            reload_if_changed()
+        except Exception as e:
+            # a half-written file just fails this round, the old data stays in use
+            print("Data reload failed, keeping current data:", repr(e))
 
-    print("DEBUG JSON TYPE:", type(PARCELS_INDICES))
-    print("DEBUG JSON SAMPLE:", str(PARCELS_INDICES)[:200])
 
-    print("Data loaded successfully!")
+def start_watcher(interval: float = DATA_RELOAD_INTERVAL):
+    if interval <= 0:
+        return None
+    _watcher_stop.clear()
+    thread = threading.Thread(target=_watch, args=(interval,), name="data-reload", daemon=True)
+    thread.start()
+    return thread
 
 
+def stop_watcher():
+    _watcher_stop.set()
@@ -0,0 +1,43 @@
+"""
+repository.py
+In-memory repository over the farmers and parcels loaded by data_manager.
+Builds hash indexes once at load time so every lookup done while handling
+a message is O(1) instead of a scan over all farmers / parcels.
+"""
+
+
+class DataRepository:
+
+    def __init__(self, farmers: list, parcels: list):
+        self.farmers = farmers
+        self.parcels = parcels
+
+        self._farmer_by_id = {}
+        self._farmer_by_username = {}
+        self._parcel_by_id = {}
+        self._parcels_by_farmer = {}
+
+        # setdefault keeps the first occurrence, same result as the old linear scans
+        for farmer in farmers:
+            self._farmer_by_id.setdefault(farmer["id"], farmer)
+            self._farmer_by_username.setdefault(farmer["username"].lower(), farmer)
+
+        for parcel in parcels:
+            self._parcel_by_id.setdefault(parcel["id"], parcel)
+            self._parcels_by_farmer.setdefault(parcel["farmer_id"], []).append(parcel)
+
+    def get_farmer(self, farmer_id: str):
+        return self._farmer_by_id.get(farmer_id)
+
+    def get_farmer_by_username(self, username: str):
+        """
+        Case-insensitive username lookup
+        """
+        return self._farmer_by_username.get(username.lower())
+
+    def get_parcel(self, parcel_id: str):
+        return self._parcel_by_id.get(parcel_id)
+
+    def get_parcels_for_farmer(self, farmer_id: str) -> list:
+        # copy so callers can't corrupt the index
+        return list(self._parcels_by_farmer.get(farmer_id, ()))
@@ -0,0 +1,476 @@
+"""
+snapshot.py
+Compiles farmers.json, parcels.json and parcel_indices.json into a single
+binary file that workers memory-map read-only at startup instead of parsing
+JSON. All uvicorn workers on the same host share the page cache of the file,
+and nothing is decoded until it is used: a farmer or parcel is decoded when it
+is looked up, a time series when it is first read.
+
+Layout (native byte order, every section 8-byte aligned):
+    header          magic, version, counts and the offset of each section
+    str_offsets     uint64[n_strings + 1]   string table offsets into str_blob
+    str_blob        utf-8 bytes
+    farmer_offsets  uint64[n_farmers + 1]   record offsets into farmer_blob
+    farmer_blob     one compact JSON object per farmer, as found in farmers.json
+    parcel_offsets  uint64[n_parcels + 1]
+    parcel_blob     one compact JSON object per parcel
+    <index>_keys    uint32[n]               string refs, equal keys next to each other
+    <index>_rows    uint32[n]               record (or series) row of every key
+    <index>_slots   uint32[2^k >= 2n]       open addressing table: crc32(key) -> first
+                                            position of the key in <index>_keys, plus one
+    series_parcel   uint32[n_series]        parcel id of every time series
+    series_start    uint64[n_series + 1]    row offsets into the observation columns
+    dates           int32[n_obs]            date ordinals, sorted inside each series
+    <metric>        float64[n_obs]          one column per metric, NaN = missing
+
+The indexes (farmer by id and username, parcel by id and by farmer,
+series by parcel id) are hash tables stored in the file and probed in place,
+so lookups need nothing built at startup. Records with the same key keep
+their file order.
+
+Build with:
+    python -m app.data_loader.snapshot [data_dir] [output]
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Sequence
+
+from app.data_loader.timeseries import METRICS, IndicesStore, ParcelTimeSeries
+
+MAGIC = b"FASNAP01"
+VERSION = 3
+SNAPSHOT_FILE = "snapshot.bin"
+
+# index name -> header count giving its length
+_INDEXES = {
+    "farmer_id": "n_farmers",
+    "farmer_username": "n_farmers",
+    "parcel_id": "n_parcels",
+    "parcel_farmer": "n_parcels",
+    "series": "n_series",
+}
+
+_SECTIONS = (("str_offsets", "str_blob", "farmer_offsets", "farmer_blob", "parcel_offsets", "parcel_blob")
+             + tuple(f"{name}_{part}" for name in _INDEXES for part in ("keys", "rows", "slots"))
+             + ("series_parcel", "series_start", "dates") + METRICS)
+
+_COUNTS = ("n_strings", "n_farmers", "n_parcels", "n_series", "n_obs")
+
+# magic, version, byte order: the same in every version
+_PREFIX = struct.Struct("<8sII")
+# prefix, counts, section offsets
+_HEADER = struct.Struct(_PREFIX.format + "Q" * len(_COUNTS) + "Q" * len(_SECTIONS))
+
+_BYTEORDER = {"little": 1, "big": 2}
+
+# json.loads without its per-call argument handling, records are decoded one by one
+_decode_json = json.JSONDecoder().decode
+
+
+class _StringTable:
+
+    def __init__(self):
+        self._ids = {}
+        self.blob = bytearray()
+        self.offsets = array("Q", [0])
+
+    def ref(self, s):
+        ref = self._ids.get(s)
+        if ref is None:
+            ref = self._ids[s] = len(self.offsets) - 1
+            self.blob += s.encode("utf-8")
+            self.offsets.append(len(self.blob))
+        return ref
+
+
+def _records(records) -> tuple:
+    """
+    (offsets, blob) of the records, each one stored as compact JSON so every
+    field and its type is kept
+    """
+    offsets = array("Q", [0])
+    blob = bytearray()
+    for r in records:
+        blob += json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def _slot_count(n: int) -> int:
+    # a power of two, at most half full
+    return 1 << max(3, (2 * n).bit_length())
+
+
+def _key_index(strings: _StringTable, entries) -> tuple:
+    """
+    (keys, rows, slots) of (key, row) entries. Sorted by key, stable, so equal
+    keys are adjacent and stay in row order
+    """
+    entries = sorted(entries, key=lambda e: e[0].encode("utf-8"))
+    slots = array("I", bytes(4 * _slot_count(len(entries))))
+    mask = len(slots) - 1
+    for pos, (key, _) in enumerate(entries):
+        if pos and entries[pos - 1][0] == key:
+            continue
+        i = zlib.crc32(key.encode("utf-8")) & mask
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = pos + 1
+    return array("I", [strings.ref(k) for k, _ in entries]), array("I", [row for _, row in entries]), slots
+
+
+def write_snapshot(path: str, farmers, parcels, indices: IndicesStore):
+    """
+    Writes already loaded data to a snapshot file (atomically, via rename)
+    """
+    strings = _StringTable()
+    farmers = list(farmers)
+    parcels = list(parcels)
+
+    indexes = {
+        "farmer_id": _key_index(strings, ((f["id"], row) for row, f in enumerate(farmers))),
+        "farmer_username": _key_index(strings, ((f["username"].lower(), row) for row, f in enumerate(farmers))),
+        "parcel_id": _key_index(strings, ((p["id"], row) for row, p in enumerate(parcels))),
+        "parcel_farmer": _key_index(strings, ((p["farmer_id"], row) for row, p in enumerate(parcels))),
+    }
+
+    series_parcel = array("I")
+    series_start = array("Q", [0])
+    dates = array("i")
+    columns = {m: array("d") for m in METRICS}
+    parcel_ids = []
+    for parcel_id, series in indices.items():
+        parcel_ids.append(parcel_id)
+        series_parcel.append(strings.ref(parcel_id))
+        series_dates, series_columns = series.arrays()
+        dates.extend(series_dates)
+        for m in METRICS:
+            columns[m].extend(series_columns[m])
+        series_start.append(len(dates))
+    indexes["series"] = _key_index(strings, ((p, row) for row, p in enumerate(parcel_ids)))
+
+    farmer_offsets, farmer_blob = _records(farmers)
+    parcel_offsets, parcel_blob = _records(parcels)
+    payload = {
+        "str_offsets": strings.offsets.tobytes(),
+        "str_blob": bytes(strings.blob),
+        "farmer_offsets": farmer_offsets.tobytes(),
+        "farmer_blob": farmer_blob,
+        "parcel_offsets": parcel_offsets.tobytes(),
+        "parcel_blob": parcel_blob,
+        "series_parcel": series_parcel.tobytes(),
+        "series_start": series_start.tobytes(),
+        "dates": dates.tobytes(),
+    }
+    for name, (keys, rows, slots) in indexes.items():
+        payload[f"{name}_keys"] = keys.tobytes()
+        payload[f"{name}_rows"] = rows.tobytes()
+        payload[f"{name}_slots"] = slots.tobytes()
+    for m in METRICS:
+        payload[m] = columns[m].tobytes()
+
+    offsets = []
+    pos = _HEADER.size
+    for name in _SECTIONS:
+        pos += -pos % 8
+        offsets.append(pos)
+        pos += len(payload[name])
+
+    counts = (len(strings.offsets) - 1, len(farmers), len(parcels), len(series_parcel), len(dates))
+    header = _HEADER.pack(MAGIC, VERSION, _BYTEORDER[sys.byteorder], *counts, *offsets)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(header)
+        for name, offset in zip(_SECTIONS, offsets):
+            out.write(b"\0" * (offset - out.tell()))
+            out.write(payload[name])
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(data_dir: str, path: str):
+    """
+    The build step: JSON files in data_dir -> snapshot file
+    """
+    from app.data_loader.data_manager import load_indices
+
+    with open(os.path.join(data_dir, "farmers.json"), "r") as pt:
+        farmers = json.load(pt)
+    with open(os.path.join(data_dir, "parcels.json"), "r") as pt:
+        parcels = json.load(pt)
+    indices = load_indices(os.path.join(data_dir, "parcel_indices.json"))
+
+    write_snapshot(path, farmers, parcels, indices)
+
+
+class _Records(Sequence):
+    """
+    Read-only list of the farmers or parcels of a snapshot. Every access
+    decodes a fresh dict, so callers cannot change the mapped data
+    """
+
+    def __init__(self, mm, start: int, offsets):
+        self._mm = mm
+        self._start = start
+        self._offsets = offsets
+        self._len = len(offsets) - 1
+
+    def __len__(self):
+        return self._len
+
+    def _decode(self, i: int) -> dict:
+        start, offsets = self._start, self._offsets
+        return _decode_json(self._mm[start + offsets[i]:start + offsets[i + 1]].decode("utf-8"))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(j) for j in range(*i.indices(self._len))]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        return self._decode(i)
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self._decode(i)
+
+
+class _KeyIndex:
+    """
+    One <index>_keys / _rows / _slots group, probed in place
+    """
+
+    def __init__(self, snapshot, keys, rows, slots):
+        self._key = snapshot.string_bytes
+        self._keys = keys
+        self._rows = rows
+        self._slots = slots
+        self._mask = len(slots) - 1
+
+    def _range(self, key: str) -> tuple:
+        target = key.encode("utf-8")
+        keys, slots, mask = self._keys, self._slots, self._mask
+        i = zlib.crc32(target) & mask
+        while True:
+            pos = slots[i]
+            if not pos:
+                return 0, 0
+            if self._key(keys[pos - 1]) == target:
+                break
+            i = (i + 1) & mask
+        lo = hi = pos - 1
+        # equal keys are few (the parcels of one farmer), walk them
+        while hi < len(keys) and self._key(keys[hi]) == target:
+            hi += 1
+        return lo, hi
+
+    def find(self, key: str):
+        """
+        Row of the first record with this key, or None
+        """
+        lo, hi = self._range(key)
+        return self._rows[lo] if hi > lo else None
+
+    def find_all(self, key: str) -> list:
+        lo, hi = self._range(key)
+        return self._rows[lo:hi].tolist()
+
+
+class SnapshotRepository:
+    """
+    DataRepository over a mapped snapshot: the same lookups, answered by
+    probing the crc32 open addressing tables stored in the file and decoding
+    only the records found
+    """
+
+    def __init__(self, snapshot):
+        self.farmers = snapshot.records("farmer")
+        self.parcels = snapshot.records("parcel")
+        self._farmer_by_id = snapshot.index("farmer_id")
+        self._farmer_by_username = snapshot.index("farmer_username")
+        self._parcel_by_id = snapshot.index("parcel_id")
+        self._parcels_by_farmer = snapshot.index("parcel_farmer")
+
+    @staticmethod
+    def _one(records, index, key):
+        row = index.find(key)
+        return None if row is None else records[row]
+
+    def get_farmer(self, farmer_id: str):
+        return self._one(self.farmers, self._farmer_by_id, farmer_id)
+
+    def get_farmer_by_username(self, username: str):
+        """
+        Case-insensitive username lookup
+        """
+        return self._one(self.farmers, self._farmer_by_username, username.lower())
+
+    def get_parcel(self, parcel_id: str):
+        return self._one(self.parcels, self._parcel_by_id, parcel_id)
+
+    def get_parcels_for_farmer(self, farmer_id: str) -> list:
+        decode = self.parcels._decode
+        return [decode(row) for row in self._parcels_by_farmer.find_all(farmer_id)]
+
+
+class SnapshotIndicesStore(IndicesStore):
+    """
+    IndicesStore whose series are created on first access, as zero-copy
+    views over the mapped observation columns
+    """
+
+    def __init__(self, snapshot):
+        super().__init__()
+        self._snapshot = snapshot
+        self._by_parcel = snapshot.index("series")
+        # parcels with series added after the snapshot was built (ingestion), in order
+        self._extra = {}
+
+    def _resolve(self, parcel_id):
+        series = self._series.get(parcel_id)
+        if series is None:
+            row = self._by_parcel.find(parcel_id)
+            if row is None:
+                return None
+            series = self._series[parcel_id] = self._snapshot.series(row)
+        return series
+
+    def __contains__(self, parcel_id):
+        return parcel_id in self._series or self._by_parcel.find(parcel_id) is not None
+
+    def __getitem__(self, parcel_id) -> ParcelTimeSeries:
+        series = self._resolve(parcel_id)
+        if series is None:
+            raise KeyError(parcel_id)
+        return series
+
+    def __iter__(self):
+        string, refs = self._snapshot.string, self._snapshot.series_parcel
+        for row in range(len(refs)):
+            yield string(refs[row])
+        yield from list(self._extra)
+
+    def __len__(self):
+        return self._snapshot.n_series + len(self._extra)
+
+    def get(self, parcel_id, default=None):
+        series = self._resolve(parcel_id)
+        return default if series is None else series
+
+    def items(self):
+        return ((parcel_id, self[parcel_id]) for parcel_id in self)
+
+    def put(self, parcel_id: str, series: ParcelTimeSeries):
+        if parcel_id not in self:
+            self._extra[parcel_id] = None
+        self._series[parcel_id] = series
+
+    def record_count(self) -> int:
+        # series never accessed still hold what the snapshot has, no need to map them
+        starts = self._snapshot.series_start
+        total = self._snapshot.n_obs
+        for parcel_id, series in self._series.items():
+            row = self._by_parcel.find(parcel_id)
+            total += len(series) - (0 if row is None else starts[row + 1] - starts[row])
+        return total
+
+    def nbytes(self) -> int:
+        return sum(self[p].nbytes() for p in self)
+
+    def latest(self, parcel_id: str):
+        series = self._resolve(parcel_id)
+        if series is None:
+            return None
+        return series.latest()
+
+
+class Snapshot:
+    """
+    Read-only memory mapped snapshot
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fh:
+            # the mapping stays valid after the file is closed
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder = _PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a v{VERSION} farmer-assistant snapshot, rebuild it")
+        if byteorder != _BYTEORDER[sys.byteorder]:
+            raise ValueError(f"{path} was built on a machine with a different byte order")
+        rest = _HEADER.unpack_from(self._mm, 0)[3:]
+
+        counts = dict(zip(_COUNTS, rest))
+        sections = dict(zip(_SECTIONS, rest[len(_COUNTS):]))
+        self.n_farmers = counts["n_farmers"]
+        self.n_parcels = counts["n_parcels"]
+        self.n_series = counts["n_series"]
+        self.n_obs = counts["n_obs"]
+
+        mv = memoryview(self._mm)
+
+        def view(name, fmt, count):
+            start = sections[name]
+            return mv[start:start + count * struct.calcsize(fmt)].cast(fmt)
+
+        self._sections = sections
+        n_strings = counts["n_strings"]
+        self.str_offsets = view("str_offsets", "Q", n_strings + 1)
+        self.str_blob = mv[sections["str_blob"]:sections["str_blob"] + self.str_offsets[n_strings]]
+        self._str_start = sections["str_blob"]
+        self.farmer_offsets = view("farmer_offsets", "Q", self.n_farmers + 1)
+        self.parcel_offsets = view("parcel_offsets", "Q", self.n_parcels + 1)
+        self._indexes = {
+            name: (view(f"{name}_keys", "I", counts[count]), view(f"{name}_rows", "I", counts[count]),
+                   view(f"{name}_slots", "I", _slot_count(counts[count])))
+            for name, count in _INDEXES.items()
+        }
+        self.series_parcel = view("series_parcel", "I", self.n_series)
+        self.series_start = view("series_start", "Q", self.n_series + 1)
+        self.dates = view("dates", "i", self.n_obs)
+        self.metrics = {m: view(m, "d", self.n_obs) for m in METRICS}
+
+    def string_bytes(self, ref: int) -> bytes:
+        # slicing the mmap itself gives bytes without an intermediate view
+        start = self._str_start
+        return self._mm[start + self.str_offsets[ref]:start + self.str_offsets[ref + 1]]
+
+    def string(self, ref: int) -> str:
+        return str(self.str_blob[self.str_offsets[ref]:self.str_offsets[ref + 1]], "utf-8")
+
+    def records(self, kind: str) -> _Records:
+        """
+        "farmer" or "parcel" records, decoded on access
+        """
+        return _Records(self._mm, self._sections[f"{kind}_blob"], getattr(self, f"{kind}_offsets"))
+
+    def index(self, name: str) -> _KeyIndex:
+        return _KeyIndex(self, *self._indexes[name])
+
+    def repository(self) -> SnapshotRepository:
+        return SnapshotRepository(self)
+
+    def series(self, row: int) -> ParcelTimeSeries:
+        lo, hi = self.series_start[row], self.series_start[row + 1]
+        return ParcelTimeSeries.from_columns(
+            self.dates[lo:hi], {m: self.metrics[m][lo:hi] for m in METRICS})
+
+    def indices(self) -> SnapshotIndicesStore:
+        return SnapshotIndicesStore(self)
+
+
+if __name__ == "__main__":
+    default_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data")
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else default_dir
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, SNAPSHOT_FILE)
+
+    build_snapshot(data_dir, out_path)
+    print(f"Snapshot written to {out_path} ({os.path.getsize(out_path)} bytes)")
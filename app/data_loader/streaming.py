@@ -0,0 +1,112 @@
+"""
+streaming.py
+Incremental reader for parcel_indices.json.
+The file is one object {parcel_id: [record, ...], ...} that can be several GB,
+so instead of json.load on the whole thing it is read in chunks and decoded
+one record at a time. Only the records of the parcel currently being read
+are held as dicts; they are handed over to the caller as soon as the parcel's
+array is closed.
+"""
+import json
+
+_WHITESPACE = " \t\n\r"
+
+_decoder = json.JSONDecoder()
+
+
+class _ChunkReader:
+    """
+    Sliding text buffer over a file, refilled on demand
+    """
+
+    def __init__(self, fh, chunk_size: int):
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fh.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop what was already consumed so the buffer stays about one chunk long
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Next non-whitespace character, without consuming it ("" at end of file)
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"parcel_indices.json: expected {char!r}, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the next JSON value, reading more input while it is incomplete
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number could be cut at the chunk boundary, make sure it really ended
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_parcel_indices(path: str, chunk_size: int = 1 << 20):
+    """
+    Yields (parcel_id, records) for every parcel in parcel_indices.json
+    """
+    with open(path, "r") as fh:
+        reader = _ChunkReader(fh, chunk_size)
+        reader.expect("{")
+
+        if reader.peek() == "}":
+            return
+
+        while True:
+            parcel_id = reader.value()
+            reader.expect(":")
+            reader.expect("[")
+
+            records = []
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    records.append(reader.value())
+                    if reader.peek() == ",":
+                        reader.pos += 1
+                        continue
+                    reader.expect("]")
+                    break
+
+            yield parcel_id, records
+
+            if reader.peek() == ",":
+                reader.pos += 1
+                continue
+            reader.expect("}")
+            return
@@ -0,0 +1,365 @@
+"""
+timeseries.py
+Column-oriented storage for parcel monitoring indices.
+Each parcel keeps one date array (date ordinals, sorted ascending) plus one
+float array per metric. Records are sorted once at load time, so the latest
+observation is simply the last element and range / as-of queries are a
+binary search over the date column.
+Missing values are stored as NaN and given back as None.
+Per-metric prefix sums (of the values and of the non-missing count) are built
+on the first trend query and kept up to date on appends, so the mean and the
+first / last value of any date range cost O(log n).
+Readers never lock: each query reads one consistent _Columns. Writers take the
+series' own lock and either append in place (date last) or publish new columns.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from math import isnan
+
+METRICS = ("ndvi", "ndmi", "ndwi", "soc", "nitrogen", "phosphorus", "potassium", "ph")
+
+MISSING = float("nan")
+
+
+def to_ordinal(day) -> int:
+    """
+    Accepts an ISO date string, a date or an already computed ordinal
+    """
+    if isinstance(day, int):
+        return day
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.toordinal()
+
+
+def _to_float(v) -> float:
+    return MISSING if v is None else float(v)
+
+
+class _Columns:
+    """
+    One consistent state of a series: the date column, the metric columns and
+    their prefix sums. Readers take it once and never lock; writers append to
+    it in place (date last, so nothing is shorter than the dates) or publish
+    a new one with a single assignment
+    """
+    __slots__ = ("dates", "columns", "prefix")
+
+    def __init__(self, dates, columns: dict):
+        self.dates = dates
+        self.columns = columns
+        # {metric: (sums, counts)} once built, see ParcelTimeSeries._prefix_sums
+        self.prefix = None
+
+    def record(self, i: int) -> dict:
+        rec = {"date": date.fromordinal(self.dates[i]).isoformat()}
+        for m in METRICS:
+            v = self.columns[m][i]
+            rec[m] = None if isnan(v) else v
+        return rec
+
+    def index_range(self, start=None, end=None) -> tuple:
+        lo = 0 if start is None else bisect_left(self.dates, to_ordinal(start))
+        hi = len(self.dates) if end is None else bisect_right(self.dates, to_ordinal(end))
+        return lo, max(lo, hi)
+
+    def copy(self) -> "_Columns":
+        return _Columns(array("i", self.dates), {m: array("d", self.columns[m]) for m in METRICS})
+
+
+class ParcelTimeSeries:
+    __slots__ = ("_data", "version", "_lock")
+
+    def __init__(self):
+        self._data = _Columns(array("i"), {m: array("d") for m in METRICS})
+        # bumped on every change, lets caches detect stale entries
+        self.version = 0
+        # taken by writers and prefix sum builds of this series; reads never wait for it
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records: list):
+        series = cls()
+        for r in sorted(records, key=lambda r: r["date"]):
+            series.append(r)
+        return series
+
+    @classmethod
+    def from_columns(cls, dates, columns: dict):
+        """
+        Wraps already sorted columns without copying them.
+        Any sequence works (e.g. memoryviews over a snapshot); they are turned
+        into private arrays on the first write
+        """
+        series = cls.__new__(cls)
+        series._data = _Columns(dates, columns)
+        series.version = 0
+        series._lock = threading.Lock()
+        return series
+
+    @property
+    def dates(self):
+        return self._data.dates
+
+    @property
+    def columns(self) -> dict:
+        return self._data.columns
+
+    def arrays(self) -> tuple:
+        """
+        (dates, metric -> values) of one consistent state, cut to the same length
+        """
+        data = self._data
+        n = len(data.dates)
+        return data.dates[:n], {m: data.columns[m][:n] for m in METRICS}
+
+    def __len__(self):
+        return len(self._data.dates)
+
+    def record(self, i: int) -> dict:
+        """
+        Rebuilds the i-th observation as the dict shape stored in parcel_indices.json
+        """
+        return self._data.record(i)
+
+    def latest(self):
+        data = self._data
+        if not data.dates:
+            return None
+        return data.record(len(data.dates) - 1)
+
+    def as_of(self, day):
+        """
+        Latest observation taken on or before the given day
+        """
+        data = self._data
+        i = bisect_right(data.dates, to_ordinal(day))
+        if i == 0:
+            return None
+        return data.record(i - 1)
+
+    def index_range(self, start=None, end=None) -> tuple:
+        """
+        Positions [lo, hi) of the observations with start <= date <= end
+        """
+        return self._data.index_range(start, end)
+
+    def range(self, start=None, end=None) -> list:
+        data = self._data
+        lo, hi = data.index_range(start, end)
+        return [data.record(i) for i in range(lo, hi)]
+
+    def nbytes(self) -> int:
+        """
+        Size of the column buffers, used for load statistics
+        """
+        data = self._data
+        total = len(data.dates) * data.dates.itemsize
+        for col in data.columns.values():
+            total += len(col) * col.itemsize
+        return total
+
+    def to_records(self) -> list:
+        data = self._data
+        return [data.record(i) for i in range(len(data.dates))]
+
+    def append(self, record: dict):
+        """
+        Adds one observation. Newer-than-latest dates (the normal case) are a
+        plain append; an older date is inserted into a copy of the columns,
+        never re-sorted
+        """
+        with self._lock:
+            self._append_locked(to_ordinal(record["date"]), record)
+
+    def _append_locked(self, day: int, record: dict):
+        data = self._data
+        if data.dates and day < data.dates[-1]:
+            # readers keep using the current columns until the new ones are published
+            data = data.copy()
+            i = bisect_right(data.dates, day)
+            for m in METRICS:
+                data.columns[m].insert(i, _to_float(record.get(m)))
+            data.dates.insert(i, day)
+            self._data = data
+        else:
+            if not isinstance(data.dates, array):
+                data = self._data = data.copy()
+            # readers size everything by len(dates), so the date goes in last:
+            # the columns and prefix sums are never shorter
+            for m in METRICS:
+                data.columns[m].append(_to_float(record.get(m)))
+            if data.prefix is not None:
+                # extend the prefix sums instead of rebuilding them
+                for m, (sums, counts) in data.prefix.items():
+                    v = data.columns[m][-1]
+                    missing = isnan(v)
+                    sums.append(sums[-1] + (0.0 if missing else v))
+                    counts.append(counts[-1] + (0 if missing else 1))
+            data.dates.append(day)
+        self.version += 1
+
+    def _prefix_sums(self, data: _Columns) -> dict:
+        """
+        metric -> (sums, counts) where sums[i] / counts[i] cover the first i
+        observations, missing values excluded
+        """
+        if data.prefix is not None:
+            return data.prefix
+
+        # built under the lock, so no append lands halfway through
+        with self._lock:
+            if data.prefix is None:
+                prefix = {}
+                for m in METRICS:
+                    sums = array("d", [0.0])
+                    counts = array("i", [0])
+                    total, n = 0.0, 0
+                    for v in data.columns[m]:
+                        if not isnan(v):
+                            total += v
+                            n += 1
+                        sums.append(total)
+                        counts.append(n)
+                    prefix[m] = (sums, counts)
+                data.prefix = prefix
+            return data.prefix
+
+    def trend(self, metric: str, start=None, end=None):
+        """
+        How one metric moved between start and end (inclusive dates):
+        first / last value, delta, mean, min and max of the observations in range.
+        None if the metric has no value in range
+        """
+        return self._trend(self._data, metric, start, end)
+
+    def _trend(self, data: _Columns, metric: str, start, end):
+        lo, hi = data.index_range(start, end)
+        sums, counts = self._prefix_sums(data)[metric]
+        n = counts[hi] - counts[lo]
+        if n == 0:
+            return None
+
+        # counts only grows on a non-missing value: binary search for the first / last one
+        first = bisect_right(counts, counts[lo]) - 1
+        last = bisect_left(counts, counts[hi]) - 1
+        column = data.columns[metric]
+        values = [v for v in column[first:last + 1] if not isnan(v)]
+        return {
+            "metric": metric,
+            "count": n,
+            "first_date": date.fromordinal(data.dates[first]).isoformat(),
+            "first": column[first],
+            "last_date": date.fromordinal(data.dates[last]).isoformat(),
+            "last": column[last],
+            "delta": column[last] - column[first],
+            "mean": (sums[hi] - sums[lo]) / n,
+            "min": min(values),
+            "max": max(values),
+        }
+
+    def trends(self, start=None, end=None) -> dict:
+        data = self._data
+        return {m: self._trend(data, m, start, end) for m in METRICS}
+
+    def upsert(self, record: dict) -> str:
+        """
+        Append, or replace the observation with the same date.
+        Returns "inserted", "updated" or "unchanged" (same date and same values)
+        """
+        day = to_ordinal(record["date"])
+        values = {m: _to_float(record.get(m)) for m in METRICS}
+        with self._lock:
+            data = self._data
+            i = bisect_left(data.dates, day)
+            if i == len(data.dates) or data.dates[i] != day:
+                self._append_locked(day, record)
+                return "inserted"
+
+            if all(_same(data.columns[m][i], values[m]) for m in METRICS):
+                return "unchanged"
+
+            # a copy, so no reader mixes old and new values (or prefix sums)
+            data = data.copy()
+            for m in METRICS:
+                data.columns[m][i] = values[m]
+            self._data = data
+            self.version += 1
+        return "updated"
+
+
+def _same(a: float, b: float) -> bool:
+    return a == b or (isnan(a) and isnan(b))
+
+
+class IndicesStore:
+    """
+    parcel_id -> ParcelTimeSeries
+    Replaces the raw dict of record lists previously held in PARCELS_INDICES
+    """
+
+    def __init__(self):
+        self._series = {}
+
+    @classmethod
+    def from_dict(cls, raw: dict):
+        store = cls()
+        for parcel_id, records in raw.items():
+            store._series[parcel_id] = ParcelTimeSeries.from_records(records)
+        return store
+
+    def __contains__(self, parcel_id):
+        return parcel_id in self._series
+
+    def __getitem__(self, parcel_id) -> ParcelTimeSeries:
+        return self._series[parcel_id]
+
+    def __iter__(self):
+        return iter(self._series)
+
+    def __len__(self):
+        return len(self._series)
+
+    def get(self, parcel_id, default=None):
+        return self._series.get(parcel_id, default)
+
+    def items(self):
+        return self._series.items()
+
+    def put(self, parcel_id: str, series: ParcelTimeSeries):
+        self._series[parcel_id] = series
+
+    def record_count(self) -> int:
+        return sum(len(s) for s in self._series.values())
+
+    def nbytes(self) -> int:
+        return sum(s.nbytes() for s in self._series.values())
+
+    def latest(self, parcel_id: str):
+        series = self._series.get(parcel_id)
+        if series is None:
+            return None
+        return series.latest()
+
+    def trends(self, parcel_id: str, start=None, end=None):
+        series = self.get(parcel_id)
+        if series is None:
+            return None
+        return series.trends(start, end)
+
+    def _series_for_write(self, parcel_id: str) -> ParcelTimeSeries:
+        series = self.get(parcel_id)
+        if series is None:
+            series = ParcelTimeSeries()
+            self.put(parcel_id, series)
+        return series
+
+    def append(self, parcel_id: str, record: dict):
+        series = self._series_for_write(parcel_id)
+        series.append(record)
+        return series
+
+    def upsert(self, parcel_id: str, record: dict) -> str:
+        return self._series_for_write(parcel_id).upsert(record)
@@ -1,7 +1,10 @@
+import asyncio
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from app.api.routes import message_router, report_routes
+from app.api.routes import message_router, report_routes, analytics_routes, ingest_routes, metrics_routes
 from fastapi.middleware.cors import CORSMiddleware  # <-- ADD
+from app.api.middleware import PinDatasetMiddleware
 
 load_dotenv()
 app = FastAPI()
@@ -23,7 +26,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# every request reads one consistent dataset, even across a hot reload
+app.add_middleware(PinDatasetMiddleware)
+
 from app.data_loader import data_manager
+from app.services import delivery, report_pool, report_scheduler
+from app.storage import state_store
 
 
 @app.on_event("startup")
@@ -32,6 +40,34 @@ def startup_event():
     On application startup: load all data from JSON files into memory
     """
     data_manager.load_data()
+    report_scheduler.scheduler.rebuild()
+    # reload the data files in the background when they change
+    data_manager.start_watcher()
+    # outbound report messages
+    delivery.queue.start()
+
+
+@app.on_event("startup")
+async def start_report_scheduler():
+    """
+    Background task that sends periodic reports as they come due
+    """
+    if report_scheduler.REPORT_SCHEDULER:
+        app.state.report_task = asyncio.create_task(report_scheduler.run())
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    On shutdown: write any batched state changes before the worker exits
+    """
+    data_manager.stop_watcher()
+    task = getattr(app.state, "report_task", None)
+    if task is not None:
+        task.cancel()
+    delivery.queue.stop()
+    report_pool.shutdown()
+    state_store.backend.close()
 
 
 """
@@ -39,6 +75,12 @@ register backend API routes:
  /message  -> chatbot conversation logic
  /generate-reports -> scheduled reporting simulator
  /debug/state  ->internal application state viewer
+ /analytics/... -> portfolio aggregates for dashboards
+ /ingest/indices -> new index observations (NDJSON)
+ /metrics -> Prometheus metrics (stage timings, intents, caches)
 """
 app.include_router(message_router.router)
 app.include_router(report_routes.router)
+app.include_router(analytics_routes.router)
+app.include_router(ingest_routes.router)
+app.include_router(metrics_routes.router)
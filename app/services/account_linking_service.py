@@ -27,8 +27,7 @@ def try_link_account(phone: str, text: str) -> str:
                 "Please type your username to link your account.")
 
     # Find farmer by username
-    farmer = next((f for f in data_manager.FARMERS
-                   if f["username"].lower() == username_input), None)
+    farmer = data_manager.REPO.get_farmer_by_username(username_input)
 
     if not farmer:
         return "Username not found."
@@ -45,7 +44,10 @@ def try_link_account(phone: str, text: str) -> str:
             return "This account is already linked to a different phone number."
 
     # CASE B: Farmer has no phone yet
-    farmer["phone"] = phone
+    # the first phone to claim the farmer in the state store gets it; the claim
+    # is shared by every worker and survives restarts and data reloads
+    if state_store.farmer_phone.claim(farmer["id"], phone) != phone:
+        return "This account is already linked to a different phone number."
     state_store.phone_to_farmer[phone] = farmer["id"]
     state_store.pending_linking.discard(phone)
 
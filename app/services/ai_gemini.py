@@ -0,0 +1,29 @@
+"""
+ai_gemini.py
+Gemini provider for ai_service. Kept in its own module because importing the
+google-genai SDK is the slowest part of starting the app; ai_service only
+imports this the first time a model call is made with AI_BACKEND=gemini.
+"""
+import os
+
+from google import genai
+
+from app.services.ai_service import MODEL, AIProvider
+
+
+class GeminiBackend(AIProvider):
+    """
+    Real model calls through the google-genai SDK
+    """
+
+    def __init__(self):
+        self.client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+    @staticmethod
+    def _config(json_output: bool):
+        return {"response_mime_type": "application/json"} if json_output else None
+
+    async def agenerate(self, contents: str, json_output: bool = False) -> str:
+        response = await self.client.aio.models.generate_content(
+            model=MODEL, contents=contents, config=self._config(json_output))
+        return response.text
@@ -1,6 +1,5 @@
-from app.services import parcels_service
-from app.services.parcel_summary_service import build_parcel_summary
-from app.storage import state_store
+from app.services import parcels_service, report_service
+from app.services.parcel_summary_service import build_parcel_summary, build_parcel_trend
 
 def handle_intent(intent_obj, farmer_id, phone):
     """
@@ -24,15 +23,26 @@ def handle_intent(intent_obj, farmer_id, phone):
         return {"type": "PARCEL_DETAILS", "error": error, "data": details}
 
     if intent == "PARCEL_STATUS":
-        summary, error = build_parcel_summary(parcel_id)
-        return {"type": "PARCEL_STATUS", "error": error, "data": summary}
+        # a farmer cannot see another farmer s parcels
+        parcel, error = parcels_service.check_parcel_access(farmer_id, parcel_id)
+        summary = None
+        if not error:
+            summary, error = build_parcel_summary(parcel_id)
+        return {"type": "PARCEL_STATUS", "parcel_id": parcel_id, "error": error, "data": summary}
+
+    if intent == "PARCEL_TREND":
+        parcel, error = parcels_service.check_parcel_access(farmer_id, parcel_id)
+        trend = None
+        if not error:
+            trend, error = build_parcel_trend(parcel_id, parcels_service.trend_days(intent_obj.get("days")))
+        return {"type": "PARCEL_TREND", "parcel_id": parcel_id, "error": error, "data": trend}
 
     if intent == "SET_REPORT_FREQUENCY":
-        state_store.report_freq[farmer_id] = frequency
+        report_service.set_report_frequency(farmer_id, frequency)
         return {"type": "SET_REPORT_FREQUENCY", "frequency": frequency}
 
     if intent == "STOP_REPORTS":
-        state_store.report_freq.pop(farmer_id, None)
+        report_service.stop_reports(farmer_id)
         return {"type": "STOP_REPORTS"}
 
     return {"type": "UNKNOWN"}
\ No newline at end of file
@@ -1,14 +1,10 @@
-from app.services.ai_service import call_ai
+from app.services.ai_service import call_ai_async
 
 
-def ai_format_response(intent_result):
+def _fixed_reply(t):
     """
-    Formats chatbot responses when AI mode is enabled
-    For simple deterministic cases (greeting / unknown) it returns fixed text
-    For anything else, it delegates message phrasing to the AI
+    Deterministic replies that never need the AI
     """
-    t = intent_result.get("type")
-
     if t == "GREETING":
         return (
             "Welcome to the CO2 Angels Farm Assistant!\n"
@@ -16,6 +12,7 @@ def ai_format_response(intent_result):
             "• Show my parcels\n"
             "• Show parcel P2 details\n"
             "• How is parcel P1 doing?\n"
+            "• How has P1 changed over the last 30 days?\n"
             "• Set weekly reports\n"
             "• Stop reports"
         )
@@ -29,7 +26,24 @@ def ai_format_response(intent_result):
             "- Set daily reports"
         )
 
-    prompt = f"""You are a helpful agricultural assistant. You will receive structured JSON data.
+    return None
+
+
+def _format_prompt(intent_result):
+    return f"""You are a helpful agricultural assistant. You will receive structured JSON data.
     Generate a friendly message for the farmer. Be short, clear, and human.
     DATA: {intent_result}"""
-    return call_ai(prompt)
+
+
+async def ai_format_response_async(intent_result):
+    """
+    Formats chatbot responses when AI mode is enabled
+    For simple deterministic cases (greeting / unknown) it returns fixed text
+    For anything else, it delegates message phrasing to the AI, without
+    blocking the event loop on the call
+    """
+    fixed = _fixed_reply(intent_result.get("type"))
+    if fixed is not None:
+        return fixed
+
+    return await call_ai_async(_format_prompt(intent_result), payload=intent_result)
@@ -1,15 +1,31 @@
-import os
+import asyncio
+import hashlib
 import json
-from google import genai
+import os
+import re
+import threading
 from dotenv import load_dotenv
 
+from app.data_loader import data_manager
+from app.services.cache import LRUCache
+
 
 # Load API key from .env
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 MODEL = "models/gemini-2.5-flash"
 
+# async pipeline limits: seconds per AI call (including waiting for a slot)
+# and how many AI calls may be in flight at once
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "10"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+
+# farmers repeat the same phrases, and the same data gives the same reply,
+# so model answers are cached (entries, seconds)
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "10000"))
+AI_PARSE_CACHE_TTL = float(os.getenv("AI_PARSE_CACHE_TTL", "3600"))
+AI_FORMAT_CACHE_TTL = float(os.getenv("AI_FORMAT_CACHE_TTL", "600"))
+
 # force the AI to behave like a intent classifier
 SYSTEM_PROMPT = """
 You are an intent classifier for a farmer assistant chatbot.
@@ -19,9 +35,10 @@ Never include explanations or markdown.
 
 JSON schema:
 {
-  "intent": "GREETING | LIST_PARCELS | PARCEL_DETAILS | PARCEL_STATUS | SET_REPORT_FREQUENCY | STOP_REPORTS | UNKNOWN",
+  "intent": "GREETING | LIST_PARCELS | PARCEL_DETAILS | PARCEL_STATUS | PARCEL_TREND | SET_REPORT_FREQUENCY | STOP_REPORTS | UNKNOWN",
   "parcel_id": "P1 | P2 | null",
-  "frequency": "daily | weekly | monthly | null"
+  "frequency": "daily | weekly | monthly | null",
+  "days": "number of days asked about | null"
 }
 
 Rules:
@@ -30,6 +47,7 @@ Rules:
 - "show P3 / details P3" → PARCEL_DETAILS
     If message contains "parcel Px" or "P<number>" → PARCEL_DETAILS. Extract parcel_id even if intent is UNKNOWN
 - "how is P3 / status / summary" → PARCEL_STATUS
+- "how has P3 changed over the last 30 days / P3 trend" → PARCEL_TREND, days = the period in days
 - contains 'daily/weekly/monthly' → SET_REPORT_FREQUENCY
 - contains 'stop / disable' → STOP_REPORTS
 - otherwise UNKNOWN
@@ -38,30 +56,190 @@ Return ONLY JSON.
 """
 
 
-def parse_message(text: str) -> str:
+class AIProvider:
+    """
+    Interface of the model backends (AI_BACKEND): prompt in, text out
+    """
+
+    async def agenerate(self, contents: str, json_output: bool = False) -> str:
+        raise NotImplementedError
+
+
+class FakeBackend(AIProvider):
+    """
+    Offline stand-in for load tests (AI_BACKEND=fake).
+    Answers instantly or after FAKE_AI_LATENCY seconds, following the
+    keyword rules of SYSTEM_PROMPT
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    @staticmethod
+    def _classify(contents: str) -> str:
+        text = contents.rsplit("User:", 1)[-1].lower()
+        parcel = re.search(r"p\s*\d+", text)
+        parcel_id = parcel.group(0).replace(" ", "").upper() if parcel else None
+        frequency = next((f for f in ("daily", "weekly", "monthly") if f in text), None)
+
+        if frequency:
+            intent = "SET_REPORT_FREQUENCY"
+        elif "stop" in text or "disable" in text:
+            intent = "STOP_REPORTS"
+        elif parcel_id and any(w in text for w in ("changed", "change", "trend")):
+            intent = "PARCEL_TREND"
+        elif parcel_id and any(w in text for w in ("how", "status", "summary")):
+            intent = "PARCEL_STATUS"
+        elif parcel_id:
+            intent = "PARCEL_DETAILS"
+        elif "parcel" in text or "field" in text:
+            intent = "LIST_PARCELS"
+        else:
+            intent = "UNKNOWN"
+        return json.dumps({"intent": intent, "parcel_id": parcel_id, "frequency": frequency})
+
+    def _answer(self, contents: str, json_output: bool) -> str:
+        if json_output:
+            return self._classify(contents)
+        return "Here is your update: " + contents.rsplit("DATA:", 1)[-1].strip()
+
+    async def agenerate(self, contents: str, json_output: bool = False) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._answer(contents, json_output)
+
+
+def _gemini() -> AIProvider:
+    # the SDK is only imported here, not when the app starts
+    from app.services.ai_gemini import GeminiBackend
+
+    return GeminiBackend()
+
+
+# AI_BACKEND name -> factory of the provider
+PROVIDERS = {
+    "gemini": _gemini,
+    "fake": lambda: FakeBackend(float(os.getenv("FAKE_AI_LATENCY", "0"))),
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> AIProvider:
     """
-    Sends the user text to Gemini and returns raw JSON intent result
+    The AI provider, created the first time it is needed: workers that never
+    call the model never import or initialise its SDK
     """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.getenv("AI_BACKEND", "gemini")
+                factory = PROVIDERS.get(name)
+                if factory is None:
+                    raise ValueError(f"Unknown AI backend: {name}")
+                _backend = factory()
+    return _backend
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=f"{SYSTEM_PROMPT}\nUser: \"{text}\"",
-        config={"response_mime_type": "application/json"}
-    )
+_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
 
-    raw = response.text.strip()
+# normalised message text -> intent JSON
+parse_cache = LRUCache(AI_CACHE_SIZE, ttl=AI_PARSE_CACHE_TTL)
+# payload hash -> formatted reply, tagged with the parcel ids it was built from
+format_cache = LRUCache(AI_CACHE_SIZE, ttl=AI_FORMAT_CACHE_TTL)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _payload_key(payload) -> str:
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _parcel_tags(payload) -> set:
+    """
+    Parcel ids mentioned anywhere in the payload ("id" / "parcel_id" keys)
+    """
+    tags = set()
+    stack = [payload]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            for key in ("id", "parcel_id"):
+                if isinstance(item.get(key), str):
+                    tags.add(item[key])
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return tags
+
+
+@data_manager.on_indices_changed
+def _invalidate_parcels(parcel_ids):
+    if parcel_ids is None:
+        format_cache.clear()
+        return
+    for parcel_id in parcel_ids:
+        format_cache.invalidate_tag(parcel_id)
+
+
+def cache_stats() -> dict:
+    return {"parse": parse_cache.stats(), "format": format_cache.stats()}
+
+
+async def _agenerate(contents: str, json_output: bool = False) -> str:
+    """
+    One bounded, time-limited model call.
+    The timeout also covers waiting for a free slot, so a request stuck behind
+    a slow model fails over to the rule logic instead of queueing forever
+    """
+
+    # first call: import / initialise the provider without blocking the event loop
+    provider = _backend or await asyncio.to_thread(get_backend)
+
+    async def call():
+        async with _semaphore:
+            return await provider.agenerate(contents, json_output)
+
+    return await asyncio.wait_for(call(), AI_TIMEOUT)
+
+
+def _clean_json(raw: str) -> str:
+    raw = raw.strip()
+    return raw.replace("```json", "").replace("```", "").strip()
+
+
+async def parse_message_async(text: str) -> str:
+    """
+    Sends the user text to the model and returns the raw JSON intent result.
+    Used by the /message pipeline
+    """
+    key = _normalize(text)
+    cached = parse_cache.get(key)
+    if cached is not None:
+        return cached
 
-    raw = raw.replace("```json", "").replace("```", "").strip()
+    raw = _clean_json(await _agenerate(f"{SYSTEM_PROMPT}\nUser: \"{text}\"", json_output=True))
+    parse_cache.set(key, raw)
     return raw
 
 
-def call_ai(prompt: str) -> str:
+async def call_ai_async(prompt: str, payload=None) -> str:
     """
-    Used when we want gemini to generate a friendly human-like message
+    Used when we want the model to generate a friendly human-like message
+    If the structured payload the prompt was built from is given, the reply is
+    cached on it
     """
+    key = _payload_key(payload) if payload is not None else None
+    if key is not None:
+        cached = format_cache.get(key)
+        if cached is not None:
+            return cached
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=prompt
-    )
-    return response.text.strip()
+    reply = (await _agenerate(prompt)).strip()
+    if key is not None:
+        format_cache.set(key, reply, tags=_parcel_tags(payload))
+    return reply
@@ -0,0 +1,181 @@
+"""
+analytics_service.py
+Portfolio aggregates per farmer and across all farmers:
+area-weighted mean NDVI, parcels per health level for every metric and
+nutrient deficits by crop.
+Everything is computed once from each parcel's latest observation (in bulk, via
+bulk_classifier) and then kept up to date incrementally: when a parcel gets new
+indices only its old contribution is subtracted and the new one added, so
+dashboard queries never touch PARCELS_INDICES.
+"""
+import threading
+
+from app.data_loader import data_manager
+from app.data_loader.timeseries import METRICS
+from app.services import bulk_classifier
+from app.services.parcel_summary_service import LEVEL_NAMES, level
+
+NUTRIENTS = ("nitrogen", "phosphorus", "potassium")
+
+
+class _Contribution:
+    """
+    What one parcel adds to the aggregates
+    """
+    __slots__ = ("parcel_id", "farmer_id", "crop", "area", "ndvi", "levels")
+
+    def __init__(self, parcel, ndvi, levels):
+        self.parcel_id = parcel["id"]
+        self.farmer_id = parcel["farmer_id"]
+        self.crop = parcel["crop"]
+        self.area = float(parcel["area_ha"])
+        self.ndvi = ndvi
+        # metric -> level code or None
+        self.levels = levels
+
+    @property
+    def deficits(self):
+        return [n for n in NUTRIENTS if self.levels[n] == 0]
+
+
+class Aggregate:
+
+    def __init__(self):
+        self.parcels = 0
+        self.area_ha = 0.0
+        self.ndvi_area_sum = 0.0
+        self.ndvi_area = 0.0
+        self.health = {m: {name: 0 for name in LEVEL_NAMES[m] + ("missing",)} for m in METRICS}
+        # crop -> nutrient -> parcels below the adequate level
+        self.deficits_by_crop = {}
+
+    def add(self, c: _Contribution, sign: int = 1):
+        self.parcels += sign
+        self.area_ha += sign * c.area
+        if c.ndvi is not None:
+            self.ndvi_area_sum += sign * c.ndvi * c.area
+            self.ndvi_area += sign * c.area
+
+        for m in METRICS:
+            code = c.levels[m]
+            self.health[m]["missing" if code is None else LEVEL_NAMES[m][code]] += sign
+
+        deficits = c.deficits
+        if deficits:
+            crop = self.deficits_by_crop.setdefault(c.crop, {n: 0 for n in NUTRIENTS})
+            for n in deficits:
+                crop[n] += sign
+
+    def to_dict(self) -> dict:
+        return {
+            "parcels": self.parcels,
+            "area_ha": round(self.area_ha, 2),
+            "area_weighted_ndvi": round(self.ndvi_area_sum / self.ndvi_area, 3) if self.ndvi_area > 1e-9 else None,
+            "health": self.health,
+            "nutrient_deficits_by_crop": {crop: counts for crop, counts in self.deficits_by_crop.items()
+                                          if any(counts.values())},
+        }
+
+
+_lock = threading.Lock()
+_contributions = {}
+_by_farmer = {}
+_total = Aggregate()
+
+
+def _contribution_from_latest(parcel, latest):
+    if latest is None:
+        return _Contribution(parcel, None, {m: None for m in METRICS})
+    return _Contribution(parcel, latest.get("ndvi"), {m: level(m, latest.get(m)) for m in METRICS})
+
+
+def rebuild():
+    """
+    Full computation, used after a (re)load of the data
+    """
+    global _contributions, _by_farmer, _total
+
+    parcels = data_manager.PARCELS
+    parcel_ids, columns = bulk_classifier.latest_metric_arrays([p["id"] for p in parcels])
+    codes = bulk_classifier.classify_bulk(columns)
+
+    contributions = {}
+    by_farmer = {}
+    total = Aggregate()
+    for row, parcel in enumerate(parcels):
+        levels = {}
+        for m in METRICS:
+            code = int(codes[m][row])
+            levels[m] = None if code == bulk_classifier.MISSING else code
+        ndvi = columns["ndvi"][row]
+        c = _Contribution(parcel, None if ndvi != ndvi else float(ndvi), levels)
+
+        contributions[c.parcel_id] = c
+        by_farmer.setdefault(c.farmer_id, Aggregate()).add(c)
+        total.add(c)
+
+    with _lock:
+        _contributions, _by_farmer, _total = contributions, by_farmer, total
+
+
+def update_parcel(parcel_id: str):
+    """
+    Replaces one parcel's contribution after its indices changed
+    """
+    parcel = data_manager.REPO.get_parcel(parcel_id)
+    new = None
+    if parcel is not None:
+        new = _contribution_from_latest(parcel, data_manager.PARCELS_INDICES.latest(parcel_id))
+
+    with _lock:
+        old = _contributions.pop(parcel_id, None)
+        if old is not None:
+            _by_farmer[old.farmer_id].add(old, -1)
+            _total.add(old, -1)
+        if new is not None:
+            _contributions[parcel_id] = new
+            _by_farmer.setdefault(new.farmer_id, Aggregate()).add(new)
+            _total.add(new)
+
+
+@data_manager.on_indices_changed
+def _on_indices_changed(parcel_ids):
+    if parcel_ids is None:
+        rebuild()
+        return
+    for parcel_id in parcel_ids:
+        update_parcel(parcel_id)
+
+
+def portfolio() -> dict:
+    with _lock:
+        return {"farmers": len(_by_farmer), **_total.to_dict()}
+
+
+def farmer(farmer_id: str):
+    with _lock:
+        agg = _by_farmer.get(farmer_id)
+        return None if agg is None else {"farmer_id": farmer_id, **agg.to_dict()}
+
+
+def farmers(offset: int = 0, limit: int = 100) -> list:
+    with _lock:
+        ids = sorted(_by_farmer)[offset:offset + limit]
+        return [{"farmer_id": f, **_by_farmer[f].to_dict()} for f in ids]
+
+
+def parcels_matching(conditions: dict, match_all: bool = False, farmer_id: str | None = None) -> list:
+    """
+    conditions: metric -> level names, e.g. {"ndvi": ["poor"], "nitrogen": ["low"]}
+    For one farmer only that farmer's parcels are classified, from their latest
+    indices; across all farmers it is answered from the precomputed levels
+    """
+    if farmer_id is not None:
+        parcel_ids = [p["id"] for p in data_manager.REPO.get_parcels_for_farmer(farmer_id)]
+        return bulk_classifier.find_parcels(conditions, match_all, parcel_ids)
+
+    wanted = {m: {bulk_classifier.level_code(m, name) for name in names} for m, names in conditions.items()}
+    check = all if match_all else any
+    with _lock:
+        return [c.parcel_id for c in _contributions.values()
+                if check(c.levels[m] in codes for m, codes in wanted.items())]
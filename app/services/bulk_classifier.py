@@ -0,0 +1,72 @@
+"""
+bulk_classifier.py
+Vectorised (NumPy) version of the classify_* functions, for scoring every
+parcel at once ("which parcels have poor vegetation or need nitrogen").
+Uses the same THRESHOLDS / LEVEL_NAMES tables as the scalar path, so both
+always agree. Levels are returned as int8 codes; MISSING (-1) marks parcels
+without a value for that metric.
+"""
+import numpy as np
+
+from app.data_loader import data_manager
+from app.data_loader.timeseries import METRICS
+from app.services.parcel_summary_service import LEVEL_NAMES, THRESHOLDS
+
+MISSING = -1
+
+_BOUNDS = {m: np.asarray(THRESHOLDS[m], dtype=np.float64) for m in METRICS}
+
+
+def classify_bulk(metrics: dict) -> dict:
+    """
+    metric name -> array of values (NaN or None = missing)
+    returns metric name -> int8 array of level codes
+    """
+    res = {}
+    for metric, values in metrics.items():
+        values = np.asarray(values, dtype=np.float64)
+        # side="right": a value equal to a boundary goes to the upper level, like bisect_right
+        codes = np.searchsorted(_BOUNDS[metric], values, side="right").astype(np.int8)
+        codes[np.isnan(values)] = MISSING
+        res[metric] = codes
+    return res
+
+
+def latest_metric_arrays(parcel_ids=None):
+    """
+    Latest observation of every parcel as metric columns.
+    Returns (parcel ids, metric -> float64 array); parcels without data are all NaN
+    """
+    indices = data_manager.PARCELS_INDICES
+    if parcel_ids is None:
+        parcel_ids = [p["id"] for p in data_manager.PARCELS]
+
+    columns = {m: np.full(len(parcel_ids), np.nan) for m in METRICS}
+    for row, parcel_id in enumerate(parcel_ids):
+        series = indices.get(parcel_id)
+        if series is None or not len(series):
+            continue
+        for m in METRICS:
+            columns[m][row] = series.columns[m][-1]
+    return list(parcel_ids), columns
+
+
+def level_code(metric: str, name: str) -> int:
+    return LEVEL_NAMES[metric].index(name)
+
+
+def find_parcels(conditions: dict, match_all: bool = False, parcel_ids=None) -> list:
+    """
+    conditions: metric -> level names, e.g. {"ndvi": ["poor"], "nitrogen": ["low"]}
+    Returns the ids of parcels matching any (or all) of the conditions
+    """
+    parcel_ids, columns = latest_metric_arrays(parcel_ids)
+    codes = classify_bulk({m: columns[m] for m in conditions})
+
+    mask = np.full(len(parcel_ids), match_all, dtype=bool)
+    for metric, names in conditions.items():
+        wanted = [level_code(metric, n) for n in names]
+        hit = np.isin(codes[metric], wanted)
+        mask = mask & hit if match_all else mask | hit
+
+    return [parcel_ids[i] for i in np.flatnonzero(mask)]
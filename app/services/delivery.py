@@ -0,0 +1,348 @@
+"""
+delivery.py
+Outbound queue between report generation and the messaging gateway.
+
+Messages are put in groups (all the phones of one farmer's report); a
+background thread takes them in batches, paces them to DELIVERY_RATE
+messages per second and hands them to a Sender. Messages the sender does not
+acknowledge are retried with exponential backoff, up to DELIVERY_MAX_ATTEMPTS
+times. When every message of a group is acknowledged or given up, the
+group's on_done(acked, failed) callback runs, which is where the report is
+marked as sent: nothing is recorded before the gateway confirmed it.
+
+The queue holds at most DELIVERY_QUEUE_MAX undelivered messages (waiting,
+being sent or waiting for a retry); put() refuses a group that does not fit,
+so producers slow down instead of memory growing.
+
+The queue lives in the process: messages still queued when it stops are lost,
+but their farmers were not marked as sent, so they are due again after a restart.
+
+Senders (DELIVERY_SENDER):
+ - memory (default) -> keeps the last messages in-process, for tests and demos
+ - file -> appends NDJSON lines to DELIVERY_FILE
+"""
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from app.services import metrics
+
+DELIVERY_SENDER = os.getenv("DELIVERY_SENDER", "memory")
+DELIVERY_FILE = os.getenv("DELIVERY_FILE", "outbox.ndjson")
+DELIVERY_QUEUE_MAX = int(os.getenv("DELIVERY_QUEUE_MAX", "10000"))
+DELIVERY_BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", "50"))
+# seconds a batch waits to fill up before it is sent anyway
+DELIVERY_BATCH_WAIT = float(os.getenv("DELIVERY_BATCH_WAIT", "0.05"))
+# messages per second, 0 = no limit
+DELIVERY_RATE = float(os.getenv("DELIVERY_RATE", "80"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_BACKOFF_SECONDS = float(os.getenv("DELIVERY_BACKOFF_SECONDS", "1"))
+DELIVERY_MAX_BACKOFF_SECONDS = float(os.getenv("DELIVERY_MAX_BACKOFF_SECONDS", "300"))
+
+# window of the throughput figure in stats()
+_THROUGHPUT_WINDOW = 60.0
+
+
+class Sender:
+    """
+    Interface every sender implements
+    """
+
+    def send_batch(self, messages: list) -> list:
+        """
+        Sends the messages ({"to", "farmer_id", "message"}), returns one bool
+        per message: True once the gateway acknowledged it. Raising means
+        that none of them was sent
+        """
+        raise NotImplementedError
+
+
+class MemorySender(Sender):
+    """
+    In-process stub. fail_rate makes a share of the messages fail, to see the
+    retries at work
+    """
+
+    def __init__(self, keep: int = 1000, fail_rate: float = 0.0):
+        self.sent = deque(maxlen=keep)
+        self.fail_rate = fail_rate
+
+    def send_batch(self, messages):
+        acks = [random.random() >= self.fail_rate for _ in messages]
+        self.sent.extend(m for m, ok in zip(messages, acks) if ok)
+        return acks
+
+
+class FileSender(Sender):
+    """
+    Appends one JSON line per message; a message is acknowledged once it is
+    flushed to disk
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send_batch(self, messages):
+        with open(self.path, "a", encoding="utf-8") as out:
+            out.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages))
+            out.flush()
+            os.fsync(out.fileno())
+        return [True] * len(messages)
+
+
+def create_sender(name: str, path: str = DELIVERY_FILE) -> Sender:
+    if name == "memory":
+        return MemorySender()
+    if name == "file":
+        return FileSender(path)
+    raise ValueError(f"Unknown delivery sender: {name}")
+
+
+class _Group:
+    __slots__ = ("remaining", "acked", "failed", "on_done")
+
+    def __init__(self, size: int, on_done):
+        self.remaining = size
+        self.acked = 0
+        self.failed = 0
+        self.on_done = on_done
+
+
+class _Delivery:
+    __slots__ = ("message", "group", "attempts", "queued_at")
+
+    def __init__(self, message: dict, group: _Group, queued_at: float):
+        self.message = message
+        self.group = group
+        self.attempts = 0
+        self.queued_at = queued_at
+
+
+class DeliveryQueue:
+
+    def __init__(self, sender: Sender, maxsize: int = DELIVERY_QUEUE_MAX, batch_size: int = DELIVERY_BATCH_SIZE,
+                 batch_wait: float = DELIVERY_BATCH_WAIT, rate: float = DELIVERY_RATE,
+                 max_attempts: int = DELIVERY_MAX_ATTEMPTS, backoff: float = DELIVERY_BACKOFF_SECONDS,
+                 max_backoff: float = DELIVERY_MAX_BACKOFF_SECONDS):
+        self.sender = sender
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._ready = deque()
+        # (retry at, sequence, delivery)
+        self._retry = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        # earliest time the next batch may go out (rate limit)
+        self._next_send_at = 0.0
+
+        self._thread = None
+        self._stopping = threading.Event()
+
+        self.acked = 0
+        self.retried = 0
+        self.dead = 0
+        self.rejected = 0
+        self.batches = 0
+        # monotonic time of recent acks, for the throughput
+        self._acked_at = deque()
+        self._latencies = deque(maxlen=1024)
+        # messages given up on, newest last
+        self.dead_letters = deque(maxlen=1000)
+
+    def __len__(self):
+        with self._cond:
+            return self._depth()
+
+    def _depth(self) -> int:
+        return len(self._ready) + len(self._retry) + self._in_flight
+
+    def put(self, messages: list, on_done=None) -> bool:
+        """
+        Queues the messages as one group. on_done(acked, failed) is called from
+        the delivery thread once all of them are acknowledged or given up.
+        Returns False, queueing nothing, if they do not fit
+        """
+        if not messages:
+            return True
+        now = time.monotonic()
+        group = _Group(len(messages), on_done)
+        with self._cond:
+            if self._depth() + len(messages) > self.maxsize:
+                self.rejected += len(messages)
+                metrics.DELIVERIES.inc(len(messages), result="rejected")
+                return False
+            self._ready.extend(_Delivery(m, group, now) for m in messages)
+            self._cond.notify()
+        return True
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="delivery", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stops the delivery thread after the batch in progress
+        """
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain(self, timeout: float = 5.0) -> bool:
+        """
+        Waits until nothing is left to deliver, returns False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._depth():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.05))
+        return True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self._pace(len(batch))
+            self._send(batch)
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            waited = False
+            while not self._stopping.is_set():
+                now = time.monotonic()
+                while self._retry and self._retry[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._retry)[2])
+
+                # give a small batch a moment to fill up, once
+                if self._ready and (len(self._ready) >= self.batch_size or waited or not self.batch_wait):
+                    n = min(len(self._ready), self.batch_size)
+                    batch = [self._ready.popleft() for _ in range(n)]
+                    self._in_flight += n
+                    return batch
+
+                if self._ready:
+                    timeout = self.batch_wait
+                    waited = True
+                elif self._retry:
+                    timeout = self._retry[0][0] - now
+                else:
+                    timeout = None
+                self._cond.wait(timeout)
+        return []
+
+    def _pace(self, n: int):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        if self._next_send_at > now:
+            self._stopping.wait(self._next_send_at - now)
+        self._next_send_at = max(now, self._next_send_at) + n / self.rate
+
+    def _send(self, batch: list):
+        try:
+            acks = self.sender.send_batch([d.message for d in batch])
+        except Exception as e:
+            print("Delivery batch failed, retrying:", repr(e))
+            acks = [False] * len(batch)
+
+        now = time.monotonic()
+        done = []
+        with self._cond:
+            self.batches += 1
+            self._in_flight -= len(batch)
+            for delivery, ok in zip(batch, acks):
+                delivery.attempts += 1
+                if ok:
+                    self._resolve(delivery, True, now, done)
+                elif delivery.attempts >= self.max_attempts:
+                    self.dead_letters.append(delivery.message)
+                    self._resolve(delivery, False, now, done)
+                else:
+                    self.retried += 1
+                    metrics.DELIVERIES.inc(result="retried")
+                    delay = min(self.max_backoff, self.backoff * 2 ** (delivery.attempts - 1))
+                    # jitter, so messages failing together do not retry together
+                    delay *= random.uniform(0.8, 1.2)
+                    heapq.heappush(self._retry, (now + delay, next(self._seq), delivery))
+            while self._acked_at and self._acked_at[0] < now - _THROUGHPUT_WINDOW:
+                self._acked_at.popleft()
+            self._cond.notify_all()
+
+        # outside the lock: callbacks write state and may put more messages
+        for group in done:
+            try:
+                group.on_done(group.acked, group.failed)
+            except Exception as e:
+                print("Delivery callback failed:", repr(e))
+
+    def _resolve(self, delivery: _Delivery, ok: bool, now: float, done: list):
+        group = delivery.group
+        if ok:
+            latency = now - delivery.queued_at
+            self.acked += 1
+            self._acked_at.append(now)
+            self._latencies.append(latency)
+            metrics.DELIVERY_LATENCY.observe(latency)
+            metrics.DELIVERIES.inc(result="acked")
+            group.acked += 1
+        else:
+            self.dead += 1
+            metrics.DELIVERIES.inc(result="dead")
+            group.failed += 1
+        group.remaining -= 1
+        if group.remaining == 0 and group.on_done is not None:
+            done.append(group)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            recent = sum(1 for t in self._acked_at if t >= now - _THROUGHPUT_WINDOW)
+            latencies = sorted(self._latencies)
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "sender": type(self.sender).__name__,
+                "depth": self._depth(),
+                "max_depth": self.maxsize,
+                "ready": len(self._ready),
+                "in_flight": self._in_flight,
+                "waiting_retry": len(self._retry),
+                "acked": self.acked,
+                "retried": self.retried,
+                "dead": self.dead,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "rate_limit": self.rate,
+                "throughput_per_second": round(recent / _THROUGHPUT_WINDOW, 3),
+                "latency_p50_seconds": _percentile(latencies, 0.5),
+                "latency_p95_seconds": _percentile(latencies, 0.95),
+            }
+
+
+def _percentile(ordered: list, q: float):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+queue = DeliveryQueue(create_sender(DELIVERY_SENDER))
@@ -0,0 +1,156 @@
+"""
+ingestion_service.py
+Adds new satellite / soil observations to the in-memory time series while the
+app runs, without reloading parcel_indices.json.
+Input is NDJSON, one observation per line:
+    {"parcel_id": "P1", "date": "2025-06-01", "ndvi": 0.71, "ndmi": null, ...}
+Ingestion is idempotent on (parcel_id, date): sending the same observation
+again changes nothing, sending new values for an existing date replaces them.
+Only the parcels that actually changed are reported to the
+data_manager.on_indices_changed listeners (caches, analytics).
+"""
+import json
+import math
+import os
+import threading
+from datetime import date
+
+from app.data_loader import data_manager
+from app.data_loader.timeseries import METRICS
+
+# how many rejected lines are described in the response
+MAX_REPORTED_ERRORS = 50
+# longer lines are rejected without being buffered
+INGEST_MAX_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", "65536"))
+
+_ALLOWED_KEYS = frozenset(("parcel_id", "date") + METRICS)
+
+# one writer at a time, readers are not blocked
+_write_lock = threading.Lock()
+
+
+def validate(obj):
+    """
+    Returns (parcel_id, record) or raises ValueError with the reason
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("observation must be a JSON object")
+
+    unknown = set(obj) - _ALLOWED_KEYS
+    if unknown:
+        raise ValueError(f"unknown fields: {sorted(unknown)}")
+
+    parcel_id = obj.get("parcel_id")
+    if not isinstance(parcel_id, str) or data_manager.REPO.get_parcel(parcel_id) is None:
+        raise ValueError(f"unknown parcel_id: {parcel_id!r}")
+
+    day = obj.get("date")
+    try:
+        date.fromisoformat(day)
+    except (TypeError, ValueError):
+        raise ValueError(f"date must be YYYY-MM-DD, got {day!r}")
+
+    record = {"date": day}
+    for m in METRICS:
+        v = obj.get(m)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or not math.isfinite(v)):
+            raise ValueError(f"{m} must be a number or null, got {v!r}")
+        record[m] = v
+
+    if all(record[m] is None for m in METRICS):
+        raise ValueError("observation has no metric values")
+
+    return parcel_id, record
+
+
+class IngestBatch:
+    """
+    Accumulates the outcome of one request; lines can be fed as they arrive
+    """
+
+    def __init__(self, max_line_bytes: int = INGEST_MAX_LINE_BYTES):
+        self.line_no = 0
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0}
+        self.errors = []
+        self.changed = set()
+        self.max_line_bytes = max_line_bytes
+        # start of a line whose end has not arrived yet
+        self._partial = bytearray()
+        self._oversized = False
+
+    def feed_chunk(self, chunk: bytes):
+        """
+        Raw body bytes as they arrive: every complete line is fed, the rest of
+        the chunk waits for the next one
+        """
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                self._buffer(chunk[start:])
+                return
+            self._buffer(chunk[start:end])
+            self._end_line()
+            start = end + 1
+
+    def _buffer(self, part: bytes):
+        if self._oversized or not part:
+            return
+        if len(self._partial) + len(part) > self.max_line_bytes:
+            # the rest of this line is dropped as it arrives
+            self._oversized = True
+            self._partial.clear()
+            return
+        self._partial += part
+
+    def _end_line(self):
+        if self._oversized:
+            self._oversized = False
+            self.line_no += 1
+            self._reject(f"line longer than {self.max_line_bytes} bytes")
+            return
+        line = self._partial.decode("utf-8", errors="replace")
+        self._partial.clear()
+        self.feed(line)
+
+    def _reject(self, error: str):
+        self.counts["rejected"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": self.line_no, "error": error})
+
+    def feed(self, line: str):
+        self.line_no += 1
+        if not line.strip():
+            return
+        try:
+            parcel_id, record = validate(json.loads(line))
+        except ValueError as e:  # JSONDecodeError is a ValueError too
+            self._reject(str(e))
+            return
+
+        with _write_lock:
+            outcome = data_manager.PARCELS_INDICES.upsert(parcel_id, record)
+        self.counts[outcome] += 1
+        if outcome != "unchanged":
+            self.changed.add(parcel_id)
+
+    def finish(self) -> dict:
+        # last line without a trailing newline
+        if self._partial or self._oversized:
+            self._end_line()
+        # one notification for the whole batch, only for parcels that changed
+        if self.changed:
+            data_manager.notify_indices_changed(sorted(self.changed))
+        return {
+            "lines": self.line_no,
+            **self.counts,
+            "parcels_changed": len(self.changed),
+            "errors": self.errors,
+        }
+
+
+def ingest_lines(lines) -> dict:
+    batch = IngestBatch()
+    for line in lines:
+        batch.feed(line)
+    return batch.finish()
@@ -0,0 +1,235 @@
+"""
+intent_classifier.py
+Rule based intent detection shared by message_router and the AI fast path.
+
+A message is tokenised once: it is lowercased and split a single time, and
+one precompiled regex scans it for every keyword, parcel id and period
+("last 2 weeks") in one pass. The keywords are compiled into a prefix trie,
+so the cost of the scan depends on the length of the message, not on how
+many keywords / intents exist.
+
+route() turns the tokens into a typed Intent with the precedence of the rule
+based router. classify() returns the SYSTEM_PROMPT JSON schema plus a
+confidence score; in AI mode only messages below FAST_PATH_THRESHOLD are
+sent to the model.
+"""
+import os
+import re
+import threading
+from typing import NamedTuple
+
+from app.services import parcels_service
+
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.8"))
+
+# keyword -> kind, matched anywhere in the text ("hi" also matches "this")
+KEYWORDS = {
+    "hello": "greeting", "hi": "greeting", "hey": "greeting", "salut": "greeting",
+    "good morning": "greeting", "good evening": "greeting",
+    "daily": "frequency", "weekly": "frequency", "monthly": "frequency",
+    "stop": "stop", "disable": "stop",
+    "parcel": "parcel_word", "field": "parcel_word",
+}
+
+# keyword -> kind, only matched as whole words
+WORD_KEYWORDS = {
+    "changed": "trend", "change": "trend", "changes": "trend", "trend": "trend",
+    "trends": "trend", "evolution": "trend", "evolved": "trend",
+}
+
+_STATUS_WORDS = frozenset(("how", "status", "summary"))
+_DETAILS_WORDS = frozenset(("show", "details", "detail", "info"))
+_LIST_WORDS = frozenset(("show", "list", "my", "all"))
+
+# the router checks the frequencies in this order
+_FREQUENCIES = ("daily", "weekly", "monthly")
+_PERIOD_DAYS = {"day": 1, "week": 7, "month": 30}
+
+_stats_lock = threading.Lock()
+STATS = {"fast_path": 0, "model": 0}
+
+
+def _trie_pattern(words) -> str:
+    """
+    Regex alternation of the words, factored as a prefix trie, e.g.
+    ("daily", "disable") -> d(?:aily|isable)
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        alt = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # greedy, so the longest keyword wins ("changes" over "change")
+        return f"(?:{alt})?" if "" in node else alt
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    One compiled regex finding every keyword, parcel id and period of a text.
+    A lookahead is matched at each position so overlapping keywords are all found
+    """
+
+    def __init__(self, keywords: dict, word_keywords: dict):
+        self.kinds = {**keywords, **word_keywords}
+        self.pattern = re.compile(
+            r"(?=(?P<kw>" + _trie_pattern(keywords) + r")"
+            r"|\b(?P<word>" + _trie_pattern(word_keywords) + r")\b"
+            r"|(?P<parcel>p\s*\d+)"
+            r"|(?P<n>\d+)\s*(?P<unit>day|week|month))"
+        )
+
+    def scan(self, text_lower: str) -> tuple:
+        """
+        Returns ({kind: [keywords in order of appearance]}, first parcel id, first period in days)
+        """
+        hits = {}
+        parcel_id = None
+        period = None
+        for m in self.pattern.finditer(text_lower):
+            keyword = m.group("kw") or m.group("word")
+            if keyword:
+                hits.setdefault(self.kinds[keyword], []).append(keyword)
+            elif m.group("parcel"):
+                if parcel_id is None:
+                    parcel_id = m.group("parcel").replace(" ", "").upper()
+            elif m.group("n") and period is None:
+                period = int(m.group("n")) * _PERIOD_DAYS[m.group("unit")]
+        return hits, parcel_id, period
+
+
+_MATCHER = KeywordMatcher(KEYWORDS, WORD_KEYWORDS)
+
+
+class Message:
+    """
+    Everything the rules need from one message, computed once
+    """
+    __slots__ = ("text_lower", "words", "word_set", "hits", "parcel_id", "period")
+
+    def __init__(self, text: str, matcher: KeywordMatcher = _MATCHER):
+        self.text_lower = text.strip().lower()
+        self.words = self.text_lower.split()
+        self.word_set = frozenset(self.words)
+        self.hits, self.parcel_id, self.period = matcher.scan(self.text_lower)
+
+    def has(self, kind: str) -> bool:
+        return kind in self.hits
+
+    @property
+    def greeting(self) -> bool:
+        # only a message made of the greeting itself: "hello show parcels" is not one
+        return self.has("greeting") and len(self.words) <= 2
+
+    @property
+    def trend_days(self):
+        if not self.has("trend"):
+            return None
+        # clamped like the model's answer on the AI path
+        return parcels_service.trend_days(self.period)
+
+
+def tokenize(text: str) -> Message:
+    return Message(text)
+
+
+class Intent(NamedTuple):
+    name: str
+    parcel_id: str | None = None
+    frequency: str | None = None
+    days: int | None = None
+
+    def as_dict(self) -> dict:
+        """
+        The SYSTEM_PROMPT JSON schema, as returned by the model
+        """
+        return {"intent": self.name, "parcel_id": self.parcel_id, "frequency": self.frequency, "days": self.days}
+
+
+def route(message: Message) -> Intent:
+    """
+    Intent of a message with the precedence of the rule based router
+    """
+    if message.greeting:
+        return Intent("GREETING")
+
+    frequencies = message.hits.get("frequency")
+    if frequencies:
+        return Intent("SET_REPORT_FREQUENCY", frequency=next(f for f in _FREQUENCIES if f in frequencies))
+
+    if message.has("stop"):
+        return Intent("STOP_REPORTS")
+
+    parcel_id = message.parcel_id
+    if parcel_id:
+        days = message.trend_days
+        if days:
+            return Intent("PARCEL_TREND", parcel_id, days=days)
+        if _STATUS_WORDS & message.word_set:
+            return Intent("PARCEL_STATUS", parcel_id)
+        return Intent("PARCEL_DETAILS", parcel_id)
+
+    if message.has("parcel_word"):
+        return Intent("LIST_PARCELS")
+
+    return Intent("UNKNOWN")
+
+
+def classify(message):
+    """
+    Accepts the text or an already tokenised Message.
+    Returns (intent dict, confidence between 0 and 1)
+    """
+    if isinstance(message, str):
+        message = tokenize(message)
+    intent = route(message)
+    name = intent.name
+    words = message.word_set
+
+    if name == "GREETING":
+        confidence = 1.0
+    elif name == "SET_REPORT_FREQUENCY":
+        # "stop weekly reports" or "daily or weekly?" are left to the model
+        frequencies = message.hits["frequency"]
+        confidence = 0.95 if len(set(frequencies)) == 1 and not message.has("stop") else 0.5
+        # the model is given the first one mentioned
+        intent = intent._replace(frequency=frequencies[0])
+    elif name == "STOP_REPORTS":
+        confidence = 0.95
+    elif name == "PARCEL_TREND":
+        confidence = 0.9
+    elif name == "PARCEL_STATUS":
+        confidence = 0.95
+    elif name == "PARCEL_DETAILS":
+        # "P3" or "show P3 details" are clear, a long sentence mentioning P3 is not
+        confidence = 0.9 if len(message.words) <= 4 or _DETAILS_WORDS & words else 0.7
+    elif name == "LIST_PARCELS":
+        confidence = 0.9 if _LIST_WORDS & words else 0.75
+    else:
+        confidence = 0.0
+
+    return intent.as_dict(), confidence
+
+
+def record(fast_path: bool):
+    with _stats_lock:
+        STATS["fast_path" if fast_path else "model"] += 1
+
+
+def stats() -> dict:
+    with _stats_lock:
+        total = STATS["fast_path"] + STATS["model"]
+        return {
+            **STATS,
+            "total": total,
+            "hit_rate": round(STATS["fast_path"] / total, 4) if total else 0.0,
+            "threshold": FAST_PATH_THRESHOLD,
+        }
@@ -0,0 +1,154 @@
+"""
+metrics.py
+Low-overhead timing histograms and counters, exposed in the Prometheus text
+format by GET /metrics (see metrics_routes).
+Recording a sample is a perf_counter difference, a bisect over the bucket
+bounds and a few additions under a lock, so it can stay on in production.
+
+    with metrics.stage("summary"):
+        ...
+    metrics.INTENTS.inc(intent="PARCEL_STATUS", source="rules")
+"""
+import threading
+import time
+from bisect import bisect_left
+
+PREFIX = "farmer_assistant_"
+
+# seconds, upper bounds of the histogram buckets (+Inf is implicit)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[n] for n in self.labelnames), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def snapshot(self, **labels) -> dict:
+        """
+        count / sum / per-bucket counts of one label set, for debugging
+        """
+        with self._lock:
+            series = self._series.get(tuple(labels[n] for n in self.labelnames))
+            if series is None:
+                return {"count": 0, "sum": 0.0, "buckets": [0] * (len(self.buckets) + 1)}
+            return {"count": series[2], "sum": series[1], "buckets": list(series[0])}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    """
+    Context manager timing a block into a histogram (a plain class is cheaper
+    than a generator based one on the hot path)
+    """
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+STAGE_SECONDS = Histogram("stage_seconds", "Time spent in each stage of request handling", ("stage",))
+INTENTS = Counter("intents_total", "Messages per detected intent and who detected it", ("intent", "source"))
+REPORTS = Counter("reports_total", "Farmers whose periodic report was produced")
+MESSAGE_FAILURES = Counter("message_failures_total", "Batch messages that raised and got an error reply", ("reason",))
+AI_FALLBACKS = Counter("ai_fallbacks_total", "AI calls that failed and fell back to the rule logic", ("reason",))
+DELIVERIES = Counter("deliveries_total", "Outbound messages by outcome (acked, retried, dead, rejected)", ("result",))
+DELIVERY_LATENCY = Histogram("delivery_latency_seconds", "Time from queueing an outbound message to its acknowledgement")
+
+
+def stage(name: str):
+    """
+    Times the block into STAGE_SECONDS{stage=name}
+    """
+    return STAGE_SECONDS.time(stage=name)
+
+
+def render(extra_lines=()) -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
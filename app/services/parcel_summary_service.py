@@ -1,16 +1,54 @@
-from datetime import datetime
-from app.services.parcels_service import get_latest_indices, get_parcel_by_id
+from bisect import bisect_right
+from datetime import datetime, date as date_cls
+from app.services.parcels_service import (get_latest_indices, get_parcel_by_id, get_parcel_trends, get_parcels_for_farmer,
+                                          TREND_DAYS)
+from app.services.reply_cache import cached_reply
+
+# Threshold tables shared by the scalar classifiers below and the vectorised
+# bulk_classifier. For each metric: the boundaries between levels (a value equal
+# to a boundary belongs to the upper level) and the name of every level
+THRESHOLDS = {
+    "ndvi": (0.3, 0.55, 0.75),
+    "ndmi": (0.15, 0.30),
+    "ndwi": (0.10, 0.25),
+    "soc": (1.5, 2.5),
+    "nitrogen": (0.7, 1.0),
+    "phosphorus": (0.35, 0.45),
+    "potassium": (0.55, 0.7),
+    "ph": (5.5, 6.0, 7.0),
+}
+
+LEVEL_NAMES = {
+    "ndvi": ("poor", "moderate", "good", "strong"),
+    "ndmi": ("dry", "average", "good"),
+    "ndwi": ("low", "average", "good"),
+    "soc": ("poor", "moderate", "rich"),
+    "nitrogen": ("low", "adequate", "high"),
+    "phosphorus": ("low", "adequate", "high"),
+    "potassium": ("low", "adequate", "high"),
+    "ph": ("strongly acidic", "slightly acidic", "optimal", "alkaline"),
+}
+
+
+def level(metric: str, v):
+    """
+    Index of the level v falls into, None when the value is missing
+    """
+    if v is None or v != v:
+        return None
+    return bisect_right(THRESHOLDS[metric], v)
 
 
 # Normalized Difference Vegetation Index
 def classify_ndvi(v):
     if v is None:
         return "No vegetation data available."
-    if v < 0.3:
+    lvl = level("ndvi", v)
+    if lvl == 0:
         return f"NDVI is {v}, indicating poor vegetation."
-    if 0.3 <= v < 0.55:
+    if lvl == 1:
         return f"NDVI is {v}, indicating moderate vegetation."
-    if 0.55 <= v < 0.75:
+    if lvl == 2:
         return f"NDVI is {v}, indicating good vegetation"
 
     return f"NDVI is {v}, indicating strong vegetation."
@@ -20,9 +58,10 @@ def classify_ndvi(v):
 def classify_ndmi(v):
     if v is None:
         return "No moisture data available."
-    if v < 0.15:
+    lvl = level("ndmi", v)
+    if lvl == 0:
         return f"NDMI is {v}, indicating dry moisture"
-    if 0.15 <= v < 0.30:
+    if lvl == 1:
         return f"NDMI is {v}, indicating average moisture"
 
     return "NDMI is {v}, indicating good moisture"
@@ -32,9 +71,10 @@ def classify_ndmi(v):
 def classify_ndwi(v):
     if v is None:
         return "No water data available."
-    if v < 0.10:
+    lvl = level("ndwi", v)
+    if lvl == 0:
         return f"Water index (NDWI) is low ({v})."
-    if 0.10 <= v < 0.25:
+    if lvl == 1:
         return f"Water index (NDWI) is average ({v})."
     return f"Water index (NDWI) is good ({v})"
 
@@ -43,9 +83,10 @@ def classify_ndwi(v):
 def classify_soc(v):
     if v is None:
         return "No soil organic carbon data available."
-    if v < 1.5:
+    lvl = level("soc", v)
+    if lvl == 0:
         return f"SOC is {v}, indicating poor soil organic matter"
-    if 1.5 <= v < 2.5:
+    if lvl == 1:
         return f"SOC is {v}, indicating moderate oil organic matter"
 
     return "SOC is {v}, indicating rich organic content"
@@ -55,9 +96,10 @@ def classify_soc(v):
 def classify_N(v):
     if v is None:
         return "No nitrogen data available."
-    if v < 0.7:
+    lvl = level("nitrogen", v)
+    if lvl == 0:
         return f"Nitrogen is {v}, indicating crop may need nitrogen fertilization"
-    if 0.7 <= v < 1.0:
+    if lvl == 1:
         return f"Nitrogen is {v}, indicating crop has adequate nitrogen fertilization"
 
     return "Nitrogen is {v}, indicating high nitrogen fertilization"
@@ -67,9 +109,10 @@ def classify_N(v):
 def classify_P(v):
     if v is None:
         return "No phosphorus data available."
-    if v < 0.35:
+    lvl = level("phosphorus", v)
+    if lvl == 0:
         return f"Phosphorus is {v}, indicating crop may need phosphorus fertilization"
-    if 0.35 <= v < 0.45:
+    if lvl == 1:
         return f"Phosphorus is {v}, indicating crop has adequate phosphorus fertilization"
 
     return "Phosphorus is {v}, indicating high phosphorus fertilization"
@@ -79,9 +122,10 @@ def classify_P(v):
 def classify_K(v):
     if v is None:
         return "No potassium data available."
-    if v < 0.55:
+    lvl = level("potassium", v)
+    if lvl == 0:
         return f"Potassium is {v}, indicating crop may need potassium fertilization"
-    if 0.55 <= v < 0.7:
+    if lvl == 1:
         return f"Potassium is {v}, indicating crop has adequate potassium fertilization"
 
     return "Potassium is {v}, indicating high/good phosphor fertilization"
@@ -91,16 +135,18 @@ def classify_K(v):
 def classify_ph(v):
     if v is None:
         return "No pH data available."
-    if v < 5.5:
+    lvl = level("ph", v)
+    if lvl == 0:
         return f"pH is {v}, indicating strongly acidic soil."
-    if 5.5 <= v < 6.0:
+    if lvl == 1:
         return f"pH is {v}, indicating slightly acidic"
-    if 6.0 <= v < 7.0:
+    if lvl == 2:
         return f"pH is {v}, near optimal. This is good for most crops"
 
     return f"pH is {v},slightly alkalin"
 
 
+@cached_reply("status")
 def build_parcel_summary(parcel_id:str):
     parcel = get_parcel_by_id(parcel_id)
     if parcel is None:
@@ -151,6 +197,119 @@ def build_parcel_summary(parcel_id:str):
         f"    - {ph_text}"
     )
 
+    # how the metrics moved recently, e.g. "NDVI up 0.13 since 15 April"
+    trends = get_parcel_trends(parcel_id)
+    moved = [t for t in trends.values() if t and t["count"] >= 2]
+    if moved:
+        reply += f"\n\nTrends (last {TREND_DAYS} days):\n"
+        reply += "\n".join(f"    - {describe_trend(t)}" for t in moved)
+
+    return {"reply": reply}, None
+
+
+TREND_LABELS = {
+    "ndvi": "NDVI",
+    "ndmi": "NDMI",
+    "ndwi": "NDWI",
+    "soc": "SOC",
+    "nitrogen": "Nitrogen",
+    "phosphorus": "Phosphorus",
+    "potassium": "Potassium",
+    "ph": "pH",
+}
+
+
+def describe_trend(trend: dict) -> str:
+    delta = round(trend["delta"], 2)
+    since = date_cls.fromisoformat(trend["first_date"])
+    when = f"{since.day} {since:%B}"
+    label = TREND_LABELS[trend["metric"]]
+    if delta == 0:
+        return f"{label} unchanged since {when}"
+    return f"{label} {'up' if delta > 0 else 'down'} {abs(delta)} since {when}"
+
+
+@cached_reply("trend")
+def build_parcel_trend(parcel_id: str, days: int = TREND_DAYS):
+    """
+    Answer to "how has P1 changed over the last 30 days"
+    """
+    parcel = get_parcel_by_id(parcel_id)
+    if parcel is None:
+        return None, "Parcel not found"
+
+    trends = get_parcel_trends(parcel_id, days)
+    if not trends:
+        return None, "No monitoring data available for this parcel"
+
+    present = [t for t in trends.values() if t]
+    moved = [t for t in present if t["count"] >= 2]
+    start = min(t["first_date"] for t in present)
+    end = max(t["last_date"] for t in present)
+
+    header = f"Parcel {parcel_id} – {parcel['name']}\n"
+    if not moved:
+        return {"reply": header + f"Only one observation in the last {days} days of data ({end}), "
+                                  f"no trend to show yet."}, None
+
+    lines = [header + f"Changes over the last {days} days of data ({start} to {end}):"]
+    for t in moved:
+        lines.append(f"    - {describe_trend(t)} ({t['first']} → {t['last']}, "
+                     f"average {round(t['mean'], 2)}, range {t['min']}–{t['max']})")
+    return {"reply": "\n".join(lines)}, None
+
+
+
+
+@cached_reply("details")
+def build_parcel_details(parcel_id: str):
+    """
+    Answer to "P2 details": parcel info and the raw latest values
+    """
+    parcel = get_parcel_by_id(parcel_id)
+    if parcel is None:
+        return None, "Parcel not found"
+
+    latest = get_latest_indices(parcel_id)
+    if not latest:
+        return None, "No monitoring data available for this parcel"
+
+    reply = (
+        f"Parcel {parcel['id']} – {parcel['name']}\n"
+        f"Crop: {parcel['crop']}\n"
+        f"Area: {parcel['area_ha']} ha\n"
+        f"Latest data: {latest['date']}:\n"
+        f"     NDVI: {latest['ndvi']}\n"
+        f"     NDMI: {latest['ndmi']}\n"
+        f"     NDWI: {latest['ndwi']}\n"
+        f"     SOC: {latest['soc']}\n"
+        f"     N: {latest['nitrogen']}\n"
+        f"     P: {latest['phosphorus']}\n"
+        f"     K: {latest['potassium']}\n"
+        f"     pH: {latest['ph']}"
+    )
+
     return {"reply": reply}, None
 
 
+def render_report(farmer_id: str) -> str:
+    """
+    Periodic report text for one farmer: a status summary for every parcel.
+    Also runs in the report_pool workers, so this module must not import the
+    delivery queue or the state store
+    """
+    parcels = get_parcels_for_farmer(farmer_id)
+
+    # if farmer has no parcels registered
+    if not parcels:
+        return "You currently have no registered parcels."
+
+    parts = [f"You have {len(parcels)} parcels. Here is your latest update:"]
+    for parcel in parcels:
+        summary, error = build_parcel_summary(parcel["id"])
+        if error:
+            parts.append(f"Parcel {parcel['id']} – {parcel['name']}\n{error}")
+        else:
+            parts.append(summary["reply"])
+
+    return "\n\n".join(parts)
@@ -1,42 +1,100 @@
-import re
+import contextvars
+import os
+from contextlib import contextmanager
+
 from app.data_loader import data_manager
 
+# default window of trend questions and of the trends in status summaries
+TREND_DAYS = int(os.getenv("TREND_DAYS", "30"))
+# longest window a trend question may ask for
+TREND_MAX_DAYS = int(os.getenv("TREND_MAX_DAYS", "3650"))
+
+# farmer id -> parcels, shared by the messages of one batch (see shared_lookups)
+_shared_parcels = contextvars.ContextVar("shared_parcels", default=None)
+
+
+@contextmanager
+def shared_lookups():
+    """
+    Inside the block each farmer's parcels are fetched once and reused, also by
+    tasks started inside it. Used by /messages:batch: all its messages read the
+    same pinned dataset, so the parcels cannot change in between
+    """
+    token = _shared_parcels.set({})
+    try:
+        yield
+    finally:
+        _shared_parcels.reset(token)
+
 
 def get_parcels_for_farmer(farmer_id: str):
     """
     Returns all parcels belonging to a given farmer
     """
-    res = []
-    for parcel in data_manager.PARCELS:
-        if parcel["farmer_id"] == farmer_id:
-            res.append(parcel)
-    return res
+    shared = _shared_parcels.get()
+    if shared is None:
+        return data_manager.REPO.get_parcels_for_farmer(farmer_id)
+    parcels = shared.get(farmer_id)
+    if parcels is None:
+        parcels = shared[farmer_id] = data_manager.REPO.get_parcels_for_farmer(farmer_id)
+    # a copy, as outside the block: a caller changing it must not affect the others
+    return list(parcels)
+
+
+def trend_days(days) -> int:
+    """
+    Turns a requested trend window (possibly model output) into a number of
+    days in [1, TREND_MAX_DAYS], TREND_DAYS when missing or not a number
+    """
+    if days is None or isinstance(days, bool):
+        return TREND_DAYS
+    try:
+        days = int(days)
+    except (TypeError, ValueError, OverflowError):
+        return TREND_DAYS
+    return min(max(days, 1), TREND_MAX_DAYS)
 
 
 def get_latest_indices(parcel_id: str):
     """
     Retrieves the latest monitoring index record for a given parcel (the newest)
+    Records are kept sorted by date, so this is the last one
     """
-    if parcel_id not in data_manager.PARCELS_INDICES:
-        return None
+    return data_manager.PARCELS_INDICES.latest(parcel_id)
 
-    records = data_manager.PARCELS_INDICES[parcel_id]
-    if not records:
-        return None
 
-    sorted_records = sorted(records, key=lambda r: r["date"], reverse=True)
-    return sorted_records[0]
+def get_parcel_trends(parcel_id: str, days: int = TREND_DAYS):
+    """
+    Trend of every metric over the `days` days up to the latest observation
+    (satellite data arrives with a delay, so the window follows the data, not today)
+    Binary search over the sorted dates, no pass over the full history
+    """
+    series = data_manager.PARCELS_INDICES.get(parcel_id)
+    if series is None or not len(series):
+        return None
+    end = series.dates[-1]
+    return series.trends(end - days, end)
 
 
-def parcel_details_for_farmer(farmer_id: str, parcel_id: str):
+def check_parcel_access(farmer_id: str, parcel_id: str):
     """
-    Returns details for a specific parcel only if it belongs to the given farmer.
+    Returns (parcel, None) if the parcel belongs to the given farmer, (None, error) otherwise
     """
     parcel = get_parcel_by_id(parcel_id)
     if parcel is None:
         return None, "Parcel not found"
     if parcel["farmer_id"] != farmer_id:
         return None, "This parcel does not belong to you.."
+    return parcel, None
+
+
+def parcel_details_for_farmer(farmer_id: str, parcel_id: str):
+    """
+    Returns details for a specific parcel only if it belongs to the given farmer.
+    """
+    parcel, error = check_parcel_access(farmer_id, parcel_id)
+    if error:
+        return None, error
 
     latest = get_latest_indices(parcel_id)
     return {
@@ -52,18 +110,4 @@ def get_parcel_by_id(parcel_id: str):
     """
     Finds and returns a parcel object by parcel ID
     """
-    for p in data_manager.PARCELS:
-        if p["id"] == parcel_id:
-            return p
-    return None
-
-
-def extract_parcel_id(text: str) -> str | None:
-    """
-    Finds in the text if it is about a parcel (PX)
-    """
-    text_upper = text.upper()
-    matches = re.findall(r"P\s*\d+", text_upper)
-    if not matches:
-        return None
-    return matches[0].replace(" ", "")
+    return data_manager.REPO.get_parcel(parcel_id)
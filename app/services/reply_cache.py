@@ -0,0 +1,66 @@
+"""
+reply_cache.py
+Rendered parcel replies (status summary, details, trends), so that asking
+about a popular parcel again is a dict lookup instead of eight classifier calls
+and a page of string formatting.
+Entries are keyed on (parcel_id, data version, template, arguments). The data
+version is the dataset generation plus the parcel's series version, so a
+reload or new observations can never serve an outdated reply; entries of a
+parcel whose indices changed are also dropped right away to free the slots.
+"""
+import os
+from functools import wraps
+
+from app.data_loader import data_manager
+from app.services.cache import LRUCache
+
+# replies are ~1 KB, so the default bounds the cache to a few MB
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "4096"))
+
+cache = LRUCache(REPLY_CACHE_SIZE)
+
+_MISSING = object()
+
+
+def data_version(parcel_id: str) -> tuple:
+    dataset = data_manager.current()
+    series = dataset.indices.get(parcel_id)
+    return dataset.generation, -1 if series is None else series.version
+
+
+def cached_reply(template: str):
+    """
+    Decorator for builders called as f(parcel_id, *args) -> ({"reply": text}, None)
+    or (None, error). Only the text is stored; every call gets a fresh dict
+    """
+
+    def decorator(render):
+
+        @wraps(render)
+        def wrapper(parcel_id: str, *args):
+            key = (parcel_id, data_version(parcel_id), template, args)
+            entry = cache.get(key, _MISSING)
+            if entry is _MISSING:
+                reply, error = render(parcel_id, *args)
+                entry = (None if reply is None else reply["reply"], error)
+                cache.set(key, entry, tags=(parcel_id,))
+
+            text, error = entry
+            return (None if text is None else {"reply": text}), error
+
+        return wrapper
+
+    return decorator
+
+
+@data_manager.on_indices_changed
+def _invalidate_parcels(parcel_ids):
+    if parcel_ids is None:
+        cache.clear()
+        return
+    for parcel_id in parcel_ids:
+        cache.invalidate_tag(parcel_id)
+
+
+def stats() -> dict:
+    return cache.stats()
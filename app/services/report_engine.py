@@ -0,0 +1,118 @@
+"""
+report_engine.py
+Bulk report generation used by /generate-reports.
+ - due farmers come from the report_scheduler heap instead of testing every linked phone
+ - phones of each due farmer come from the phone_to_farmer reverse index
+ - every report contains the real per-parcel status summaries
+ - runs can be split into pages (limit + cursor)
+ - the messages go to the outbound delivery queue; a farmer is marked in
+   last_report_sent only once the gateway acknowledged its report, so an
+   interrupted run can simply be started again and only the farmers whose
+   report was not delivered are due
+"""
+import threading
+from bisect import bisect_right
+from datetime import date
+
+from app.services import delivery, metrics, report_pool, report_scheduler, report_service
+from app.storage import state_store
+
+
+def select_due(today: date, cursor: str | None = None, limit: int | None = None):
+    """
+    Returns (farmer ids to process in this run, cursor for the next page or None)
+    """
+    with metrics.stage("report_select_due"):
+        report_scheduler.scheduler.refresh()
+        farmer_ids = sorted(report_scheduler.scheduler.due(today))
+    if cursor is not None:
+        farmer_ids = farmer_ids[bisect_right(farmer_ids, cursor):]
+
+    if limit is not None and len(farmer_ids) > limit:
+        farmer_ids = farmer_ids[:limit]
+        return farmer_ids, farmer_ids[-1]
+    return farmer_ids, None
+
+
+# farmers whose report is in the delivery queue, not to be queued twice
+_delivering = set()
+_delivering_lock = threading.Lock()
+
+
+def _delivered(farmer_id: str, today: date):
+    """
+    on_done callback of a farmer's report in the delivery queue
+    """
+
+    def on_done(acked: int, failed: int):
+        with _delivering_lock:
+            _delivering.discard(farmer_id)
+        if acked:
+            # mark report as sent, this also schedules the next one
+            report_service.mark_report_sent(farmer_id, today)
+        else:
+            # nothing got through, keep it due for the next run
+            report_scheduler.scheduler.update(farmer_id)
+
+    return on_done
+
+
+def iter_reports(farmer_ids: list, today: date):
+    """
+    Yields one message per linked phone of every farmer and queues them for
+    delivery. Farmers whose report is still being delivered (or being rendered
+    by a concurrent run) are skipped; when the queue is full the farmer stays
+    due for a later run.
+    The texts are rendered by report_pool (in worker processes with REPORT_WORKERS).
+    Every farmer that does not make it into the queue (no phone, queue full,
+    a rendering error, or the caller stopping early) is released and scheduled again
+    """
+    # farmers this run put in _delivering; checked and claimed in one step, so
+    # concurrent runs (tick and /generate-reports) never queue a farmer twice
+    claimed = set()
+    # farmers queued by this run or owned by another one, the others are rescheduled at the end
+    handled = set()
+    rendered = None
+    try:
+        phones = {}
+        for farmer_id in farmer_ids:
+            with _delivering_lock:
+                if farmer_id in _delivering:
+                    if farmer_id not in claimed:
+                        handled.add(farmer_id)
+                    continue
+                _delivering.add(farmer_id)
+            claimed.add(farmer_id)
+
+            farmer_phones = state_store.phone_to_farmer.keys_for(farmer_id)
+            # nobody to send to, keep it due until a phone is linked
+            if farmer_phones:
+                phones[farmer_id] = farmer_phones
+
+        rendered = report_pool.render_reports(list(phones))
+        for farmer_id, message in rendered:
+            reports = [{"to": phone, "farmer_id": farmer_id, "message": message} for phone in phones[farmer_id]]
+            if not delivery.queue.put(reports, _delivered(farmer_id, today)):
+                # queue full: stop rendering, this farmer and the rest stay due
+                return
+            handled.add(farmer_id)
+
+            yield from reports
+            metrics.REPORTS.inc()
+    finally:
+        if rendered is not None:
+            rendered.close()
+        released = [farmer_id for farmer_id in claimed if farmer_id not in handled]
+        with _delivering_lock:
+            _delivering.difference_update(released)
+        for farmer_id in farmer_ids:
+            if farmer_id not in handled:
+                report_scheduler.scheduler.update(farmer_id)
+
+
+def delivering() -> int:
+    """
+    Farmers whose report is queued but not acknowledged yet
+    """
+    with _delivering_lock:
+        return len(_delivering)
@@ -0,0 +1,203 @@
+"""
+report_pool.py
+Renders report texts in a pool of worker processes, so large report runs use
+every core instead of one (building the summaries is pure Python string work
+and holds the GIL).
+
+The workers do not receive the data with each task. The current dataset is
+written once to a snapshot file (see snapshot.py) and every worker maps it
+read-only, so the parcel and index data is shared through the page cache.
+A new snapshot is only written after the data changed (reload or ingest);
+when the dataset was itself loaded from a snapshot, that file is used as is.
+Tasks are chunks of farmer ids; the rendered messages are streamed back in
+order while a bounded number of chunks is in flight.
+
+REPORT_WORKERS=0 (default) renders in-process; "auto" uses one worker per core.
+If a worker fails or the pool breaks, the rest of the run is rendered
+in-process and the next run starts a new pool.
+
+The workers import this module and parcel_summary_service only: the delivery
+queue and the state store (with its database connection and flusher) are never
+loaded in them.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app.data_loader import data_manager
+from app.data_loader.snapshot import write_snapshot
+from app.services import metrics
+from app.services.parcel_summary_service import render_report
+
+_workers = os.getenv("REPORT_WORKERS", "0")
+REPORT_WORKERS = (os.cpu_count() or 1) if _workers == "auto" else int(_workers)
+# farmers per task sent to a worker
+REPORT_CHUNK_SIZE = int(os.getenv("REPORT_CHUNK_SIZE", "64"))
+# smaller runs are rendered in-process, the pool would not pay off
+REPORT_POOL_MIN_FARMERS = int(os.getenv("REPORT_POOL_MIN_FARMERS", "256"))
+REPORT_SNAPSHOT_DIR = os.getenv("REPORT_SNAPSHOT_DIR", tempfile.gettempdir())
+
+_lock = threading.Lock()
+_pool = None
+_pool_size = 0
+# ((generation, ingests), path, written by us) of the snapshot the workers attach to
+_snapshot = None
+# ingests since the last dataset swap
+_ingests = 0
+
+
+@data_manager.on_indices_changed
+def _data_changed(parcel_ids):
+    global _ingests
+    with _lock:
+        _ingests = 0 if parcel_ids is None else _ingests + 1
+
+
+def _current_snapshot() -> tuple:
+    """
+    (path, generation) of a snapshot holding the current data, written if needed
+    """
+    global _snapshot
+    dataset = data_manager.current()
+    with _lock:
+        key = (dataset.generation, _ingests)
+        if _snapshot is not None and _snapshot[0] == key:
+            return _snapshot[1], dataset.generation
+
+        previous = _snapshot
+        if dataset.snapshot and key[1] == 0:
+            path, written = dataset.snapshot, False
+        else:
+            path = os.path.join(REPORT_SNAPSHOT_DIR,
+                                f"farmer-assistant-reports-{os.getpid()}-{key[0]}-{key[1]}.bin")
+            started = time.perf_counter()
+            write_snapshot(path, dataset.farmers, dataset.parcels, dataset.indices)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="report_snapshot")
+            written = True
+        _snapshot = (key, path, written)
+
+    # workers still attached to the old file keep their mapping
+    if previous is not None and previous[2] and previous[1] != path:
+        try:
+            os.remove(previous[1])
+        except OSError:
+            pass
+    return path, dataset.generation
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    with _lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # spawn: forking a process that runs threads (watcher, delivery, state flusher) is unsafe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_size = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """
+    Drops a pool that failed, the next run starts a new one
+    """
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    global _pool, _snapshot
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _snapshot is not None and _snapshot[2]:
+            try:
+                os.remove(_snapshot[1])
+            except OSError:
+                pass
+        _snapshot = None
+
+
+# worker side: snapshot path this process is attached to
+_attached = None
+
+
+def _render_chunk(path: str, generation: int, farmer_ids: list) -> tuple:
+    """
+    Runs in a worker: attaches to the snapshot once, then renders the chunk.
+    Returns ([(farmer_id, message)], seconds spent rendering)
+    """
+    global _attached
+
+    if _attached != path:
+        data_manager.attach_snapshot(path, generation)
+        _attached = path
+    started = time.perf_counter()
+    res = [(farmer_id, render_report(farmer_id)) for farmer_id in farmer_ids]
+    return res, time.perf_counter() - started
+
+
+def _render_local(farmer_ids: list):
+    for farmer_id in farmer_ids:
+        with metrics.stage("report_render"):
+            message = render_report(farmer_id)
+        yield farmer_id, message
+
+
+def _render_in_pool(pool: ProcessPoolExecutor, path: str, generation: int, farmer_ids: list, workers: int):
+    chunks = iter([farmer_ids[i:i + REPORT_CHUNK_SIZE] for i in range(0, len(farmer_ids), REPORT_CHUNK_SIZE)])
+    pending = deque()
+    try:
+        # two chunks per worker: one rendering, one ready to go
+        for chunk in chunks:
+            pending.append(pool.submit(_render_chunk, path, generation, chunk))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            results, seconds = pending.popleft().result()
+            for chunk in chunks:
+                pending.append(pool.submit(_render_chunk, path, generation, chunk))
+                break
+            for _ in results:
+                metrics.STAGE_SECONDS.observe(seconds / len(results), stage="report_render")
+            yield from results
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def render_reports(farmer_ids: list, workers: int | None = None):
+    """
+    Yields (farmer_id, report text) for every farmer, in order.
+    Stopping the iteration early cancels the chunks not started yet
+    """
+    workers = REPORT_WORKERS if workers is None else workers
+    if workers <= 0 or len(farmer_ids) < REPORT_POOL_MIN_FARMERS:
+        yield from _render_local(farmer_ids)
+        return
+
+    path, generation = _current_snapshot()
+    pool = _get_pool(workers)
+    rendered = _render_in_pool(pool, path, generation, farmer_ids, workers)
+    done = 0
+    try:
+        for item in rendered:
+            yield item
+            done += 1
+        return
+    except Exception as e:
+        # a worker raised or died: the farmers not rendered yet are rendered here,
+        # so one bad worker does not fail the run (a failing report fails here too)
+        print("Report worker failed, rendering in-process:", repr(e))
+        _discard_pool(pool)
+    finally:
+        rendered.close()
+    yield from _render_local(farmer_ids[done:])
@@ -0,0 +1,198 @@
+"""
+report_scheduler.py
+Keeps the next-due date of every farmer with a report frequency in a min-heap,
+so finding who is due costs O(k log n) for k due farmers instead of a pass over
+everybody. Entries are pushed whenever report_freq changes or a report is sent;
+outdated entries are skipped lazily when they reach the top of the heap.
+When another worker changed report_freq or last_report_sent (SQLite backend),
+the heap is rebuilt from them before it is read (refresh()).
+
+run() is started as a background asyncio task by app.main and hands the
+reports to the delivery queue as they come due. With several workers sharing the SQLite state backend
+only one of them should run it (REPORT_SCHEDULER=off on the others).
+"""
+import asyncio
+import heapq
+import os
+import threading
+from datetime import date, timedelta
+
+from app.storage import state_store
+
+REPORT_SCHEDULER = os.getenv("REPORT_SCHEDULER", "on") != "off"
+REPORT_TICK_SECONDS = float(os.getenv("REPORT_TICK_SECONDS", "60"))
+
+# state the heap is built from
+_NAMESPACES = ("report_freq", "last_report_sent")
+
+
+def next_due(freq: str | None, last: str | None) -> date | None:
+    """
+    Date on which the next report is due, given the frequency and the ISO date
+    of the last report sent. date.min means "due now", None means never
+    """
+    if freq not in ("daily", "weekly", "monthly"):
+        return None
+    if not last:
+        return date.min
+
+    last_date = date.fromisoformat(last)
+
+    if freq == "daily":
+        return last_date + timedelta(days=1)
+
+    if freq == "weekly":
+        return last_date + timedelta(days=7)
+
+    # monthly: any day of the next calendar month
+    # return last_date + timedelta(days=30)  # -> to sand at each 30 days
+    if last_date.month == 12:
+        return date(last_date.year + 1, 1, 1)
+    return date(last_date.year, last_date.month + 1, 1)
+
+
+class ReportScheduler:
+
+    def __init__(self):
+        # (due date, farmer_id, generation)
+        self._heap = []
+        # farmer_id -> generation of its only valid heap entry
+        self._current = {}
+        self._generation = 0
+        # state backend data version the heap was built from
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._current)
+
+    def rebuild(self):
+        """
+        Fills the heap from state_store (startup, or after state was changed elsewhere)
+        """
+        with self._lock:
+            # read first: a write landing during the rebuild triggers another one
+            self._data_version = state_store.backend.data_version(*_NAMESPACES)
+            self._heap = []
+            self._current = {}
+            last_sent = dict(state_store.last_report_sent.items())
+            for farmer_id, freq in state_store.report_freq.items():
+                due = next_due(freq, last_sent.get(farmer_id))
+                if due is not None:
+                    self._push(farmer_id, due)
+            heapq.heapify(self._heap)
+
+    def refresh(self):
+        """
+        Rebuilds the heap if another worker changed report settings or sent
+        reports since it was built; other state writes (chat traffic) do not count
+        """
+        if state_store.backend.data_version(*_NAMESPACES) != self._data_version:
+            self.rebuild()
+
+    def update(self, farmer_id: str):
+        """
+        Recomputes a farmer's next due date, call after report_freq or last_report_sent changed
+        """
+        due = next_due(state_store.report_freq.get(farmer_id), state_store.last_report_sent.get(farmer_id))
+        with self._lock:
+            self._current.pop(farmer_id, None)
+            if due is not None:
+                self._push(farmer_id, due, heap=True)
+            self._compact()
+
+    def _push(self, farmer_id, due, heap=False):
+        self._generation += 1
+        self._current[farmer_id] = self._generation
+        entry = (due, farmer_id, self._generation)
+        if heap:
+            heapq.heappush(self._heap, entry)
+        else:
+            self._heap.append(entry)
+
+    def _compact(self):
+        # too many outdated entries -> drop them
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._heap = [e for e in self._heap if self._current.get(e[1]) == e[2]]
+            heapq.heapify(self._heap)
+
+    def due(self, today: date) -> list:
+        """
+        Farmers due on or before today, without removing them.
+        Walks only the part of the heap whose dates are <= today
+        """
+        res = []
+        with self._lock:
+            heap = self._heap
+            stack = [0] if heap else []
+            while stack:
+                i = stack.pop()
+                due, farmer_id, generation = heap[i]
+                if due > today:
+                    continue
+                if self._current.get(farmer_id) == generation:
+                    res.append(farmer_id)
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(heap):
+                        stack.append(child)
+        return res
+
+    def pop_due(self, today: date) -> list:
+        """
+        Removes and returns the farmers due on or before today.
+        They are pushed back by update() once their report is handled
+        """
+        res = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= today:
+                _, farmer_id, generation = heapq.heappop(self._heap)
+                if self._current.get(farmer_id) == generation:
+                    del self._current[farmer_id]
+                    res.append(farmer_id)
+        return res
+
+    def next_due(self):
+        with self._lock:
+            while self._heap and self._current.get(self._heap[0][1]) != self._heap[0][2]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+
+scheduler = ReportScheduler()
+
+
+def tick(today: date | None = None) -> int:
+    """
+    One scheduler step: queue the reports of every farmer due now,
+    returns how many messages were queued
+    """
+    from app.services import report_engine
+
+    today = today or date.today()
+    scheduler.refresh()
+    farmer_ids = scheduler.pop_due(today)
+    # iter_reports reschedules every popped farmer it does not queue, also when it fails
+    return sum(1 for _ in report_engine.iter_reports(farmer_ids, today))
+
+
+async def run(interval: float = REPORT_TICK_SECONDS):
+    while True:
+        try:
+            # report rendering is CPU work, keep it off the event loop
+            await asyncio.to_thread(tick)
+        except Exception as e:
+            print("Report scheduler tick failed:", repr(e))
+        await asyncio.sleep(interval)
+
+
+def stats() -> dict:
+    from app.services import report_engine
+
+    earliest = scheduler.next_due()
+    return {
+        "enabled": REPORT_SCHEDULER,
+        "tick_seconds": REPORT_TICK_SECONDS,
+        "scheduled_farmers": len(scheduler),
+        "next_due": None if earliest is None else str(max(earliest, date.today())),
+        "delivering_farmers": report_engine.delivering(),
+    }
@@ -1,31 +1,34 @@
-from datetime import date, timedelta
+from datetime import date
+from app.services import report_scheduler
 from app.storage import state_store
 
+
 def scheduled_report(farmer_id: str) -> bool:
     """
     Determines whether a scheduled report should be sent to a farmer, based on their configured reporting
     frequency and the last time a report was sent
     """
-    freq = state_store.report_freq.get(farmer_id)
-    if not freq:
-        return False
-
-    today = date.today()
-    last = state_store.last_report_sent.get(farmer_id)
-
-    if freq == "daily":
-        return last != str(today)
-
-    if freq == "weekly":
-        if not last:
-            return True
-        last_date = date.fromisoformat(last)
-        return (today - last_date).days >=7
-
-    if freq == "monthly":
-        if not last:
-            return True
-        last_date = date.fromisoformat(last)
-        return (today.year != last_date.year) or (today.month != last_date.month)
-      # return (today - last_date).days >= 30  # -> to sand at each 30 days
-    return False
\ No newline at end of file
+    due = report_scheduler.next_due(state_store.report_freq.get(farmer_id), state_store.last_report_sent.get(farmer_id))
+    return due is not None and due <= date.today()
+
+
+def set_report_frequency(farmer_id: str, freq: str):
+    """
+    Stores the frequency and reschedules the farmer's next report
+    """
+    state_store.report_freq[farmer_id] = freq
+    report_scheduler.scheduler.update(farmer_id)
+
+
+def stop_reports(farmer_id: str) -> bool:
+    """
+    Disables reports, returns False if none were scheduled
+    """
+    existed = state_store.report_freq.pop(farmer_id, None) is not None
+    report_scheduler.scheduler.update(farmer_id)
+    return existed
+
+
+def mark_report_sent(farmer_id: str, day: date):
+    state_store.last_report_sent[farmer_id] = str(day)
+    report_scheduler.scheduler.update(farmer_id)
@@ -0,0 +1,148 @@
+"""
+sessions.py
+One Session per phone, holding what handle_message would otherwise look up
+again on every message: the farmer the phone is linked to and the farmer's
+parcels (for the current dataset).
+
+Sessions live in a map split into shards, each with its own lock, so phones
+in different shards never contend. A session's own asyncio lock serialises
+the messages of one phone (e.g. two "username" messages racing to link the
+account) without blocking the event loop. Sessions idle for longer than
+SESSION_IDLE_SECONDS are dropped, oldest first, as the shard is used.
+
+Only what cannot go stale is kept: a phone that is not linked yet is looked
+up again on every message (another worker may link it), and the parcels are
+reloaded when the dataset generation changes.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.data_loader import data_manager
+from app.services import parcels_service
+from app.storage import state_store
+
+SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", "64"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+
+
+class Session:
+    __slots__ = ("phone", "farmer_id", "last_seen", "lock", "_parcels", "_generation")
+
+    def __init__(self, phone: str):
+        self.phone = phone
+        self.farmer_id = None
+        self.last_seen = time.monotonic()
+        self.lock = asyncio.Lock()
+        self._parcels = None
+        self._generation = None
+
+    def farmer(self) -> str | None:
+        """
+        Farmer id the phone is linked to, or None
+        """
+        if self.farmer_id is None:
+            # a link is never undone, so only the positive answer is kept
+            self.farmer_id = state_store.phone_to_farmer.get(self.phone)
+        return self.farmer_id
+
+    def parcels(self) -> list:
+        """
+        The farmer's parcels in the dataset of this request
+        """
+        generation = data_manager.current().generation
+        if self._parcels is None or self._generation != generation:
+            self._parcels = parcels_service.get_parcels_for_farmer(self.farmer_id)
+            self._generation = generation
+        return self._parcels
+
+
+class _Shard:
+    __slots__ = ("sessions", "lock")
+
+    def __init__(self):
+        # phone -> Session, least recently used first
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class SessionStore:
+
+    def __init__(self, shards: int = SESSION_SHARDS, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _shard(self, phone: str) -> _Shard:
+        return self._shards[hash(phone) % len(self._shards)]
+
+    def get(self, phone: str) -> Session:
+        """
+        Session of the phone, created on first use
+        """
+        now = time.monotonic()
+        shard = self._shard(phone)
+        with shard.lock:
+            session = shard.sessions.get(phone)
+            if session is None:
+                session = shard.sessions[phone] = Session(phone)
+                hit = False
+            else:
+                shard.sessions.move_to_end(phone)
+                hit = True
+            session.last_seen = now
+            evicted = self._evict_idle(shard, now)
+
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.evictions += evicted
+        return session
+
+    def _evict_idle(self, shard: _Shard, now: float) -> int:
+        # the shard is in last-use order, so only the idle head is looked at
+        evicted = 0
+        sessions = shard.sessions
+        while sessions:
+            phone, session = next(iter(sessions.items()))
+            if now - session.last_seen <= self.idle_seconds or session.lock.locked():
+                break
+            del sessions[phone]
+            evicted += 1
+        return evicted
+
+    def drop(self, phone: str):
+        shard = self._shard(phone)
+        with shard.lock:
+            shard.sessions.pop(phone, None)
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.sessions.clear()
+
+    def __len__(self):
+        return sum(len(shard.sessions) for shard in self._shards)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "sessions": len(self),
+                "shards": len(self._shards),
+                "idle_seconds": self.idle_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+sessions = SessionStore()
@@ -0,0 +1,582 @@
+"""
+backends.py
+Storage backends for state_store.
+State is a set of namespaces ("phone_to_farmer", "report_freq", ...), each one
+a string -> string map. Two implementations:
+ - MemoryBackend: plain dicts, lost on restart (the original behaviour)
+ - SqliteBackend: SQLite in WAL mode, shared by every worker on the host.
+   Writes are batched and flushed every few milliseconds or when the batch is
+   full, except in SYNC_NAMESPACES (account linking), which are committed
+   before set() returns. Reads go through a local cache that is dropped as
+   soon as another process commits (PRAGMA data_version), so every worker
+   reads what the others committed; batched writes (report settings) reach
+   them within flush_interval.
+
+data_version(*namespaces) tells a process that others changed one of the
+VERSIONED_NAMESPACES, so local views of them (the report scheduler heap) are
+rebuilt only when those namespaces changed, not after any chat traffic.
+
+Both can page through a namespace in key order (scan) and keep the number of
+keys per namespace / per value up to date on every write, so counting never
+needs a full scan.
+"""
+import atexit
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+_MISSING = object()
+_DELETED = object()
+
+# namespaces that keep a value -> keys index
+INDEXED_NAMESPACES = ("phone_to_farmer", "report_freq")
+
+# namespaces whose changes by other processes data_version() reports
+VERSIONED_NAMESPACES = ("report_freq", "last_report_sent")
+
+# namespaces SqliteBackend writes through instead of batching: a phone linked
+# on one worker must not be unknown to another one a moment later
+SYNC_NAMESPACES = ("phone_to_farmer", "pending_linking", "farmer_phone")
+
+# most keys a MemoryBackend scan looks at per page when filtering by value; a
+# page may then come back short, with a cursor to continue from
+MAX_SCANNED_PER_PAGE = 10000
+
+_INDEXED_SQL = "(" + ", ".join(f"'{ns}'" for ns in INDEXED_NAMESPACES) + ")"
+_VERSIONED_SQL = "(" + ", ".join(f"'{ns}'" for ns in VERSIONED_NAMESPACES) + ")"
+
+# counter tables of SqliteBackend and the triggers keeping them up to date
+_COUNTER_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS state_totals (ns TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS state_counts ("
+    " ns TEXT NOT NULL, value TEXT NOT NULL, n INTEGER NOT NULL,"
+    " PRIMARY KEY (ns, value)) WITHOUT ROWID",
+    "DELETE FROM state_totals",
+    "DELETE FROM state_counts",
+    "INSERT INTO state_totals SELECT ns, COUNT(*) FROM state GROUP BY ns",
+    f"INSERT INTO state_counts SELECT ns, value, COUNT(*) FROM state WHERE ns IN {_INDEXED_SQL} GROUP BY ns, value",
+    """CREATE TRIGGER state_total_insert AFTER INSERT ON state BEGIN
+        INSERT INTO state_totals VALUES (NEW.ns, 1) ON CONFLICT (ns) DO UPDATE SET n = n + 1;
+    END""",
+    """CREATE TRIGGER state_total_delete AFTER DELETE ON state BEGIN
+        UPDATE state_totals SET n = n - 1 WHERE ns = OLD.ns;
+    END""",
+    f"""CREATE TRIGGER state_count_insert AFTER INSERT ON state WHEN NEW.ns IN {_INDEXED_SQL} BEGIN
+        INSERT INTO state_counts VALUES (NEW.ns, NEW.value, 1) ON CONFLICT (ns, value) DO UPDATE SET n = n + 1;
+    END""",
+    f"""CREATE TRIGGER state_count_delete AFTER DELETE ON state WHEN OLD.ns IN {_INDEXED_SQL} BEGIN
+        UPDATE state_counts SET n = n - 1 WHERE ns = OLD.ns AND value = OLD.value;
+        DELETE FROM state_counts WHERE ns = OLD.ns AND value = OLD.value AND n <= 0;
+    END""",
+    f"""CREATE TRIGGER state_count_update AFTER UPDATE OF value ON state
+    WHEN NEW.ns IN {_INDEXED_SQL} AND OLD.value != NEW.value BEGIN
+        UPDATE state_counts SET n = n - 1 WHERE ns = OLD.ns AND value = OLD.value;
+        DELETE FROM state_counts WHERE ns = OLD.ns AND value = OLD.value AND n <= 0;
+        INSERT INTO state_counts VALUES (NEW.ns, NEW.value, 1) ON CONFLICT (ns, value) DO UPDATE SET n = n + 1;
+    END""",
+)
+
+# writes per versioned namespace, kept by triggers (see SqliteBackend.data_version)
+_VERSION_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS state_versions (ns TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID",
+    f"""CREATE TRIGGER IF NOT EXISTS state_version_insert AFTER INSERT ON state WHEN NEW.ns IN {_VERSIONED_SQL} BEGIN
+        INSERT INTO state_versions VALUES (NEW.ns, 1) ON CONFLICT (ns) DO UPDATE SET n = n + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS state_version_delete AFTER DELETE ON state WHEN OLD.ns IN {_VERSIONED_SQL} BEGIN
+        INSERT INTO state_versions VALUES (OLD.ns, 1) ON CONFLICT (ns) DO UPDATE SET n = n + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS state_version_update AFTER UPDATE OF value ON state
+    WHEN NEW.ns IN {_VERSIONED_SQL} AND OLD.value != NEW.value BEGIN
+        INSERT INTO state_versions VALUES (NEW.ns, 1) ON CONFLICT (ns) DO UPDATE SET n = n + 1;
+    END""",
+)
+
+
+class StateBackend:
+    """
+    Interface every backend implements
+    """
+
+    def get(self, ns: str, key: str, default=None):
+        raise NotImplementedError
+
+    def set(self, ns: str, key: str, value: str):
+        raise NotImplementedError
+
+    def delete(self, ns: str, key: str) -> bool:
+        """
+        Removes key, returns True if it existed
+        """
+        raise NotImplementedError
+
+    def items(self, ns: str) -> list:
+        raise NotImplementedError
+
+    def count(self, ns: str) -> int:
+        raise NotImplementedError
+
+    def keys_for(self, ns: str, value: str) -> list:
+        """
+        Keys whose value equals value, e.g. every phone linked to one farmer.
+        Only the namespaces in INDEXED_NAMESPACES are guaranteed to answer
+        without a full scan
+        """
+        raise NotImplementedError
+
+    def scan(self, ns: str, after: str | None = None, limit: int = 100, value: str | None = None) -> tuple:
+        """
+        One page of (key, value) pairs in key order, starting after the key
+        after, optionally only those whose value equals value.
+        Returns (rows, cursor for the next page or None when done)
+        """
+        raise NotImplementedError
+
+    def value_counts(self, ns: str) -> dict:
+        """
+        value -> number of keys holding it. Maintained on every write for the
+        namespaces in INDEXED_NAMESPACES; meant for the ones with few distinct
+        values (report_freq)
+        """
+        raise NotImplementedError
+
+    def claim(self, ns: str, key: str, value: str) -> str:
+        """
+        Sets key to value unless it already holds one, in one atomic step (also
+        across workers sharing the backend). Returns the value key holds
+        afterwards: the caller got the key if that is its own value
+        """
+        raise NotImplementedError
+
+    def contains(self, ns: str, key: str) -> bool:
+        return self.get(ns, key, _MISSING) is not _MISSING
+
+    def data_version(self, *namespaces: str) -> int:
+        """
+        Changes whenever another process changed one of the namespaces (all of
+        them in VERSIONED_NAMESPACES). A MemoryBackend is private to its
+        process, so its version never moves
+        """
+        return 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class _SortedKeys:
+    """
+    Keys kept in order as a list of sorted buckets, so adding or removing one
+    key moves at most a bucket, not the whole key list
+    """
+    __slots__ = ("_buckets", "_maxes")
+
+    BUCKET_SIZE = 1000
+
+    def __init__(self):
+        self._buckets = []
+        # last key of every bucket
+        self._maxes = []
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        i = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        bucket = self._buckets[i]
+        insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            half = self.BUCKET_SIZE
+            self._buckets[i:i + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[i:i + 1] = [bucket[half - 1], bucket[-1]]
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+
+    def iter_after(self, after=None):
+        if after is None:
+            i, j = 0, 0
+        else:
+            i = bisect_right(self._maxes, after)
+            if i == len(self._buckets):
+                return
+            j = bisect_right(self._buckets[i], after)
+        for bucket in self._buckets[i:]:
+            yield from bucket[j:]
+            j = 0
+
+
+class MemoryBackend(StateBackend):
+
+    def __init__(self):
+        self._data = {}
+        # ns -> value -> {key: None} (dict used as an insertion ordered set)
+        self._by_value = {ns: {} for ns in INDEXED_NAMESPACES}
+        # ns -> keys in order, for scan
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    def _ns(self, ns):
+        data = self._data.get(ns)
+        if data is None:
+            data = self._data.setdefault(ns, {})
+        return data
+
+    def get(self, ns, key, default=None):
+        return self._ns(ns).get(key, default)
+
+    def _sorted_keys(self, ns) -> _SortedKeys:
+        keys = self._sorted.get(ns)
+        if keys is None:
+            keys = self._sorted[ns] = _SortedKeys()
+        return keys
+
+    def set(self, ns, key, value):
+        with self._lock:
+            self._set_locked(ns, key, value)
+
+    def _set_locked(self, ns, key, value):
+        data = self._ns(ns)
+        old = data.get(key, _MISSING)
+        by_value = self._by_value.get(ns)
+        if by_value is not None:
+            self._unindex(by_value, key, old)
+            by_value.setdefault(value, {})[key] = None
+        if old is _MISSING:
+            self._sorted_keys(ns).add(key)
+        data[key] = value
+
+    def claim(self, ns, key, value):
+        with self._lock:
+            old = self._ns(ns).get(key, _MISSING)
+            if old is not _MISSING:
+                return old
+            self._set_locked(ns, key, value)
+            return value
+
+    def delete(self, ns, key):
+        with self._lock:
+            old = self._ns(ns).pop(key, _MISSING)
+            by_value = self._by_value.get(ns)
+            if by_value is not None:
+                self._unindex(by_value, key, old)
+            if old is _MISSING:
+                return False
+            self._sorted_keys(ns).remove(key)
+            return True
+
+    @staticmethod
+    def _unindex(by_value, key, old):
+        if old is _MISSING:
+            return
+        keys = by_value.get(old)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del by_value[old]
+
+    def keys_for(self, ns, value):
+        by_value = self._by_value.get(ns)
+        with self._lock:
+            if by_value is None:
+                return [k for k, v in self._ns(ns).items() if v == value]
+            return list(by_value.get(value, ()))
+
+    def items(self, ns):
+        with self._lock:
+            return list(self._ns(ns).items())
+
+    def count(self, ns):
+        return len(self._ns(ns))
+
+    def scan(self, ns, after=None, limit=100, value=None):
+        with self._lock:
+            data = self._ns(ns)
+            by_value = self._by_value.get(ns)
+            if value is not None and by_value is not None:
+                keys = by_value.get(value, {})
+                # e.g. the phones of one farmer: sorting them beats walking the namespace
+                if len(keys) <= MAX_SCANNED_PER_PAGE:
+                    keys = sorted(k for k in keys if after is None or k > after)
+                    rows = [(k, value) for k in keys[:limit]]
+                    return rows, rows[-1][0] if len(keys) > limit else None
+
+            rows = []
+            budget = max(limit, MAX_SCANNED_PER_PAGE)
+            last = None
+            for key in self._sorted_keys(ns).iter_after(after):
+                if len(rows) == limit or budget == 0:
+                    return rows, last
+                budget -= 1
+                last = key
+                v = data[key]
+                if value is None or v == value:
+                    rows.append((key, v))
+            return rows, None
+
+    def value_counts(self, ns):
+        by_value = self._by_value.get(ns)
+        with self._lock:
+            if by_value is None:
+                counts = {}
+                for v in self._ns(ns).values():
+                    counts[v] = counts.get(v, 0) + 1
+                return counts
+            return {v: len(keys) for v, keys in by_value.items()}
+
+    def contains(self, ns, key):
+        return key in self._ns(ns)
+
+
+class SqliteBackend(StateBackend):
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS state_by_value ON state (ns, value)")
+        self._create_counters()
+
+        self._lock = threading.RLock()
+        # (ns, key) -> value or _DELETED, not yet written to the database
+        self._pending = {}
+        # (ns, key) -> value or _MISSING, valid while data_version does not move
+        self._cache = {}
+        self._data_version = self._read_data_version()
+        # versioned ns -> last state_versions count seen / changes seen that were not ours
+        self._ns_versions = {}
+        self._foreign_changes = dict.fromkeys(VERSIONED_NAMESPACES, 0)
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="state-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _create_counters(self):
+        """
+        state_totals (keys per namespace), state_counts (keys per value of
+        the indexed namespaces) and state_versions are kept by triggers, so they
+        are right whichever worker writes. A database created before them is
+        counted once here
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for trigger, schema in (("state_count_insert", _COUNTER_SCHEMA),
+                                    ("state_version_insert", _VERSION_SCHEMA)):
+                exists = self._conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (trigger,)).fetchone()
+                if not exists:
+                    for statement in schema:
+                        self._conn.execute(statement)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_cache(self):
+        # data_version changes only when another connection commits
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self._cache.clear()
+
+    def _sync_versions(self, namespaces, foreign: bool = True):
+        """
+        Reads the write counts of versioned namespaces. With foreign=True a
+        count that moved since last seen is a change by another process; it is
+        called inside our own write transactions both before (foreign) and
+        after (ours) the writes, so our writes are never counted as foreign
+        """
+        namespaces = [ns for ns in namespaces if ns in self._foreign_changes]
+        if not namespaces:
+            return
+        rows = dict(self._conn.execute(
+            f"SELECT ns, n FROM state_versions WHERE ns IN ({', '.join('?' * len(namespaces))})",
+            namespaces).fetchall())
+        for ns in namespaces:
+            n = rows.get(ns, 0)
+            seen = self._ns_versions.get(ns)
+            if foreign and seen is not None and n != seen:
+                self._foreign_changes[ns] += 1
+            self._ns_versions[ns] = n
+
+    def data_version(self, *namespaces):
+        with self._lock:
+            self._sync_versions(namespaces)
+            return sum(self._foreign_changes.get(ns, 0) for ns in namespaces)
+
+    def get(self, ns, key, default=None):
+        with self._lock:
+            value = self._pending.get((ns, key), _MISSING)
+            if value is _MISSING:
+                self._check_cache()
+                value = self._cache.get((ns, key), _MISSING)
+                if value is _MISSING:
+                    row = self._conn.execute(
+                        "SELECT value FROM state WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+                    value = row[0] if row else _DELETED
+                    self._cache[(ns, key)] = value
+            return default if value is _DELETED else value
+
+    def set(self, ns, key, value):
+        with self._lock:
+            self._pending[(ns, key)] = value
+            if ns in SYNC_NAMESPACES or len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def delete(self, ns, key):
+        with self._lock:
+            existed = self.contains(ns, key)
+            if existed:
+                self._pending[(ns, key)] = _DELETED
+                if ns in SYNC_NAMESPACES or len(self._pending) >= self.batch_size:
+                    self._flush_locked()
+            return existed
+
+    def claim(self, ns, key, value):
+        with self._lock:
+            self._flush_locked()
+            self._check_cache()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync_versions((ns,))
+                self._conn.execute(
+                    "INSERT INTO state (ns, key, value) VALUES (?, ?, ?) ON CONFLICT (ns, key) DO NOTHING",
+                    (ns, key, value))
+                self._sync_versions((ns,), foreign=False)
+                owner = self._conn.execute(
+                    "SELECT value FROM state WHERE ns = ? AND key = ?", (ns, key)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._cache[(ns, key)] = owner
+            return owner
+
+    def items(self, ns):
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute(
+                "SELECT key, value FROM state WHERE ns = ? ORDER BY key", (ns,)).fetchall()
+
+    def count(self, ns):
+        with self._lock:
+            self._flush_locked()
+            row = self._conn.execute("SELECT n FROM state_totals WHERE ns = ?", (ns,)).fetchone()
+            return row[0] if row else 0
+
+    def scan(self, ns, after=None, limit=100, value=None):
+        sql = "SELECT key, value FROM state WHERE ns = ?"
+        params = [ns]
+        if after is not None:
+            sql += " AND key > ?"
+            params.append(after)
+        if value is not None:
+            # state_by_value holds (ns, value, key), so this is a range read too
+            sql += " AND value = ?"
+            params.append(value)
+        sql += " ORDER BY key LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            self._flush_locked()
+            rows = self._conn.execute(sql, params).fetchall()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1][0]
+        return rows, None
+
+    def value_counts(self, ns):
+        with self._lock:
+            self._flush_locked()
+            if ns not in INDEXED_NAMESPACES:
+                return dict(self._conn.execute(
+                    "SELECT value, COUNT(*) FROM state WHERE ns = ? GROUP BY value", (ns,)).fetchall())
+            return dict(self._conn.execute(
+                "SELECT value, n FROM state_counts WHERE ns = ?", (ns,)).fetchall())
+
+    def keys_for(self, ns, value):
+        with self._lock:
+            self._flush_locked()
+            return [row[0] for row in self._conn.execute(
+                "SELECT key FROM state WHERE ns = ? AND value = ? ORDER BY key", (ns, value))]
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        upserts = []
+        deletes = []
+        for (ns, key), value in self._pending.items():
+            if value is _DELETED:
+                deletes.append((ns, key))
+            else:
+                upserts.append((ns, key, value))
+
+        written = {ns for ns, _ in self._pending}
+        self._check_cache()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._sync_versions(written)
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO state (ns, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value", upserts)
+            if deletes:
+                self._conn.executemany("DELETE FROM state WHERE ns = ? AND key = ?", deletes)
+            self._sync_versions(written, foreign=False)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        # what we just wrote is now the committed value
+        self._cache.update(self._pending)
+        self._pending.clear()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("State flush failed, retrying:", e)
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.flush()
+        self._conn.close()
+
+
+def create_backend(name: str, db_path: str = "state.db") -> StateBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SqliteBackend(db_path)
+    raise ValueError(f"Unknown state backend: {name}")
@@ -1,10 +1,141 @@
 """
-Temporary data stored in memory while the app runs
+Temporary data stored while the app runs
 Used for account linking and scheduled reporting preferences
+
+Where it is stored is decided by the STATE_BACKEND env variable (see backends.py):
+ - memory (default) -> in-process dicts, lost on restart
+ - sqlite -> STATE_DB_PATH file shared by all workers
+The names below keep behaving like the plain dict / set they replaced
 """
-phone_to_farmer = {}
-pending_linking = set()
+import os
+from collections.abc import MutableMapping, MutableSet
+
+from dotenv import load_dotenv
+
+from app.storage.backends import create_backend
+
+load_dotenv()
+
+
+class StateDict(MutableMapping):
+    """
+    dict-like view over one namespace of the backend
+    """
+
+    def __init__(self, backend, ns: str):
+        self._backend = backend
+        self._ns = ns
+
+    def __getitem__(self, key):
+        value = self._backend.get(self._ns, key, None)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._backend.set(self._ns, key, value)
+
+    def __delitem__(self, key):
+        if not self._backend.delete(self._ns, key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self._backend.contains(self._ns, key)
+
+    def __iter__(self):
+        return iter([k for k, _ in self._backend.items(self._ns)])
+
+    def __len__(self):
+        return self._backend.count(self._ns)
+
+    def get(self, key, default=None):
+        return self._backend.get(self._ns, key, default)
+
+    def items(self):
+        return self._backend.items(self._ns)
+
+    def keys_for(self, value) -> list:
+        """
+        Reverse lookup, e.g. phone_to_farmer.keys_for("F1") -> phones of F1
+        """
+        return self._backend.keys_for(self._ns, value)
+
+    def scan(self, after=None, limit: int = 100, value=None) -> tuple:
+        """
+        One page of (key, value) in key order: (rows, cursor of the next page or None)
+        """
+        return self._backend.scan(self._ns, after, limit, value)
+
+    def value_counts(self) -> dict:
+        """
+        e.g. report_freq.value_counts() -> {"daily": 3, "weekly": 1}, without a scan
+        """
+        return self._backend.value_counts(self._ns)
+
+    def claim(self, key, value) -> str:
+        """
+        Sets key only if it is not set yet (atomic, also across workers),
+        returns the value it holds afterwards
+        """
+        return self._backend.claim(self._ns, key, value)
+
+    def pop(self, key, *default):
+        value = self._backend.get(self._ns, key, None)
+        if value is None or not self._backend.delete(self._ns, key):
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return value
+
+
+class StateSet(MutableSet):
+    """
+    set-like view over one namespace of the backend
+    """
+
+    def __init__(self, backend, ns: str):
+        self._backend = backend
+        self._ns = ns
+
+    def __contains__(self, item):
+        return self._backend.contains(self._ns, item)
+
+    def __iter__(self):
+        return iter([k for k, _ in self._backend.items(self._ns)])
+
+    def __len__(self):
+        return self._backend.count(self._ns)
+
+    def scan(self, after=None, limit: int = 100) -> tuple:
+        """
+        One page of items in order: (items, cursor of the next page or None)
+        """
+        rows, cursor = self._backend.scan(self._ns, after, limit)
+        return [k for k, _ in rows], cursor
+
+    def add(self, item):
+        self._backend.set(self._ns, item, "1")
+
+    def discard(self, item):
+        self._backend.delete(self._ns, item)
+
+
+backend = create_backend(os.getenv("STATE_BACKEND", "memory"), os.getenv("STATE_DB_PATH", "state.db"))
+
+phone_to_farmer = StateDict(backend, "phone_to_farmer")
+pending_linking = StateSet(backend, "pending_linking")
+# farmer_id -> the one phone allowed to link a farmer that has no phone in the data files
+farmer_phone = StateDict(backend, "farmer_phone")
+
+report_freq = StateDict(backend, "report_freq")  # daily, weekly or monthly
+last_report_sent = StateDict(backend, "last_report_sent")
+
+
+def _backfill_farmer_phone():
+    # state written before farmer_phone existed: the phones linked so far keep their farmer
+    if len(phone_to_farmer) and not len(farmer_phone):
+        for phone, farmer_id in phone_to_farmer.items():
+            farmer_phone.claim(farmer_id, phone)
 
-report_freq = {} # daily, weekly or monthly
-last_report_sent = {}
 
+_backfill_farmer_phone()
@@ -0,0 +1,109 @@
+"""
+bench_import.py
+Cold start of a worker: `import app.main` and the startup work (load_data,
+scheduler rebuild), each in a fresh interpreter, plus the slowest imports
+reported by python -X importtime.
+
+    python -m benchmarks.bench_import [--runs 5] [--top 15] [--json out.json]
+
+The app is imported with its default settings (AI_BACKEND=gemini), so the run
+also checks that the AI SDK is not imported at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child interpreter, prints one JSON line
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from app.data_loader import data_manager
+from app.services import report_scheduler
+data_manager.load_data()
+report_scheduler.scheduler.rebuild()
+ready = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "startup_seconds": ready - imported,
+    "modules": len(sys.modules),
+    "ai_sdk_imported": any(m.startswith("google.genai") for m in sys.modules),
+}))
+"""
+
+
+def _env() -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ("AI_BACKEND", "PYTHONPROFILEIMPORTTIME")}
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["DATA_RELOAD_INTERVAL"] = "0"
+    return env
+
+
+def run_once() -> dict:
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """
+    (cumulative seconds, self seconds, module) of the slowest imports of app.main
+    """
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, name.rstrip()))
+        except ValueError:
+            continue
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    imports = [r["import_seconds"] for r in runs]
+    startups = [r["startup_seconds"] for r in runs]
+    res = {
+        "runs": args.runs,
+        "import_seconds": {"median": round(statistics.median(imports), 4), "min": round(min(imports), 4)},
+        "startup_seconds": {"median": round(statistics.median(startups), 4), "min": round(min(startups), 4)},
+        "modules": runs[-1]["modules"],
+        "ai_sdk_imported": any(r["ai_sdk_imported"] for r in runs),
+        "slowest_imports": [
+            {"module": name.strip(), "cumulative_seconds": round(c, 4), "self_seconds": round(s, 4)}
+            for c, s, name in slowest_imports(args.top)
+        ],
+    }
+
+    print(f"import app.main: median {res['import_seconds']['median']:.3f}s, min {res['import_seconds']['min']:.3f}s "
+          f"({res['modules']} modules)")
+    print(f"startup (load_data + scheduler): median {res['startup_seconds']['median']:.3f}s")
+    print(f"AI SDK imported at startup: {'YES' if res['ai_sdk_imported'] else 'no'}")
+    print(f"\n{'cumulative s':>12} {'self s':>8}  module")
+    for row in res["slowest_imports"]:
+        print(f"{row['cumulative_seconds']:>12.3f} {row['self_seconds']:>8.3f}  {row['module']}")
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(res, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+bench_report_pool.py
+Report rendering throughput in-process and with 1, 2, 4 ... worker processes
+(report_pool), on synthetic data.
+
+    python -m benchmarks.bench_report_pool [--parcels 20000] [--max-workers N]
+
+The reply cache is disabled so every run renders every summary. Each worker
+count gets a fresh pool and one warm-up run (spawning the workers and mapping
+the snapshot), then a timed run.
+"""
+import argparse
+import os
+import time
+
+# read at import time by the app modules (and by the spawned workers)
+os.environ["REPLY_CACHE_SIZE"] = "0"
+os.environ.setdefault("AI_BACKEND", "fake")
+
+from benchmarks import synthetic_data  # noqa: E402
+
+DATA_ROOT = os.path.join(os.path.dirname(__file__), "data")
+
+
+def worker_counts(max_workers: int) -> list:
+    res = []
+    n = 1
+    while n < max_workers:
+        res.append(n)
+        n *= 2
+    return res + [max_workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report rendering with a process pool")
+    parser.add_argument("--parcels", type=int, default=20000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    data_dir = os.path.join(DATA_ROOT, f"report_pool_{args.parcels}")
+    if not os.path.exists(os.path.join(data_dir, "parcel_indices.json")):
+        print(f"Generating {args.parcels} parcels in {data_dir}")
+        synthetic_data.generate(data_dir, args.parcels)
+    os.environ["DATA_DIR"] = data_dir
+
+    from app.data_loader import data_manager
+    from app.services import report_pool
+
+    data_manager.load_data()
+    farmer_ids = [f["id"] for f in data_manager.FARMERS]
+    report_pool.REPORT_POOL_MIN_FARMERS = 0
+
+    def run(workers) -> float:
+        started = time.perf_counter()
+        for _ in report_pool.render_reports(farmer_ids, workers):
+            pass
+        return time.perf_counter() - started
+
+    run(0)
+    inline = run(0)
+    print(f"\n{len(farmer_ids)} farmers, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'seconds':>9} {'farmers/s':>10} {'speedup':>8}")
+    print(f"{'inline':>8} {inline:>9.2f} {len(farmer_ids) / inline:>10.0f} {1:>8.2f}")
+    for workers in worker_counts(args.max_workers):
+        report_pool.shutdown()
+        run(workers)
+        seconds = run(workers)
+        print(f"{workers:>8} {seconds:>9.2f} {len(farmer_ids) / seconds:>10.0f} {inline / seconds:>8.2f}")
+    report_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+bench_routing.py
+Per-message routing cost (tokenise + match + dispatch lookup) as intents are
+added, compared with the former chain of substring checks.
+
+    python -m benchmarks.bench_routing [messages_per_round]
+
+Every extra intent brings 4 synthetic keywords. The compiled matcher should
+stay roughly flat; the sequential chain grows linearly.
+"""
+import os
+import random
+import string
+import sys
+import time
+
+# the router module imports the AI service, which must not need an API key here
+os.environ.setdefault("AI_BACKEND", "fake")
+
+from app.api.routes.message_router import HANDLERS  # noqa: E402
+from app.services import intent_classifier  # noqa: E402
+from app.services.intent_classifier import KEYWORDS, WORD_KEYWORDS, KeywordMatcher, Message  # noqa: E402
+
+MESSAGES = [
+    "hello",
+    "show my parcels",
+    "P2 details",
+    "how is P1 doing?",
+    "how has P1 changed over the last 30 days",
+    "set weekly reports please",
+    "stop reports",
+    "what is the weather going to be like tomorrow on the north field",
+    "blah",
+]
+
+EXTRA_INTENTS = (0, 16, 64, 256, 1024)
+KEYWORDS_PER_INTENT = 4
+
+
+def synthetic_keywords(n_intents: int) -> dict:
+    rng = random.Random(n_intents)
+    res = {}
+    for i in range(n_intents):
+        for _ in range(KEYWORDS_PER_INTENT):
+            word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 9)))
+            res[word] = f"extra_{i}"
+    return res
+
+
+def compiled_router(matcher):
+
+    def route(text):
+        message = Message(text, matcher)
+        intent = intent_classifier.route(message)
+        return HANDLERS[intent.name]
+
+    return route
+
+
+def sequential_router(keywords: dict):
+    """
+    The shape of the old handle_message: one lowercase + substring scan per rule
+    """
+    by_kind = {}
+    for keyword, kind in {**keywords, **WORD_KEYWORDS}.items():
+        by_kind.setdefault(kind, []).append(keyword)
+    rules = list(by_kind.items())
+
+    def route(text):
+        for kind, words in rules:
+            text_lower = text.lower()
+            if any(w in text_lower for w in words):
+                return kind
+        text.lower().split()
+        return None
+
+    return route
+
+
+def per_message_us(route, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in MESSAGES:
+            route(text)
+    return (time.perf_counter() - started) / (rounds * len(MESSAGES)) * 1e6
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'extra intents':>14} {'keywords':>9} {'compiled us/msg':>16} {'sequential us/msg':>18}")
+    for n in EXTRA_INTENTS:
+        keywords = {**KEYWORDS, **synthetic_keywords(n)}
+        compiled = compiled_router(KeywordMatcher(keywords, WORD_KEYWORDS))
+        sequential = sequential_router(keywords)
+        # warm up
+        per_message_us(compiled, 10)
+        per_message_us(sequential, 10)
+        print(f"{n:>14} {len(keywords) + len(WORD_KEYWORDS):>9} "
+              f"{per_message_us(compiled, rounds):>16.2f} {per_message_us(sequential, rounds):>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+load_test.py
+Load test of the chatbot API on synthetic data.
+
+Virtual users (farmers without a phone) link their account, set daily reports,
+then repeatedly list their parcels, ask for details and for a status summary.
+Users run concurrently, the messages of one user are sent in order. Afterwards
+/generate-reports is paged through until every due report was produced.
+
+Two modes:
+    asgi  the app runs in this process, requests go through httpx's ASGI transport
+          (no network, measures the application itself)
+    http  the app runs under uvicorn in a subprocess, requests go over TCP
+
+    python -m benchmarks.load_test --parcels 10000 --users 200 --concurrency 32
+    python -m benchmarks.load_test --parcels 10000 --mode http
+
+The AI is replaced by the offline stub (AI_BACKEND=fake), so no API key is needed.
+Reported: startup (load_data) time, p50 / p95 / p99 latency and throughput per
+request type, and the resident memory of the process serving the app.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from math import ceil
+
+import httpx
+
+from benchmarks.synthetic_data import generate
+
+DEFAULT_DATA_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def rss_mb(pid: int | None = None) -> dict:
+    """
+    Current and peak resident memory of a process (Linux /proc, falls back to
+    resource.getrusage for this process)
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as fh:
+            fields = dict(line.split(":", 1) for line in fh if ":" in line)
+        return {
+            "rss_mb": round(int(fields["VmRSS"].split()[0]) / 1024, 1),
+            "peak_rss_mb": round(int(fields["VmHWM"].split()[0]) / 1024, 1),
+        }
+    except (OSError, KeyError):
+        if pid is not None:
+            return {"rss_mb": None, "peak_rss_mb": None}
+        from app.data_loader.data_manager import _peak_rss_mb
+        return {"rss_mb": None, "peak_rss_mb": _peak_rss_mb()}
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+class Recorder:
+
+    def __init__(self):
+        # request type -> latencies in seconds
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, kind: str, seconds: float, ok: bool):
+        self.latencies.setdefault(kind, []).append(seconds)
+        if not ok:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        res = {}
+        everything = []
+        for kind, values in self.latencies.items():
+            everything.extend(values)
+            res[kind] = self._stats(sorted(values), self.errors.get(kind, 0))
+        res["all"] = self._stats(sorted(everything), sum(self.errors.values()))
+        res["all"]["throughput_rps"] = round(len(everything) / wall_seconds, 1) if wall_seconds else 0.0
+        return res
+
+    @staticmethod
+    def _stats(values: list, errors: int) -> dict:
+        return {
+            "requests": len(values),
+            "errors": errors,
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        }
+
+
+def build_sessions(data_dir: str, users: int, repeats: int, seed: int) -> list:
+    """
+    One list of (kind, json body) per virtual user, sent to /message in order
+    """
+    with open(os.path.join(data_dir, "farmers.json")) as fh:
+        farmers = json.load(fh)
+    with open(os.path.join(data_dir, "parcels.json")) as fh:
+        parcels = json.load(fh)
+
+    parcels_by_farmer = {}
+    for p in parcels:
+        parcels_by_farmer.setdefault(p["farmer_id"], []).append(p["id"])
+
+    rng = random.Random(seed)
+    sessions = []
+    for f in farmers:
+        if len(sessions) == users:
+            break
+        own = parcels_by_farmer.get(f["id"])
+        if f["phone"] or not own:
+            continue
+        phone = f"+999{len(sessions):08d}"
+        steps = [("link", f["username"]), ("set_frequency", "set daily reports")]
+        for _ in range(repeats):
+            parcel_id = rng.choice(own)
+            steps += [("list", "show my parcels"),
+                      ("details", f"{parcel_id} details"),
+                      ("status", f"how is {parcel_id} doing")]
+        sessions.append([(kind, {"from": phone, "text": text}) for kind, text in steps])
+    return sessions
+
+
+async def run_sessions(client: httpx.AsyncClient, sessions: list, concurrency: int, recorder: Recorder):
+    queue = asyncio.Queue()
+    for session in sessions:
+        queue.put_nowait(session)
+
+    async def worker():
+        while not queue.empty():
+            for kind, body in queue.get_nowait():
+                started = time.perf_counter()
+                try:
+                    r = await client.post("/message", json=body)
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                recorder.add(kind, time.perf_counter() - started, ok)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_reports(client: httpx.AsyncClient, page_size: int, recorder: Recorder) -> int:
+    """
+    Pages through /generate-reports, returns how many reports were produced
+    """
+    sent = 0
+    cursor = None
+    while True:
+        params = {"limit": page_size}
+        if cursor:
+            params["cursor"] = cursor
+        started = time.perf_counter()
+        r = await client.post("/generate-reports", params=params)
+        recorder.add("generate_reports", time.perf_counter() - started, r.status_code == 200)
+        if r.status_code != 200:
+            return sent
+        body = r.json()
+        sent += body["reports_sent"]
+        cursor = body.get("next_cursor")
+        if not cursor:
+            return sent
+
+
+async def drive(client, args, sessions) -> dict:
+    recorder = Recorder()
+    started = time.perf_counter()
+    await run_sessions(client, sessions, args.concurrency, recorder)
+    messages_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    reports = await run_reports(client, args.report_page, recorder)
+    reports_seconds = time.perf_counter() - started
+
+    res = recorder.summary(messages_seconds + reports_seconds)
+    res["all"]["messages_seconds"] = round(messages_seconds, 3)
+    res["all"]["reports_seconds"] = round(reports_seconds, 3)
+    res["all"]["reports_sent"] = reports
+    return res
+
+
+def _server_env(args) -> dict:
+    """
+    Settings the app reads at import time
+    """
+    return {
+        "DATA_DIR": args.data_dir,
+        "AI_BACKEND": "fake",
+        "FAKE_AI_LATENCY": str(args.ai_latency),
+        "REPORT_SCHEDULER": "off",
+        # measure report generation, not the gateway rate limit
+        "DELIVERY_RATE": "0",
+        "DATA_RELOAD_INTERVAL": "0",
+        "STATE_BACKEND": args.state_backend,
+        "STATE_DB_PATH": os.path.join(args.data_dir, "bench_state.db"),
+    }
+
+
+def run_asgi(args, sessions) -> dict:
+    os.environ.update(_server_env(args))
+
+    started = time.perf_counter()
+    from app.main import app
+    from app.api.routes import message_router
+    from app.data_loader import data_manager
+    from app.services import delivery, report_scheduler
+    import_seconds = time.perf_counter() - started
+
+    # what the startup event does, timed on its own
+    started = time.perf_counter()
+    data_manager.load_data()
+    report_scheduler.scheduler.rebuild()
+    startup_seconds = time.perf_counter() - started
+    delivery.queue.start()
+    after_startup = rss_mb()
+
+    message_router.USE_AI = args.ai
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await drive(client, args, sessions)
+
+    res = asyncio.run(main())
+    delivery.queue.drain()
+    delivery.queue.stop()
+    return {
+        "startup": {"import_seconds": round(import_seconds, 3), "load_data_seconds": round(startup_seconds, 3),
+                    "load_stats": data_manager.LOAD_STATS, **after_startup},
+        "requests": res,
+        "delivery": delivery.queue.stats(),
+        "memory": rss_mb(),
+    }
+
+
+def run_http(args, sessions) -> dict:
+    env = {**os.environ, **_server_env(args)}
+    url = args.url
+    server = None
+    startup = {}
+    if url is None:
+        url = f"http://127.0.0.1:{args.port}"
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL)
+        # ready once the startup event (load_data) finished and requests are served
+        while True:
+            if server.poll() is not None:
+                raise SystemExit("uvicorn exited during startup")
+            try:
+                if httpx.get(url + "/debug/fast-path", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+        startup = {"ready_seconds": round(time.perf_counter() - started, 3), **rss_mb(server.pid)}
+
+    async def main():
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+            return await drive(client, args, sessions)
+
+    try:
+        res = asyncio.run(main())
+        memory = rss_mb(server.pid) if server else {}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return {"startup": startup, "requests": res, "memory": memory}
+
+
+def print_report(report: dict):
+    print("\nStartup:", report["startup"])
+    print("Memory: ", report["memory"])
+    if "delivery" in report:
+        print("Delivery:", report["delivery"])
+    print(f"\n{'request':<18}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, s in report["requests"].items():
+        print(f"{kind:<18}{s['requests']:>8}{s['errors']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}")
+    total = report["requests"]["all"]
+    print(f"\nthroughput: {total['throughput_rps']} req/s, reports sent: {total['reports_sent']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the farmer-assistant API on synthetic data")
+    parser.add_argument("--parcels", type=int, default=1000, help="scale of the synthetic dataset")
+    parser.add_argument("--years", type=float, default=3, help="history length per parcel")
+    parser.add_argument("--interval-days", type=int, default=15, help="days between observations")
+    parser.add_argument("--data-dir", help="where the synthetic data is kept (generated if missing)")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--mode", choices=("asgi", "http"), default="asgi")
+    parser.add_argument("--url", help="http mode: test an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5, help="list/details/status rounds per user")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--report-page", type=int, default=100)
+    parser.add_argument("--state-backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--ai", action="store_true", help="asgi mode: go through the AI path (stub backend)")
+    parser.add_argument("--ai-latency", type=float, default=0.0, help="simulated AI latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.data_dir is None:
+        args.data_dir = os.path.join(DEFAULT_DATA_ROOT, f"{args.parcels}_{args.years:g}y_{args.interval_days}d")
+    args.data_dir = os.path.abspath(args.data_dir)
+    if args.regenerate or not os.path.exists(os.path.join(args.data_dir, "parcel_indices.json")):
+        started = time.perf_counter()
+        info = generate(args.data_dir, args.parcels, years=args.years, interval_days=args.interval_days,
+                        seed=args.seed)
+        print(f"Generated {info} in {time.perf_counter() - started:.1f}s")
+    db_path = os.path.join(args.data_dir, "bench_state.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    sessions = build_sessions(args.data_dir, args.users, args.repeats, args.seed)
+    print(f"{len(sessions)} users, {sum(len(s) for s in sessions)} messages, mode {args.mode}")
+
+    report = run_asgi(args, sessions) if args.mode == "asgi" else run_http(args, sessions)
+    report["config"] = {k: v for k, v in vars(args).items() if k != "json"}
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+synthetic_data.py
+Generates farmers.json, parcels.json and parcel_indices.json in the same shape
+as data/, at any scale. Files are written incrementally, so 10^6 parcels do not
+need the whole dataset in memory (they do need disk: roughly 150 bytes per
+observation, i.e. parcels * years * 365 / interval_days * 150 bytes).
+
+    python -m benchmarks.synthetic_data OUT_DIR --parcels 100000 [--years 3] [--interval-days 15]
+
+Half of the farmers have no phone, so they can be linked by the load test.
+"""
+import argparse
+import json
+import os
+import random
+from datetime import date, timedelta
+
+CROPS = ("Wheat", "Maize", "Sunflower", "Rapeseed", "Soybean", "Barley", "Alfalfa", "Apples")
+FIELD_NAMES = ("North Field", "South Slope", "East Meadow", "West Terrace", "River Plot", "Valley Field",
+               "Orchard Strip", "Hill Top")
+
+# metric -> (low, high, step of the random walk)
+METRIC_RANGES = {
+    "ndvi": (0.1, 0.9, 0.08),
+    "ndmi": (0.05, 0.45, 0.05),
+    "ndwi": (0.05, 0.35, 0.04),
+    "soc": (1.0, 3.0, 0.1),
+    "nitrogen": (0.4, 1.2, 0.06),
+    "phosphorus": (0.2, 0.55, 0.03),
+    "potassium": (0.35, 0.85, 0.04),
+    "ph": (5.0, 7.8, 0.1),
+}
+
+START_DATE = date(2022, 1, 1)
+
+
+def farmer_id(i: int) -> str:
+    return f"F{i + 1}"
+
+
+def username(i: int) -> str:
+    return f"farmer{i + 1}"
+
+
+def _write_array(path: str, items):
+    """
+    Writes a JSON array one element at a time
+    """
+    with open(path, "w") as out:
+        out.write("[")
+        for n, item in enumerate(items):
+            out.write(",\n" if n else "\n")
+            out.write(json.dumps(item))
+        out.write("\n]\n")
+
+
+def _history(rng: random.Random, n_obs: int, interval_days: int, missing_rate: float) -> list:
+    values = {m: rng.uniform(lo, hi) for m, (lo, hi, _) in METRIC_RANGES.items()}
+    records = []
+    day = START_DATE + timedelta(days=rng.randrange(interval_days))
+    for _ in range(n_obs):
+        rec = {"date": day.isoformat()}
+        for m, (lo, hi, step) in METRIC_RANGES.items():
+            values[m] = min(hi, max(lo, values[m] + rng.uniform(-step, step)))
+            rec[m] = None if rng.random() < missing_rate else round(values[m], 2)
+        records.append(rec)
+        day += timedelta(days=interval_days)
+    return records
+
+
+def generate(out_dir: str, parcels: int, parcels_per_farmer: int = 5, years: float = 3,
+             interval_days: int = 15, missing_rate: float = 0.05, seed: int = 0) -> dict:
+    """
+    Writes the three data files to out_dir and returns what was generated
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    n_farmers = max(1, -(-parcels // parcels_per_farmer))
+    n_obs = max(1, int(years * 365 / interval_days))
+
+    _write_array(os.path.join(out_dir, "farmers.json"), (
+        {
+            "id": farmer_id(i),
+            "username": username(i),
+            "name": f"Farmer {i + 1}",
+            "phone": f"+4070{i:07d}" if i % 2 else None,
+        }
+        for i in range(n_farmers)
+    ))
+
+    _write_array(os.path.join(out_dir, "parcels.json"), (
+        {
+            "id": f"P{p + 1}",
+            "farmer_id": farmer_id(p // parcels_per_farmer),
+            "name": FIELD_NAMES[p % len(FIELD_NAMES)],
+            "area_ha": round(rng.uniform(1, 50), 1),
+            "crop": CROPS[p % len(CROPS)],
+        }
+        for p in range(parcels)
+    ))
+
+    with open(os.path.join(out_dir, "parcel_indices.json"), "w") as out:
+        out.write("{")
+        for p in range(parcels):
+            out.write(",\n" if p else "\n")
+            out.write(f'"P{p + 1}": ')
+            out.write(json.dumps(_history(rng, n_obs, interval_days, missing_rate)))
+        out.write("\n}\n")
+
+    return {
+        "farmers": n_farmers,
+        "parcels": parcels,
+        "parcels_per_farmer": parcels_per_farmer,
+        "observations": parcels * n_obs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic farmer-assistant data")
+    parser.add_argument("out_dir")
+    parser.add_argument("--parcels", type=int, default=1000)
+    parser.add_argument("--parcels-per-farmer", type=int, default=5)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--interval-days", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    info = generate(args.out_dir, args.parcels, args.parcels_per_farmer, args.years, args.interval_days,
+                    seed=args.seed)
+    print(f"Generated in {args.out_dir}: {info}")
+
+
+if __name__ == "__main__":
+    main()
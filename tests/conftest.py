@@ -0,0 +1,35 @@
+import pytest
+
+from app.data_loader import data_manager
+from app.storage import state_store
+from app.storage.backends import MemoryBackend, SqliteBackend
+
+
+@pytest.fixture(scope="session", autouse=True)
+def data():
+    data_manager.load_data()
+
+
+@pytest.fixture
+def use_backend(monkeypatch):
+    """
+    use_backend(backend) points every state_store namespace at backend
+    """
+
+    def use(backend):
+        monkeypatch.setattr(state_store, "backend", backend)
+        for name in ("phone_to_farmer", "farmer_phone", "report_freq", "last_report_sent"):
+            monkeypatch.setattr(state_store, name, state_store.StateDict(backend, name))
+        monkeypatch.setattr(state_store, "pending_linking", state_store.StateSet(backend, "pending_linking"))
+
+    return use
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryBackend()
+    else:
+        b = SqliteBackend(str(tmp_path / "state.db"))
+        yield b
+        b.close()
@@ -0,0 +1,57 @@
+from app.services import account_linking_service
+from app.storage.backends import SqliteBackend
+
+# F3 (maria.stan) has no phone in data/farmers.json, F1 (ana.popescu) has one
+FREE_USERNAME = "maria.stan"
+F1_PHONE = "+40741111111"
+
+
+def link(use_backend, backend, phone, username):
+    use_backend(backend)
+    return account_linking_service.try_link_account(phone, username)
+
+
+def test_second_phone_cannot_take_a_linked_farmer(use_backend, backend):
+    assert link(use_backend, backend, "+401", FREE_USERNAME).startswith("Great, Maria Stan!")
+    assert link(use_backend, backend, "+402", FREE_USERNAME) == \
+        "This account is already linked to a different phone number."
+    assert backend.keys_for("phone_to_farmer", "F3") == ["+401"]
+
+
+def test_same_phone_links_again(use_backend, backend):
+    link(use_backend, backend, "+401", FREE_USERNAME)
+    assert link(use_backend, backend, "+401", FREE_USERNAME) == "Your phone is already linked to farmer F3."
+
+
+def test_phone_from_the_data_files(use_backend, backend):
+    assert link(use_backend, backend, "+409", "ana.popescu") == \
+        "This account is already linked to a different phone number."
+    assert link(use_backend, backend, F1_PHONE, "ana.popescu") == "Great! Your phone is now linked."
+
+
+def test_binding_survives_a_restart(use_backend, tmp_path):
+    path = str(tmp_path / "state.db")
+    before = SqliteBackend(path)
+    link(use_backend, before, "+401", FREE_USERNAME)
+    before.close()
+
+    after = SqliteBackend(path)
+    try:
+        assert link(use_backend, after, "+402", FREE_USERNAME) == \
+            "This account is already linked to a different phone number."
+    finally:
+        after.close()
+
+
+def test_binding_is_shared_between_workers(use_backend, tmp_path):
+    path = str(tmp_path / "state.db")
+    worker_a = SqliteBackend(path, flush_interval=3600)
+    worker_b = SqliteBackend(path, flush_interval=3600)
+    try:
+        link(use_backend, worker_a, "+401", FREE_USERNAME)
+        assert link(use_backend, worker_b, "+401", FREE_USERNAME) == "Your phone is already linked to farmer F3."
+        assert link(use_backend, worker_b, "+402", FREE_USERNAME) == \
+            "This account is already linked to a different phone number."
+    finally:
+        worker_a.close()
+        worker_b.close()
@@ -0,0 +1,57 @@
+from app.services.ai_handler import handle_intent
+
+# P1 belongs to F1, P7 to F3 (data/parcels.json)
+
+
+def test_parcel_status_of_another_farmer_is_refused():
+    result = handle_intent({"intent": "PARCEL_STATUS", "parcel_id": "P1"}, "F3", "+402")
+    assert result["error"] == "This parcel does not belong to you.."
+    assert result["data"] is None
+
+
+def test_parcel_status_of_own_parcel():
+    result = handle_intent({"intent": "PARCEL_STATUS", "parcel_id": "P1"}, "F1", "+401")
+    assert result["error"] is None
+    assert result["data"]["reply"]
+
+
+def test_unknown_parcel():
+    result = handle_intent({"intent": "PARCEL_STATUS", "parcel_id": "P999"}, "F1", "+401")
+    assert result["error"] == "Parcel not found"
+
+
+def test_every_parcel_intent_checks_ownership():
+    for intent in ("PARCEL_DETAILS", "PARCEL_STATUS", "PARCEL_TREND"):
+        result = handle_intent({"intent": intent, "parcel_id": "P1"}, "F3", "+402")
+        assert result["error"] == "This parcel does not belong to you..", intent
+        assert result["data"] is None, intent
+
+
+def test_trend_days_from_the_model_are_coerced_and_clamped():
+    from app.services.parcels_service import TREND_DAYS, TREND_MAX_DAYS, trend_days
+
+    assert trend_days(None) == TREND_DAYS
+    assert trend_days("abc") == TREND_DAYS
+    assert trend_days([7]) == TREND_DAYS
+    assert trend_days(float("inf")) == TREND_DAYS
+    assert trend_days("14") == 14
+    assert trend_days(7.9) == 7
+    assert trend_days(-5) == 1
+    assert trend_days(0) == 1
+    assert trend_days(10 ** 12) == TREND_MAX_DAYS
+
+    result = handle_intent({"intent": "PARCEL_TREND", "parcel_id": "P1", "days": "lots"}, "F1", "+401")
+    assert result["error"] is None
+
+
+def test_rule_path_clamps_the_trend_window_too():
+    from app.services import intent_classifier
+    from app.services.parcels_service import TREND_DAYS, TREND_MAX_DAYS
+
+    def days(text):
+        return intent_classifier.route(intent_classifier.tokenize(text)).days
+
+    assert days("how has P1 changed over the last 99999 days") == TREND_MAX_DAYS
+    assert days("how has P1 changed over the last 0 days") == 1
+    assert days("how has P1 changed over the last 2 weeks") == 14
+    assert days("P1 trend") == TREND_DAYS
@@ -0,0 +1,23 @@
+import pytest
+
+from app.data_loader import data_manager
+from app.services import analytics_service
+
+
+@pytest.mark.parametrize("conditions, match_all", [
+    ({"ndvi": ["poor"], "nitrogen": ["low"]}, False),
+    ({"ndvi": ["poor", "moderate"], "nitrogen": ["low"]}, True),
+    ({"soc": ["poor"], "ph": ["optimal"]}, True),
+])
+def test_farmer_filter_agrees_with_the_portfolio(conditions, match_all):
+    analytics_service.rebuild()
+    everyone = analytics_service.parcels_matching(conditions, match_all)
+    owner = {p["id"]: p["farmer_id"] for p in data_manager.PARCELS}
+
+    for farmer_id in {p["farmer_id"] for p in data_manager.PARCELS}:
+        mine = analytics_service.parcels_matching(conditions, match_all, farmer_id)
+        assert sorted(mine) == sorted(p for p in everyone if owner[p] == farmer_id)
+
+
+def test_unknown_farmer_matches_nothing():
+    assert analytics_service.parcels_matching({"ndvi": ["poor"]}, farmer_id="nobody") == []
@@ -0,0 +1,174 @@
+import time
+from datetime import date
+
+import pytest
+
+from app.services import delivery, report_engine, report_scheduler
+from app.services.delivery import DeliveryQueue, MemorySender, Sender
+from app.storage import state_store
+from app.storage.backends import MemoryBackend
+
+
+class ScriptedSender(Sender):
+    """
+    Fails every message the given number of times before acknowledging it
+    """
+
+    def __init__(self, failures: dict = None, raise_first: int = 0):
+        self.failures = dict(failures or {})
+        self.raise_first = raise_first
+        self.attempts = []
+        self.acked = []
+
+    def send_batch(self, messages):
+        now = time.monotonic()
+        self.attempts.extend((m["to"], now) for m in messages)
+        if self.raise_first:
+            self.raise_first -= 1
+            raise ConnectionError("gateway down")
+        acks = []
+        for m in messages:
+            left = self.failures.get(m["to"], 0)
+            self.failures[m["to"]] = left - 1
+            acks.append(left <= 0)
+        self.acked.extend(m["to"] for m, ok in zip(messages, acks) if ok)
+        return acks
+
+
+def message(to):
+    return {"to": to, "farmer_id": "F1", "message": "hi"}
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(sender, **kwargs):
+        kwargs.setdefault("rate", 0)
+        kwargs.setdefault("batch_wait", 0)
+        kwargs.setdefault("backoff", 0.01)
+        q = DeliveryQueue(sender, **kwargs)
+        q.start()
+        queues.append(q)
+        return q
+
+    yield make
+    for q in queues:
+        q.stop()
+
+
+def test_failed_messages_are_retried_with_backoff(make_queue):
+    sender = ScriptedSender({"+401": 2})
+    q = make_queue(sender, backoff=0.05)
+    done = []
+    assert q.put([message("+401")], lambda acked, failed: done.append((acked, failed)))
+    assert q.drain(5)
+
+    times = [t for to, t in sender.attempts if to == "+401"]
+    assert len(times) == 3
+    # 0.05 then 0.1, each with up to 20% jitter
+    assert times[1] - times[0] >= 0.04
+    assert times[2] - times[1] >= 0.08
+    assert done == [(1, 0)]
+    stats = q.stats()
+    assert (stats["acked"], stats["retried"], stats["dead"]) == (1, 2, 0)
+
+
+def test_sender_exception_retries_the_whole_batch(make_queue):
+    sender = ScriptedSender(raise_first=1)
+    q = make_queue(sender)
+    assert q.put([message("+401"), message("+402")])
+    assert q.drain(5)
+    assert sorted(sender.acked) == ["+401", "+402"]
+    assert q.stats()["retried"] == 2
+
+
+def test_gives_up_after_max_attempts(make_queue):
+    sender = ScriptedSender({"+401": 100})
+    q = make_queue(sender, max_attempts=3)
+    done = []
+    q.put([message("+401"), message("+402")], lambda acked, failed: done.append((acked, failed)))
+    assert q.drain(5)
+    assert len([to for to, _ in sender.attempts if to == "+401"]) == 3
+    assert list(q.dead_letters) == [message("+401")]
+    assert done == [(1, 1)]
+
+
+def test_on_done_runs_once_after_the_whole_group(make_queue):
+    sender = ScriptedSender({"+402": 1})
+    q = make_queue(sender, batch_size=1)
+    calls = []
+
+    def on_done(group):
+        def callback(acked, failed):
+            calls.append((group, acked, failed, list(sender.acked)))
+        return callback
+
+    q.put([message("+401"), message("+402"), message("+403")], on_done("a"))
+    q.put([message("+404")], on_done("b"))
+    assert q.drain(5)
+
+    assert [c[:3] for c in calls] == [("b", 1, 0), ("a", 3, 0)]
+    # "a" completes only once its retried message got through
+    assert {"+401", "+402", "+403"} <= set(calls[1][3])
+
+
+def test_full_queue_refuses_the_group(make_queue):
+    q = DeliveryQueue(MemorySender(), maxsize=3)
+    assert q.put([message("+401"), message("+402")])
+    assert not q.put([message("+403"), message("+404")])
+    assert len(q) == 2
+    assert q.stats()["rejected"] == 2
+    assert q.put([message("+403")])
+
+
+@pytest.fixture
+def reports(monkeypatch, use_backend):
+    use_backend(MemoryBackend())
+    for i, farmer_id in enumerate(("F1", "F3", "F5")):
+        state_store.phone_to_farmer[f"+40{i}"] = farmer_id
+        state_store.report_freq[farmer_id] = "daily"
+    monkeypatch.setattr(report_scheduler, "scheduler", report_scheduler.ReportScheduler())
+    monkeypatch.setattr(report_engine, "_delivering", set())
+    report_scheduler.scheduler.rebuild()
+
+    def use_queue(q):
+        monkeypatch.setattr(delivery, "queue", q)
+        return q
+
+    return use_queue
+
+
+TODAY = date(2025, 6, 2)
+
+
+def test_report_is_marked_sent_only_when_acked(reports, make_queue):
+    q = reports(make_queue(ScriptedSender({"+401": 100}), max_attempts=2))
+    assert report_scheduler.tick(TODAY) == 3
+    assert q.drain(5)
+
+    assert state_store.last_report_sent.get("F1") == str(TODAY)
+    assert state_store.last_report_sent.get("F5") == str(TODAY)
+    # F3's only phone never acked: not marked, due again
+    assert state_store.last_report_sent.get("F3") is None
+    assert report_scheduler.scheduler.due(TODAY) == ["F3"]
+    assert report_engine.delivering() == 0
+
+
+def test_full_queue_keeps_the_rest_due(reports):
+    reports(DeliveryQueue(MemorySender(), maxsize=1))
+    assert report_scheduler.tick(TODAY) == 1
+    assert report_engine.delivering() == 1
+    assert sorted(report_scheduler.scheduler.due(TODAY)) == ["F3", "F5"]
+
+
+def test_stopping_a_run_early_keeps_the_rest_due(reports):
+    reports(DeliveryQueue(MemorySender()))
+    farmer_ids = report_scheduler.scheduler.pop_due(TODAY)
+    run = report_engine.iter_reports(farmer_ids, TODAY)
+    first = next(run)
+    # e.g. the client of /generate-reports/stream went away
+    run.close()
+
+    assert report_engine.delivering() == 1
+    assert sorted(report_scheduler.scheduler.due(TODAY)) == sorted(set(farmer_ids) - {first["farmer_id"]})
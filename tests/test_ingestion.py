@@ -0,0 +1,96 @@
+import threading
+from datetime import date
+
+from app.data_loader.timeseries import ParcelTimeSeries
+from app.services.ingestion_service import IngestBatch
+
+
+def collect(chunks, max_line_bytes=64):
+    batch = IngestBatch(max_line_bytes)
+    lines = []
+    batch.feed = lambda line: (lines.append(line), setattr(batch, "line_no", batch.line_no + 1))
+    for chunk in chunks:
+        batch.feed_chunk(chunk)
+    return batch, lines, batch.finish()
+
+
+def test_lines_split_across_chunks():
+    _, lines, _ = collect([b'{"a":', b' 1}\n{"b"', b": 2}\n", b"\n", b'{"c": 3}'])
+    assert lines == ['{"a": 1}', '{"b": 2}', "", '{"c": 3}']
+
+
+def test_utf8_split_across_chunks():
+    data = '{"name": "Șerban"}\n'.encode("utf-8")
+    cut = data.index(b"\xc8") + 1
+    _, lines, _ = collect([data[:cut], data[cut:]])
+    assert lines == ['{"name": "Șerban"}']
+
+
+def test_long_line_is_rejected_without_buffering():
+    batch, lines, res = collect([b"x" * 40, b"y" * 40, b"z" * 40 + b"\nshort\n", b"w" * 100])
+    assert lines == ["short"]
+    assert res["rejected"] == 2
+    assert [e["line"] for e in res["errors"]] == [1, 3]
+    assert not batch._partial
+
+
+def test_invalid_lines_are_reported():
+    batch = IngestBatch()
+    batch.feed_chunk(b'not json\n{"parcel_id": "P999", "date": "2025-01-01", "ndvi": 0.5}\n')
+    res = batch.finish()
+    assert res["lines"] == 2 and res["rejected"] == 2 and res["parcels_changed"] == 0
+
+
+def test_readers_never_index_past_the_end_during_appends():
+    series = ParcelTimeSeries.from_records([{"date": "2020-01-01", "ndvi": 0.5}])
+    series.trends()  # prefix sums exist, appends extend them
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                n = len(series.dates)
+                series.columns["ndvi"][n - 1]
+                series.trend("ndvi")
+                series.latest()
+            except IndexError as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for day in range(2, 20000):
+        series.append({"date": 737425 + day, "ndvi": 0.5})
+    # an older date goes through the insert path
+    series.append({"date": 737000, "ndvi": 0.1})
+    stop.set()
+    reader.join()
+    assert not errors
+    assert len(series.dates) == len(series.columns["ndvi"]) == 20000
+
+
+def test_readers_see_aligned_rows_during_out_of_order_inserts():
+    base = 737000
+    series = ParcelTimeSeries.from_records([{"date": base + 5000, "ndvi": 5000.0}])
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            for rec in series.range(date(2018, 1, 1)):
+                ndvi = rec["ndvi"]
+                if ndvi != date.fromisoformat(rec["date"]).toordinal() - base:
+                    errors.append(rec)
+            series.trends()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    # every date is older than the latest one: all of them go through the insert path
+    for day in range(4999, 3000, -1):
+        series.append({"date": base + day, "ndvi": float(day)})
+    series.upsert({"date": base + 4000, "ndvi": 4000.0, "soc": 1.0})
+    stop.set()
+    reader.join()
+    assert not errors
+    assert len(series) == 2000
+    assert series.trend("ndvi")["mean"] == 4000.5
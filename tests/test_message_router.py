@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+from app.api.routes import message_router
+from app.services import ai_response, ai_service, intent_classifier, metrics, report_service
+from app.services.sessions import Session
+
+
+def _linked_session(phone="+401", farmer_id="F1"):
+    session = Session(phone)
+    session.farmer_id = farmer_id
+    return session
+
+
+def _ask_model(monkeypatch, reply):
+    async def parse(text):
+        return reply
+
+    async def render(result):
+        return "ok"
+
+    monkeypatch.setattr(message_router, "USE_AI", True)
+    monkeypatch.setattr(intent_classifier, "FAST_PATH_THRESHOLD", 2.0)
+    monkeypatch.setattr(ai_service, "parse_message_async", parse)
+    monkeypatch.setattr(ai_response, "ai_format_response_async", render)
+
+
+def test_unknown_model_intent_is_counted_as_unknown(monkeypatch):
+    _ask_model(monkeypatch, '{"intent": "DROP TABLE farmers"}')
+    before = metrics.INTENTS.value(intent="UNKNOWN", source="model")
+
+    reply = asyncio.run(message_router._handle_message(_linked_session(), "what is going on"))
+
+    assert reply["reply"] == "ok"
+    assert metrics.INTENTS.value(intent="UNKNOWN", source="model") == before + 1
+    assert metrics.INTENTS.value(intent="DROP TABLE farmers", source="model") == 0
+
+
+def test_intent_label():
+    assert message_router._intent_label("PARCEL_STATUS") == "PARCEL_STATUS"
+    for name in (None, "", "parcel_status", ["PARCEL_STATUS"], 3):
+        assert message_router._intent_label(name) == "UNKNOWN"
+
+
+def test_failing_batch_message_is_counted_and_logged(monkeypatch, capsys):
+    async def handle(session, text):
+        if text == "boom":
+            raise RuntimeError("handler broke")
+        return {"reply": text}
+
+    monkeypatch.setattr(message_router, "_handle_message", handle)
+    before = metrics.MESSAGE_FAILURES.value(reason="RuntimeError")
+    payload = message_router.MessageBatchPayload(messages=[
+        {"from": "+491", "text": "one"},
+        {"from": "+491", "text": "boom"},
+        {"from": "+492", "text": "two"},
+    ])
+
+    result = asyncio.run(message_router.handle_message_batch(payload))
+
+    assert result["replies"] == [{"reply": "one"}, {"error": "Message could not be processed"}, {"reply": "two"}]
+    assert metrics.MESSAGE_FAILURES.value(reason="RuntimeError") == before + 1
+    err = capsys.readouterr().err
+    assert "Traceback" in err and "handler broke" in err
+
+
+def test_blocked_state_write_does_not_stall_other_messages(monkeypatch):
+    released = threading.Event()
+
+    def locked_backend(farmer_id, frequency):
+        # e.g. SQLite waiting on busy_timeout
+        released.wait(5)
+
+    monkeypatch.setattr(report_service, "set_report_frequency", locked_backend)
+
+    async def scenario():
+        blocked = asyncio.create_task(message_router._handle_message(_linked_session(), "set daily reports"))
+        other = await asyncio.wait_for(
+            message_router._handle_message(_linked_session("+402", "F3"), "show my parcels"), 2)
+        assert not blocked.done()
+        released.set()
+        return other, await blocked
+
+    other, blocked = asyncio.run(scenario())
+    assert other["reply"].startswith("You have")
+    assert blocked["reply"] == message_router.FREQUENCY_REPLIES["daily"]
@@ -0,0 +1,9 @@
+from app.services import parcels_service
+
+
+def test_shared_lookups_return_a_copy():
+    with parcels_service.shared_lookups():
+        first = parcels_service.get_parcels_for_farmer("F1")
+        first.clear()
+        assert parcels_service.get_parcels_for_farmer("F1")
+        assert parcels_service.get_parcels_for_farmer("F1") is not parcels_service.get_parcels_for_farmer("F1")
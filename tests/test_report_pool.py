@@ -0,0 +1,79 @@
+import subprocess
+import sys
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.data_loader import data_manager
+from app.data_loader.snapshot import write_snapshot
+from app.services import report_pool
+from app.services.parcel_summary_service import render_report
+
+FARMERS = ["F1", "F2", "F3", "F4"]
+
+
+class FakePool:
+    """
+    Renders the first `healthy` chunks, then fails every task like a pool whose worker died
+    """
+
+    def __init__(self, healthy: int):
+        self.healthy = healthy
+        self.submitted = 0
+        self.shut_down = False
+
+    def submit(self, fn, path, generation, chunk):
+        self.submitted += 1
+        future = Future()
+        if self.submitted > self.healthy:
+            future.set_exception(BrokenProcessPool("worker died"))
+        else:
+            future.set_result(([(farmer_id, render_report(farmer_id)) for farmer_id in chunk], 0.0))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool(healthy=1)
+    monkeypatch.setattr(report_pool, "REPORT_POOL_MIN_FARMERS", 0)
+    monkeypatch.setattr(report_pool, "REPORT_CHUNK_SIZE", 1)
+    monkeypatch.setattr(report_pool, "_current_snapshot", lambda: ("unused.bin", 0))
+    monkeypatch.setattr(report_pool, "_get_pool", lambda workers: pool)
+    return pool
+
+
+def test_failed_worker_falls_back_to_in_process(pool):
+    result = list(report_pool.render_reports(FARMERS, workers=1))
+
+    assert result == [(farmer_id, render_report(farmer_id)) for farmer_id in FARMERS]
+    assert pool.shut_down
+
+
+def test_failing_report_still_raises(monkeypatch, pool):
+    def broken(farmer_id):
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(report_pool, "render_report", broken)
+    pool.healthy = 0
+    with pytest.raises(RuntimeError):
+        list(report_pool.render_reports(FARMERS, workers=1))
+
+
+def test_workers_do_not_load_delivery_or_state(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    dataset = data_manager.current()
+    write_snapshot(path, dataset.farmers, dataset.parcels, dataset.indices)
+
+    # what a spawned worker runs: unpickle _render_chunk and call it
+    code = (
+        "import sys; from app.services.report_pool import _render_chunk; "
+        f"assert _render_chunk({path!r}, 1, ['F1'])[0][0][1].startswith('You have'); "
+        "print(sorted(m for m in ('app.services.delivery', 'app.services.report_engine', "
+        "'app.storage.state_store', 'sqlite3') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip().splitlines()[-1] == "[]"
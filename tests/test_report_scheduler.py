@@ -0,0 +1,117 @@
+import threading
+import time
+from datetime import date
+
+import pytest
+
+from app.services import delivery, report_engine, report_pool, report_scheduler
+from app.storage import state_store
+from app.storage.backends import MemoryBackend, SqliteBackend
+
+TODAY = date(2025, 6, 2)
+FARMERS = ("F1", "F2", "F3")
+
+
+@pytest.fixture
+def scheduler(monkeypatch, use_backend):
+    use_backend(MemoryBackend())
+    for i, farmer_id in enumerate(FARMERS):
+        state_store.phone_to_farmer[f"+40{i}"] = farmer_id
+        state_store.report_freq[farmer_id] = "daily"
+    monkeypatch.setattr(report_scheduler, "scheduler", report_scheduler.ReportScheduler())
+    monkeypatch.setattr(delivery, "queue", delivery.DeliveryQueue(delivery.MemorySender(), rate=0))
+    monkeypatch.setattr(report_engine, "_delivering", set())
+    report_scheduler.scheduler.rebuild()
+    return report_scheduler.scheduler
+
+
+def test_next_due():
+    assert report_scheduler.next_due(None, None) is None
+    assert report_scheduler.next_due("daily", None) == date.min
+    assert report_scheduler.next_due("weekly", "2025-06-02") == date(2025, 6, 9)
+    assert report_scheduler.next_due("monthly", "2025-12-31") == date(2026, 1, 1)
+
+
+def test_tick_queues_every_due_farmer(scheduler):
+    assert report_scheduler.tick(TODAY) == 3
+    assert report_engine.delivering() == 3
+    assert scheduler.due(TODAY) == []
+
+
+def test_failed_render_keeps_the_rest_scheduled(monkeypatch, scheduler):
+    render = report_pool.render_report
+
+    def flaky(farmer_id):
+        if farmer_id == "F2":
+            raise RuntimeError("render failed")
+        return render(farmer_id)
+
+    monkeypatch.setattr(report_pool, "render_report", flaky)
+    with pytest.raises(RuntimeError):
+        report_scheduler.tick(TODAY)
+
+    # F1 was queued before the failure; F2 and F3 are due again
+    assert report_engine.delivering() == 1
+    assert sorted(scheduler.due(TODAY)) == ["F2", "F3"]
+
+
+def test_concurrent_runs_queue_each_farmer_once(monkeypatch, scheduler):
+    render = report_pool.render_report
+
+    def slow(farmer_id):
+        time.sleep(0.01)
+        return render(farmer_id)
+
+    monkeypatch.setattr(report_pool, "render_report", slow)
+    both_selected = threading.Barrier(2)
+    queued = []
+
+    def run():
+        farmer_ids, _ = report_engine.select_due(TODAY)
+        both_selected.wait()
+        queued.extend(report_engine.iter_reports(farmer_ids, TODAY))
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(m["farmer_id"] for m in queued) == list(FARMERS)
+    assert report_engine.delivering() == len(FARMERS)
+
+
+def test_farmer_without_phone_is_released(scheduler):
+    state_store.report_freq["F4"] = "daily"
+    scheduler.update("F4")
+
+    assert report_scheduler.tick(TODAY) == 3
+    assert report_engine.delivering() == 3
+    assert scheduler.due(TODAY) == ["F4"]
+
+
+def test_refresh_sees_changes_of_other_workers(tmp_path, use_backend):
+    path = str(tmp_path / "state.db")
+    mine = SqliteBackend(path, flush_interval=3600)
+    other = SqliteBackend(path, flush_interval=3600)
+    try:
+        use_backend(mine)
+        scheduler = report_scheduler.ReportScheduler()
+        scheduler.rebuild()
+        assert scheduler.due(TODAY) == []
+
+        other.set("report_freq", "F1", "weekly")
+        other.flush()
+        scheduler.refresh()
+        assert scheduler.due(TODAY) == ["F1"]
+
+        # nothing changed elsewhere, or only chat state: no rebuild
+        heap = scheduler._heap
+        scheduler.refresh()
+        other.set("phone_to_farmer", "+409", "F9")
+        other.flush()
+        scheduler.refresh()
+        assert scheduler._heap is heap
+    finally:
+        mine.close()
+        other.close()
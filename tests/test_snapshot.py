@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+from app.data_loader.data_manager import DATA_DIR, load_indices
+from app.data_loader.repository import DataRepository
+from app.data_loader.snapshot import Snapshot, build_snapshot, write_snapshot
+from app.data_loader.timeseries import IndicesStore, ParcelTimeSeries
+
+
+@pytest.fixture(scope="module")
+def data_snapshot(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("snapshot") / "snapshot.bin")
+    build_snapshot(DATA_DIR, path)
+    return Snapshot(path)
+
+
+def load(name):
+    with open(os.path.join(DATA_DIR, name)) as fh:
+        return json.load(fh)
+
+
+def test_records_round_trip(data_snapshot):
+    repo = data_snapshot.repository()
+    assert list(repo.farmers) == load("farmers.json")
+    assert list(repo.parcels) == load("parcels.json")
+    assert repo.parcels[-1] == load("parcels.json")[-1]
+
+
+def test_lookups_match_the_json_repository(data_snapshot):
+    farmers, parcels = load("farmers.json"), load("parcels.json")
+    expected = DataRepository(farmers, parcels)
+    repo = data_snapshot.repository()
+
+    for f in farmers:
+        assert repo.get_farmer(f["id"]) == expected.get_farmer(f["id"])
+        assert repo.get_farmer_by_username(f["username"].upper()) == expected.get_farmer_by_username(f["username"])
+        assert repo.get_parcels_for_farmer(f["id"]) == expected.get_parcels_for_farmer(f["id"])
+    for p in parcels:
+        assert repo.get_parcel(p["id"]) == p
+    for missing in ("", "F0", "P999", "zzz"):
+        assert repo.get_farmer(missing) is None
+        assert repo.get_parcel(missing) is None
+        assert repo.get_parcels_for_farmer(missing) == []
+
+
+def test_unknown_fields_and_types_are_kept(tmp_path):
+    farmers = [
+        {"id": "F2", "username": "Șerban", "name": "Șerban Ion", "phone": None, "tier": "gold"},
+        {"id": "F1", "username": "ana", "name": "Ana", "phone": "+401", "tags": ["bio"]},
+    ]
+    parcels = [
+        {"id": "P2", "farmer_id": "F1", "name": "B", "area_ha": 3, "crop": "Maize", "soil": {"clay": 0.4}},
+        {"id": "P1", "farmer_id": "F2", "name": "A", "area_ha": 1.5, "crop": "Wheat"},
+        {"id": "P3", "farmer_id": "F1", "name": "C", "area_ha": 2, "crop": "Rye"},
+    ]
+    path = str(tmp_path / "snapshot.bin")
+    write_snapshot(path, farmers, parcels, IndicesStore())
+    repo = Snapshot(path).repository()
+
+    assert repo.get_farmer("F2") == farmers[0]
+    assert repo.get_farmer_by_username("șerban") == farmers[0]
+    parcel = repo.get_parcel("P2")
+    assert parcel == parcels[0] and isinstance(parcel["area_ha"], int)
+    # file order inside one farmer
+    assert [p["id"] for p in repo.get_parcels_for_farmer("F1")] == ["P2", "P3"]
+    # callers get their own copy
+    repo.get_parcel("P2")["name"] = "changed"
+    assert repo.get_parcel("P2")["name"] == "B"
+
+
+def test_indices(data_snapshot):
+    expected = load_indices(os.path.join(DATA_DIR, "parcel_indices.json"))
+    indices = data_snapshot.indices()
+    assert len(indices) == len(expected)
+    assert list(indices) == list(expected)
+    for parcel_id, series in expected.items():
+        assert indices[parcel_id].to_records() == series.to_records()
+    assert "P999" not in indices and indices.get("P999") is None
+
+    indices.put("P999", ParcelTimeSeries.from_records([{"date": "2025-01-01", "ndvi": 0.5}]))
+    indices.upsert(next(iter(expected)), {"date": "2030-01-01", "ndvi": 0.1})
+    assert len(indices) == len(expected) + 1
+    assert list(indices)[-1] == "P999"
+
+
+def test_old_snapshot_is_refused(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    path.write_bytes(b"FASNAP01" + b"\1\0\0\0" + b"\0" * 200)
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+
+
+def test_reload_from_snapshot_keeps_ingested_observations(tmp_path, monkeypatch):
+    from app.data_loader import data_manager
+    from app.services.ingestion_service import IngestBatch
+
+    for name in ("farmers.json", "parcels.json", "parcel_indices.json"):
+        (tmp_path / name).write_text(open(os.path.join(DATA_DIR, name)).read())
+    snapshot_path = str(tmp_path / "snapshot.bin")
+    monkeypatch.setattr(data_manager, "DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("DATA_SNAPSHOT", snapshot_path)
+    try:
+        build_snapshot(str(tmp_path), snapshot_path)
+        data_manager.load_data()
+        assert data_manager.LOAD_STATS["source"] == "snapshot"
+
+        batch = IngestBatch()
+        batch.feed_chunk(b'{"parcel_id": "P1", "date": "2031-01-01", "ndvi": 0.42}\n')
+        assert batch.finish()["inserted"] == 1
+        records = data_manager.LOAD_STATS["index_records"] + 1
+
+        # farmers change, the snapshot is rebuilt from the JSON files, parcel_indices.json does not change
+        farmers = load("farmers.json")
+        farmers[0]["name"] = "Renamed"
+        (tmp_path / "farmers.json").write_text(json.dumps(farmers))
+        build_snapshot(str(tmp_path), snapshot_path)
+        assert data_manager.reload_if_changed()
+
+        assert data_manager.LOAD_STATS["source"] == "snapshot"
+        assert data_manager.REPO.get_farmer(farmers[0]["id"])["name"] == "Renamed"
+        assert data_manager.PARCELS_INDICES.latest("P1")["date"] == "2031-01-01"
+        assert data_manager.LOAD_STATS["index_records"] == records
+    finally:
+        monkeypatch.undo()
+        data_manager.load_data()
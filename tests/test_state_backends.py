@@ -0,0 +1,138 @@
+import threading
+
+from app.storage.backends import SqliteBackend
+
+
+def test_claim_keeps_the_first_value(backend):
+    assert backend.claim("farmer_phone", "F3", "+401") == "+401"
+    assert backend.claim("farmer_phone", "F3", "+402") == "+401"
+    assert backend.get("farmer_phone", "F3") == "+401"
+    assert backend.count("farmer_phone") == 1
+
+
+def test_claim_from_many_threads_has_one_winner(backend):
+    results = []
+    barrier = threading.Barrier(8)
+
+    def claim(i):
+        barrier.wait()
+        results.append(backend.claim("farmer_phone", "F3", f"+40{i}"))
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(results)) == 1
+
+
+def test_claim_across_connections(tmp_path):
+    path = str(tmp_path / "state.db")
+    a, b = SqliteBackend(path), SqliteBackend(path)
+    try:
+        assert a.claim("farmer_phone", "F3", "+401") == "+401"
+        assert b.claim("farmer_phone", "F3", "+402") == "+401"
+    finally:
+        a.close()
+        b.close()
+
+
+def test_linking_writes_are_visible_to_other_workers_at_once(tmp_path):
+    path = str(tmp_path / "state.db")
+    # a flush interval far longer than the test: only a write-through is seen
+    a = SqliteBackend(path, flush_interval=3600)
+    b = SqliteBackend(path, flush_interval=3600)
+    try:
+        assert b.get("phone_to_farmer", "+401") is None
+        a.set("phone_to_farmer", "+401", "F3")
+        a.set("pending_linking", "+402", "1")
+        assert b.get("phone_to_farmer", "+401") == "F3"
+        assert b.contains("pending_linking", "+402")
+        a.delete("pending_linking", "+402")
+        assert not b.contains("pending_linking", "+402")
+    finally:
+        a.close()
+        b.close()
+
+
+def test_batched_writes_are_committed_on_flush(tmp_path):
+    path = str(tmp_path / "state.db")
+    a = SqliteBackend(path, flush_interval=3600)
+    b = SqliteBackend(path, flush_interval=3600)
+    try:
+        a.set("report_freq", "F1", "daily")
+        a.flush()
+        assert b.get("report_freq", "F1") == "daily"
+    finally:
+        a.close()
+        b.close()
+
+
+def test_state_survives_a_restart(tmp_path):
+    path = str(tmp_path / "state.db")
+    a = SqliteBackend(path)
+    a.claim("farmer_phone", "F3", "+401")
+    a.set("report_freq", "F3", "weekly")
+    a.close()
+
+    b = SqliteBackend(path)
+    try:
+        assert b.claim("farmer_phone", "F3", "+402") == "+401"
+        assert b.get("report_freq", "F3") == "weekly"
+        assert b.value_counts("report_freq") == {"weekly": 1}
+    finally:
+        b.close()
+
+
+def test_scan_and_counts_follow_writes(backend):
+    for i in range(10):
+        backend.set("report_freq", f"F{i:02d}", "daily" if i % 2 else "weekly")
+    backend.delete("report_freq", "F03")
+    backend.set("report_freq", "F04", "monthly")
+
+    rows, cursor = backend.scan("report_freq", limit=4)
+    assert [k for k, _ in rows] == ["F00", "F01", "F02", "F04"]
+    rows, cursor = backend.scan("report_freq", after=cursor, limit=10)
+    assert [k for k, _ in rows] == ["F05", "F06", "F07", "F08", "F09"]
+    assert cursor is None
+    assert backend.value_counts("report_freq") == {"daily": 4, "weekly": 4, "monthly": 1}
+    assert backend.keys_for("report_freq", "monthly") == ["F04"]
+
+
+def test_data_version_moves_only_for_other_writers_of_the_namespace(tmp_path):
+    path = str(tmp_path / "state.db")
+    mine = SqliteBackend(path, flush_interval=3600)
+    other = SqliteBackend(path, flush_interval=3600)
+    try:
+        start = mine.data_version("report_freq", "last_report_sent")
+
+        # chat traffic and our own report writes do not count
+        other.set("phone_to_farmer", "+401", "F1")
+        other.set("pending_linking", "+402", "1")
+        mine.set("report_freq", "F1", "daily")
+        mine.flush()
+        assert mine.data_version("report_freq", "last_report_sent") == start
+
+        other.set("last_report_sent", "F1", "2025-06-02")
+        other.flush()
+        assert mine.data_version("report_freq", "last_report_sent") != start
+    finally:
+        mine.close()
+        other.close()
+
+
+def test_versions_are_added_to_an_older_database(tmp_path):
+    path = str(tmp_path / "state.db")
+    first = SqliteBackend(path)
+    for statement in ("DROP TRIGGER state_version_insert", "DROP TRIGGER state_version_delete",
+                      "DROP TRIGGER state_version_update", "DROP TABLE state_versions"):
+        first._conn.execute(statement)
+    first.close()
+
+    again = SqliteBackend(path)
+    try:
+        start = again.data_version("report_freq")
+        again._conn.execute("INSERT INTO state VALUES ('report_freq', 'F1', 'daily')")
+        assert again.data_version("report_freq") != start
+    finally:
+        again.close()